@@ -0,0 +1,134 @@
+"""
+Activity Log Writer
+Buffers ActivityLog entries and writes them in batches instead of one INSERT
+per logged event.
+
+Entries are released to the buffer only when the surrounding transaction
+commits (via transaction.on_commit), so work that rolls back never leaves a
+log row behind, while entries from the parts that do commit are kept even if
+an inner savepoint rolled back. Inside a batch scope (every request, through
+ActivityLogBatchMiddleware) the buffer is written with a single bulk_create
+when the scope ends; outside a scope each entry is written as soon as it is
+released. With ACTIVITY_LOG_BACKGROUND = True the writes are handed to a
+background thread so they leave the request path entirely.
+"""
+import atexit
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+_state = Local()
+
+
+def log_activity(actionType, description, user=None):
+    """Record an activity log entry once the current transaction commits"""
+    entry = ActivityLog(user=user, actionType=actionType, description=description, createdAt=timezone.now())
+    transaction.on_commit(lambda: _release(entry))
+    return entry
+
+
+@contextmanager
+def activity_log_batch():
+    """Collect every entry released inside the block and write them together"""
+    depth = getattr(_state, 'depth', 0)
+    if depth == 0:
+        _state.buffer = []
+    _state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if _state.depth == 0:
+            entries, _state.buffer = _state.buffer, []
+            flush(entries)
+
+
+def flush(entries):
+    """Write a batch of entries, in the background if configured"""
+    if not entries:
+        return
+    if getattr(settings, 'ACTIVITY_LOG_BACKGROUND', False):
+        _get_flusher().submit(entries)
+    else:
+        _write(entries)
+
+
+def _release(entry):
+    if getattr(_state, 'depth', 0):
+        _state.buffer.append(entry)
+        if len(_state.buffer) >= _batch_size():
+            entries, _state.buffer = _state.buffer, []
+            flush(entries)
+    else:
+        flush([entry])
+
+
+def _batch_size():
+    return getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 500)
+
+
+def _write(entries):
+    try:
+        ActivityLog.objects.bulk_create(entries, batch_size=_batch_size())
+    except Exception as e:
+        # Audit logging must never break the operation being logged
+        logger.error(f"Failed to write {len(entries)} activity log entries: {str(e)}")
+
+
+class BackgroundFlusher:
+    """Daemon thread that writes queued batches of log entries"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='activity-log-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.drain)
+
+    def submit(self, entries):
+        self._queue.put(entries)
+
+    def drain(self, timeout=5):
+        """Block until every queued batch has been written (used on shutdown)"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            entries = self._queue.get()
+            if entries is None:
+                return
+            # Merge whatever else is already waiting into the same INSERT
+            while len(entries) < _batch_size():
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self._queue.put(None)
+                    break
+                entries.extend(more)
+
+            close_old_connections()
+            _write(entries)
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _get_flusher():
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = BackgroundFlusher()
+    return _flusher
@@ -1,8 +1,10 @@
 from django.contrib import admin
 from .models import (
     User, UserProfile, Category, SubCategory, Source, Product, Inventory, NewStock,
-    Customer, Invoice, Purchase, Transaction, ActivityLog
+    Customer, Invoice, Purchase, Transaction, ActivityLog, StockMovement, StockSnapshot,
+    DailySalesSummary, DailyProductSales
 )
+from .stock_ledger import record_movement
 
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
@@ -72,6 +74,15 @@ class InventoryAdmin(admin.ModelAdmin):
     search_fields = ('product__productName', 'location')
     autocomplete_fields = ('product',)
 
+    def save_model(self, request, obj, form, change):
+        # New rows get their opening balance from the record_opening_stock signal
+        previous_quantity = obj.get_previous_value('quantity') if change else None
+        super().save_model(request, obj, form, change)
+        if previous_quantity is not None and obj.quantity != previous_quantity:
+            record_movement(
+                obj, 'Adjustment', obj.quantity - previous_quantity, reference='Admin adjustment', user=request.user
+            )
+
 # ------------------- NewStock -------------------
 @admin.register(NewStock)
 class NewStockAdmin(admin.ModelAdmin):
@@ -81,6 +92,53 @@ class NewStockAdmin(admin.ModelAdmin):
     autocomplete_fields = ('inventory', 'supplier', 'addedByUser')
     date_hierarchy = 'receivedDate'
 
+# ------------------- StockMovement -------------------
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('inventory', 'movementType', 'quantity', 'reference', 'user', 'createdAt')
+    list_filter = ('movementType',)
+    search_fields = ('inventory__product__productName', 'reference')
+    date_hierarchy = 'createdAt'
+
+    # The ledger is append-only and written only by stock operations
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# ------------------- StockSnapshot -------------------
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('inventory', 'quantity', 'takenAt')
+    date_hierarchy = 'takenAt'
+
+# ------------------- Daily sales summaries -------------------
+# Maintained by api/sales_summary.py; repair with `manage.py rebuild_sales_summary`
+class ReadOnlySummaryAdmin(admin.ModelAdmin):
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySalesSummary)
+class DailySalesSummaryAdmin(ReadOnlySummaryAdmin):
+    list_display = ('date', 'paymentMethod', 'invoiceCount', 'revenue', 'tax', 'discount')
+    list_filter = ('paymentMethod',)
+
+
+@admin.register(DailyProductSales)
+class DailyProductSalesAdmin(ReadOnlySummaryAdmin):
+    list_display = ('date', 'product', 'quantity', 'revenue')
+    search_fields = ('product__productName',)
+
 # ------------------- Customer -------------------
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
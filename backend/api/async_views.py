@@ -0,0 +1,275 @@
+"""
+Async KHQR payment views
+Native async versions of InvoiceViewSet.generate_khqr, check_payment and
+batch_check_payments. Under ASGI a request waiting on Bakong only holds a
+coroutine, not a worker thread, so one process can keep hundreds of payment
+checks in flight. Enabled with KHQR_ASYNC_VIEWS (see api/urls.py); the
+responses match the DRF actions they replace.
+"""
+import asyncio
+import functools
+import logging
+import time
+import traceback
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authtoken.models import Token
+
+from .khqr_payments import (
+    BAKONG_BATCH_SIZE, acheck_invoices, chunked, mark_invoices_paid, payment_status,
+    pending_khqr_invoices
+)
+from .khqr_generation import KHQR_CURRENCY, astore_invoice_qr, wait_for_invoice_qr
+from .khqr_service import get_khqr_service
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+
+async def authenticate(request):
+    """Async equivalent of DRF TokenAuthentication (`Authorization: Token <key>`)"""
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+def token_required(view):
+    """Reject unauthenticated requests the way IsAuthenticated does"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def get_invoice(pk):
+    try:
+        return await Invoice.objects.aget(pk=pk)
+    except Invoice.DoesNotExist:
+        return None
+
+
+def not_found():
+    return JsonResponse({'detail': 'No Invoice matches the given query.'}, status=404)
+
+
+@csrf_exempt
+@require_POST
+@token_required
+async def generate_khqr(request, pk):
+    """
+    Generate KHQR QR code for an existing invoice
+    POST /api/invoices/{id}/generate_khqr/
+    """
+    invoice = await get_invoice(pk)
+    if invoice is None:
+        return not_found()
+
+    if invoice.status != 'Pending':
+        return JsonResponse({'error': 'QR code can only be generated for pending invoices'}, status=400)
+
+    # The QR code may still be generating in the background since the invoice was created
+    if not (invoice.khqrCodeString and invoice.khqrMd5):
+        try:
+            await sync_to_async(wait_for_invoice_qr, thread_sensitive=False)(
+                invoice.invoiceId, timeout=settings.KHQR_QR_WAIT_TIMEOUT
+            )
+        except TimeoutError:
+            response = JsonResponse(
+                {'success': False, 'pending': True, 'message': 'QR code is still being generated, retry shortly'},
+                status=202
+            )
+            response['Retry-After'] = '1'
+            return response
+        await invoice.arefresh_from_db(fields=['khqrCodeString', 'khqrMd5', 'khqrDeeplink'])
+
+    # If QR code already exists, return it instead of regenerating
+    if invoice.khqrCodeString and invoice.khqrMd5:
+        return JsonResponse({
+            'success': True,
+            'qr_string': invoice.khqrCodeString,
+            'md5_hash': invoice.khqrMd5,
+            'deeplink': invoice.khqrDeeplink or '',
+            'amount': float(invoice.grandTotal),
+            'invoice_id': invoice.invoiceId
+        })
+
+    try:
+        khqr_service = get_khqr_service()
+
+        if not khqr_service.bakong_account_id:
+            logger.error("KHQR_BAKONG_ACCOUNT_ID is not configured")
+            return JsonResponse(
+                {'error': 'KHQR payment is not configured. Please set KHQR_BAKONG_ACCOUNT_ID in settings.'},
+                status=500
+            )
+
+        # QR generation is local CPU work in bakong_khqr; keep it off the event loop
+        qr_data = await sync_to_async(khqr_service.generate_qr_code, thread_sensitive=False)(
+            invoice_id=invoice.invoiceId,
+            amount=invoice.grandTotal,
+            currency=KHQR_CURRENCY
+        )
+        if not qr_data:
+            logger.error(f"Failed to generate QR code for invoice #{invoice.invoiceId}")
+            return JsonResponse({'error': 'Failed to generate QR code. Please check server logs.'}, status=500)
+
+        deeplink = await khqr_service.agenerate_deeplink(qr_data['qr_string'])
+
+        # Keep the QR code stored first, by the background job or another worker
+        await astore_invoice_qr(invoice.invoiceId, qr_data, deeplink)
+        await invoice.arefresh_from_db(fields=['status', 'paymentMethod', 'khqrCodeString', 'khqrMd5', 'khqrDeeplink'])
+        if not invoice.khqrMd5:
+            return JsonResponse({'error': 'QR code can only be generated for pending invoices'}, status=400)
+
+        return JsonResponse({
+            'success': True,
+            'qr_string': invoice.khqrCodeString,
+            'md5_hash': invoice.khqrMd5,
+            'deeplink': invoice.khqrDeeplink or '',
+            'amount': float(invoice.grandTotal),
+            'invoice_id': invoice.invoiceId
+        })
+    except Exception as e:
+        logger.error(f"Error generating KHQR for invoice #{invoice.invoiceId}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JsonResponse({'error': f'Failed to generate QR code: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@token_required
+async def check_payment(request, pk):
+    """
+    Check KHQR payment status for an invoice
+    POST /api/invoices/{id}/check_payment/
+    """
+    invoice = await get_invoice(pk)
+    if invoice is None:
+        return not_found()
+
+    if not invoice.khqrMd5:
+        return JsonResponse({'error': 'No KHQR payment associated with this invoice'}, status=400)
+
+    # The poll_khqr_payments worker confirms payments; just report local state
+    if settings.KHQR_BACKGROUND_POLLING:
+        return JsonResponse(payment_status(invoice))
+
+    try:
+        khqr_service = get_khqr_service()
+
+        if not await khqr_service.aget_access_token():
+            logger.warning("KHQR API token not available")
+            return JsonResponse(
+                {
+                    'error': 'KHQR payment verification unavailable',
+                    'detail': 'KHQR API token is not configured. Please check KHQR_TOKEN in .env file.',
+                    'paid': False
+                },
+                status=503
+            )
+
+        transaction_data = await khqr_service.acheck_transaction_by_md5(invoice.khqrMd5)
+
+        # Never save the instance read before the Bakong call: a cancellation or
+        # confirmation that happened meanwhile would be reverted
+        if transaction_data:
+            # Re-checks Pending under a row lock, so a payment confirmed meanwhile isn't recorded twice
+            if await sync_to_async(mark_invoices_paid)({invoice: transaction_data}, [invoice.pk]):
+                logger.info(f"Payment confirmed for invoice #{invoice.invoiceId}")
+        else:
+            await Invoice.objects.filter(pk=invoice.pk).aupdate(khqrLastCheckedAt=timezone.now())
+        await invoice.arefresh_from_db()
+
+        return JsonResponse(payment_status(invoice))
+    except Exception as e:
+        logger.error(f"Error checking payment: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        return JsonResponse(
+            {'error': 'Failed to check payment status', 'detail': str(e), 'paid': False},
+            status=500
+        )
+
+
+@csrf_exempt
+@require_POST
+@token_required
+async def batch_check_payments(request):
+    """
+    Batch check payment status for multiple pending KHQR invoices
+    POST /api/invoices/batch_check_payments/
+
+    Unlike the sync action the chunks are checked concurrently.
+    """
+    pending_invoices = [
+        invoice async for invoice in
+        pending_khqr_invoices().order_by('invoiceId').only('invoiceId', 'khqrMd5', 'createdByUser', 'status')
+    ]
+
+    if not pending_invoices:
+        return JsonResponse({
+            'success': True,
+            'message': 'No pending KHQR invoices to check',
+            'checked': 0,
+            'paid': 0
+        })
+
+    khqr_service = get_khqr_service()
+
+    async def check_chunk(index, chunk):
+        started = time.monotonic()
+        chunk_paid = await acheck_invoices(chunk, khqr_service)
+        return chunk, chunk_paid, {
+            'chunk': index,
+            'size': len(chunk),
+            'duration_ms': round((time.monotonic() - started) * 1000, 1),
+            'ok': chunk_paid is not None,
+            'paid': len(chunk_paid or {})
+        }
+
+    try:
+        results = await asyncio.gather(*(
+            check_chunk(index, chunk) for index, chunk in enumerate(chunked(pending_invoices, BAKONG_BATCH_SIZE))
+        ))
+
+        paid = {}
+        checked_ids = []
+        for chunk, chunk_paid, chunk_report in results:
+            if chunk_paid is None:
+                logger.error(f"Batch check failed for chunk {chunk_report['chunk']} ({len(chunk)} invoices)")
+                continue
+            paid.update(chunk_paid)
+            checked_ids.extend(invoice.invoiceId for invoice in chunk)
+        chunks = [chunk_report for _, _, chunk_report in results]
+
+        if not checked_ids:
+            return JsonResponse({'error': 'Batch check failed', 'chunks': chunks}, status=500)
+
+        started = time.monotonic()
+        updated_invoices = await sync_to_async(mark_invoices_paid)(paid, checked_ids, source='KHQR batch check')
+        persist_ms = round((time.monotonic() - started) * 1000, 1)
+
+        return JsonResponse({
+            'success': True,
+            'checked': len(checked_ids),
+            'paid': len(updated_invoices),
+            'updated_invoices': updated_invoices,
+            'chunks': chunks,
+            'persist_ms': persist_ms
+        })
+    except Exception as e:
+        logger.error(f"Error in batch payment check: {str(e)}")
+        return JsonResponse({'error': f'Batch check failed: {str(e)}'}, status=500)
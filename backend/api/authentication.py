@@ -4,7 +4,8 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.permissions import AllowAny
-from .models import ActivityLog, User
+from .activity_log import log_activity
+from .models import User
 from .serializers import UserSerializer
 import logging
 
@@ -20,7 +21,7 @@ class LoginView(APIView):
         token, created = Token.objects.get_or_create(user=user)
         
         # Log successful login
-        ActivityLog.objects.create(
+        log_activity(
             user=user,
             actionType='USER_LOGIN',
             description=f"User {user.username} logged in successfully"
@@ -75,7 +76,7 @@ class RegisterView(APIView):
             token, created = Token.objects.get_or_create(user=user)
             
             # Log successful registration
-            ActivityLog.objects.create(
+            log_activity(
                 user=user,
                 actionType='USER_CREATED',
                 description=f"New user {user.username} registered successfully"
@@ -0,0 +1,147 @@
+"""
+Catalog Cache
+Read-through cache for the catalog viewsets (products, categories,
+subcategories, sources): every terminal reads them constantly and they
+rarely change.
+
+Cached responses are keyed by a per-model version counter, so invalidating
+a model is one cache increment (done after commit by the signal receivers
+in api/signals.py) and old entries simply expire. Keys also include the
+user's role, because staff see products without costPrice, and the full
+query string.
+
+When a version is bumped, the first request rebuilds the response while
+concurrent requests for the same key wait for it instead of all hitting the
+database at once.
+
+Writes that skip model signals (bulk_create, bulk_update, queryset.update)
+must call invalidate_catalog() themselves.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+LOCK_POLL_INTERVAL = 0.05  # Seconds between checks while another request builds the response
+
+
+def version_key(model):
+    return f'catalog:version:{model._meta.label_lower}'
+
+
+def catalog_version(model):
+    """Current cache version of a model's responses"""
+    key = version_key(model)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1, so a version lost to eviction
+        # never matches entries cached before it was lost
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_catalog_version(*models):
+    for model in models:
+        key = version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns() // 1000, timeout=None)
+
+
+def invalidate_catalog(*models):
+    """Invalidate cached responses of the models once the current transaction commits"""
+    # Bumping before commit would let a concurrent request cache the old rows
+    # under the new version
+    transaction.on_commit(lambda: bump_catalog_version(*models))
+
+
+def get_or_build(key, build, timeout=None):
+    """
+    Cached value of `key`, building and storing it on a miss. Only one caller
+    builds a missing key at a time; the others wait up to
+    CATALOG_CACHE_LOCK_TIMEOUT seconds for it and then build it themselves.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value, True
+
+    lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=lock_timeout):
+        try:
+            value = build()
+            if value is not None:
+                cache.set(key, value, timeout=timeout or settings.CATALOG_CACHE_TIMEOUT)
+            return value, False
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value, True
+        if cache.get(lock_key) is None:
+            break
+    logger.warning(f"Gave up waiting for {key} to be cached; building it again")
+    return build(), False
+
+
+class CachedCatalogMixin:
+    """
+    Serve list and retrieve from the catalog cache. `cache_models` lists the
+    models whose changes invalidate the viewset's responses (default: its
+    queryset's model).
+    """
+    cache_models = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_models(self):
+        return self.cache_models or [self.get_queryset().model]
+
+    def get_change_version(self):
+        if not settings.CATALOG_CACHE_ENABLED:
+            return None  # Versions live in the cache; without it they aren't shared, so fall back to modified_field
+        return '.'.join(str(catalog_version(model)) for model in self.get_cache_models())
+
+    def get_cache_key(self, request):
+        versions = self.get_change_version()
+        role = getattr(request.user, 'role', '') or 'none'
+        path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()  # Keep keys short
+        return f'catalog:response:{versions}:{role}:{path}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # Only the JSON API is cached, not the browsable API
+        if not settings.CATALOG_CACHE_ENABLED or not isinstance(request.accepted_renderer, JSONRenderer):
+            return handler(request, *args, **kwargs)
+
+        responses = [None]
+
+        def build():
+            response = handler(request, *args, **kwargs)
+            # Cache successful responses only; errors go back to the client uncached
+            responses[0] = response
+            return response.data if response.status_code == 200 else None
+
+        data, hit = get_or_build(self.get_cache_key(request), build)
+        if responses[0] is not None and responses[0].status_code != 200:
+            return responses[0]
+
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
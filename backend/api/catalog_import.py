@@ -0,0 +1,436 @@
+"""
+Catalog Import
+Bulk product and inventory import from CSV or XLSX files (a supplier
+catalog), used by POST /api/products/import/ and `manage.py import_catalog`.
+
+The file is read row by row and handled in batches: rows are validated
+against SKU, subcategory and source maps loaded once up front, then each
+batch is written in its own transaction: products are upserted by skuCode
+with one bulk_create, inventory rows (matched by product and location)
+created with one bulk_create and updated with one bulk_update. Per-row signals
+are skipped, so the import itself writes what they would have: one
+aggregated activity log entry, stock ledger movements for quantity changes,
+catalog cache invalidation, and updatedAt for delta sync.
+
+Columns are model field names. Only the columns present in the file are
+written, so a price list with just skuCode and salePrice updates prices and
+leaves everything else alone. New products need productName, unit and
+subcategory (id or name); source is an id or name too. Inventory is
+imported when the file has a quantity column.
+
+XLSX files need openpyxl (`pip install openpyxl`).
+"""
+import codecs
+import csv
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .activity_log import log_activity
+from .catalog_cache import invalidate_catalog
+from .models import STATUS_CHOICES, Inventory, Product, Source, StockMovement, SubCategory
+from .stock_ledger import record_movements
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000  # Row errors returned to the caller; the rest are only counted
+
+PRODUCT_TEXT_FIELDS = ('productName', 'description', 'image', 'unit')
+OPTIONAL_TEXT_FIELDS = ('description', 'image')
+PRODUCT_DECIMAL_FIELDS = ('costPrice', 'salePrice', 'discount')
+PRODUCT_COLUMNS = ('skuCode', *PRODUCT_TEXT_FIELDS, *PRODUCT_DECIMAL_FIELDS, 'status', 'subcategory', 'source')
+INVENTORY_COLUMNS = ('quantity', 'reorderLevel', 'location')
+REQUIRED_FOR_NEW = ('productName', 'unit', 'subcategory')
+STATUSES = {value for value, _ in STATUS_CHOICES}
+FORMATS = ('csv', 'xlsx')
+
+
+class ImportFileError(Exception):
+    """The file as a whole can't be imported (unknown format, bad header, unreadable content)"""
+
+
+def detect_format(name):
+    fmt = Path(name or '').suffix.lower().lstrip('.')
+    if fmt not in FORMATS:
+        raise ImportFileError(f"Unsupported file type '{fmt or name}', use .csv or .xlsx")
+    return fmt
+
+
+def read_rows(file, fmt):
+    """Yield each row of a binary CSV or XLSX file as a list of cells, header first"""
+    if fmt == 'csv':
+        # Django's File iterates lines with their endings, so quoted newlines still parse
+        reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+        try:
+            yield from reader
+        except UnicodeDecodeError:
+            raise ImportFileError(
+                f"Line {reader.line_num + 1} is not UTF-8 text; save the file as CSV UTF-8 and import it again"
+            )
+        except csv.Error as e:
+            raise ImportFileError(f"Line {reader.line_num}: {str(e)}")
+        return
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("XLSX import needs openpyxl (pip install openpyxl)")
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)  # read_only streams the sheet
+    except Exception as e:  # BadZipFile, KeyError or openpyxl's own errors for a damaged file
+        raise ImportFileError(f"Not a readable XLSX file: {str(e)}")
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if cell is None else cell for cell in row]
+    except Exception as e:
+        raise ImportFileError(f"Not a readable XLSX file: {str(e)}")
+    finally:
+        workbook.close()
+
+
+class CatalogImporter:
+    """
+    Import rows into Product and Inventory. Call run() with an iterator of
+    rows (header first); `progress` is called with each batch's report.
+    """
+
+    def __init__(self, user=None, location=None, batch_size=BATCH_SIZE, progress=None):
+        self.user = user
+        self.default_location = location
+        self.batch_size = batch_size
+        self.progress = progress
+        self.totals = {
+            'rows': 0, 'created': 0, 'updated': 0, 'inventoryCreated': 0, 'inventoryUpdated': 0, 'rejected': 0
+        }
+        self.errors = []
+        self.batches = 0
+        self._reported_rejects = 0
+
+    def load_maps(self):
+        """SKU, subcategory and source lookups for the whole file, one query each"""
+        self.skus = dict(Product.objects.values_list('skuCode', 'productId').iterator(chunk_size=10000))
+        self.subcategories = self._lookup(SubCategory)
+        self.sources = self._lookup(Source)
+
+    def _lookup(self, model):
+        """Map of id and lower-cased name -> pk; names shared by several rows map to None (ambiguous)"""
+        lookup = {}
+        names = {}
+        for pk, name in model.objects.values_list('pk', Lower('name')):
+            lookup[str(pk)] = pk
+            names[name] = None if name in names else pk
+        return {**names, **lookup}
+
+    def run(self, rows, filename=''):
+        rows = iter(rows)
+        header = [str(cell).strip() for cell in next(rows, [])]
+        self.columns = self._check_header(header)
+        self.load_maps()
+
+        batch = []
+        seen = set()
+        try:
+            for number, cells in enumerate(rows, start=2):  # Row 1 is the header
+                record = dict(zip(header, cells))
+                if not any(str(value).strip() for value in record.values()):
+                    continue  # Blank line
+                self.totals['rows'] += 1
+                try:
+                    batch.append(self._parse(number, record, seen))
+                except ValueError as e:
+                    self._reject(number, e.args[0])
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch)
+                    batch = []
+        except ImportFileError as e:
+            # The file broke off partway; batches before the error are committed
+            if self.batches:
+                imported = self.totals['created'] + self.totals['updated']
+                raise ImportFileError(f"{str(e)} ({imported} products of earlier rows were already imported)")
+            raise
+        if batch:
+            self._import_batch(batch)
+
+        totals = self.totals
+        name = f" {filename}" if filename else ''
+        log_activity(
+            user=self.user,
+            actionType='IMPORT_CATALOG',
+            description=(
+                f"Imported catalog{name}: {totals['created']} products created, {totals['updated']} updated, "
+                f"{totals['inventoryCreated']} inventory rows created, {totals['inventoryUpdated']} updated, "
+                f"{totals['rejected']} rows rejected"
+            )
+        )
+        return {**totals, 'errors': self.errors}
+
+    def _check_header(self, header):
+        if 'skuCode' not in header:
+            raise ImportFileError("The header must have a skuCode column")
+        unknown = [name for name in header if name and name not in PRODUCT_COLUMNS + INVENTORY_COLUMNS]
+        if unknown:
+            raise ImportFileError(f"Unknown columns: {', '.join(unknown)}")
+        named = [name for name in header if name]
+        if len(set(named)) != len(named):
+            raise ImportFileError("Duplicate column names in the header")
+        columns = [name for name in header if name in PRODUCT_COLUMNS]
+        self.with_inventory = 'quantity' in header
+        if self.with_inventory and 'location' not in header and not self.default_location:
+            raise ImportFileError("Inventory import needs a location column or a default location")
+        return columns
+
+    def _reject(self, number, errors):
+        self.totals['rejected'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def _parse(self, number, record, seen):
+        """(row number, SKU, product values, inventory values) of a row; raises ValueError({column: message})"""
+        errors = {}
+        values = {}
+        sku = _text(record.get('skuCode', ''))
+        if not sku:
+            raise ValueError({'skuCode': 'Required'})
+        try:
+            _check_limits(Product, 'skuCode', sku)
+        except ValueError as e:
+            raise ValueError({'skuCode': e.args[0]})
+        if sku in seen:
+            raise ValueError({'skuCode': 'Duplicate SKU in this file'})
+        seen.add(sku)
+
+        for column in self.columns:
+            value = record.get(column, '')
+            value = value.strip() if isinstance(value, str) else value
+            try:
+                if column in PRODUCT_TEXT_FIELDS:
+                    values[column] = _check_limits(Product, column, _text(value))
+                    if not values[column] and column not in OPTIONAL_TEXT_FIELDS:
+                        raise ValueError('Required')
+                elif column in PRODUCT_DECIMAL_FIELDS:
+                    values[column] = _check_limits(Product, column, _decimal(value))
+                elif column == 'status':
+                    if value not in STATUSES:
+                        raise ValueError(f"Must be one of {', '.join(sorted(STATUSES))}")
+                    values[column] = value
+                elif column == 'subcategory':
+                    values['subcategory_id'] = _resolve(self.subcategories, value, required=True)
+                elif column == 'source':
+                    values['source_id'] = _resolve(self.sources, value, required=False)
+            except ValueError as e:
+                errors[column] = e.args[0]
+        values.pop('skuCode', None)
+
+        if sku not in self.skus:
+            for column in REQUIRED_FOR_NEW:
+                if column not in self.columns:
+                    errors.setdefault(column, 'Required for new products')
+
+        inventory = None
+        if self.with_inventory:
+            inventory = {}
+            for column in ('quantity', 'reorderLevel'):
+                if column not in record:
+                    continue
+                try:
+                    inventory[column] = _check_limits(Inventory, column, _integer(record[column]))
+                except ValueError as e:
+                    errors[column] = e.args[0]
+            inventory['location'] = _text(record.get('location', '')) or self.default_location
+            try:
+                if not inventory['location']:
+                    raise ValueError('Required')
+                _check_limits(Inventory, 'location', inventory['location'])
+            except ValueError as e:
+                errors['location'] = e.args[0]
+
+        if errors:
+            raise ValueError(errors)
+        return number, sku, values, inventory
+
+    def _import_batch(self, batch):
+        report = {'created': 0, 'updated': 0, 'inventoryCreated': 0, 'inventoryUpdated': 0}
+        with transaction.atomic():
+            batch = self._fill_required(batch)
+            products = [Product(skuCode=sku, **values) for _, sku, values, _ in batch]
+            for product in products:
+                report['updated' if product.skuCode in self.skus else 'created'] += 1
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=['skuCode'],
+                # Only the file's columns are overwritten; updatedAt for delta sync
+                update_fields=[column for column in self.columns if column != 'skuCode'] + ['updatedAt'],
+            )
+            self._remember_ids(products)
+            if self.with_inventory:
+                self._import_inventory(batch, report)
+            invalidate_catalog(Product)
+
+        for key in ('created', 'updated', 'inventoryCreated', 'inventoryUpdated'):
+            self.totals[key] += report[key]
+        self.batches += 1
+        rejected, self._reported_rejects = self.totals['rejected'] - self._reported_rejects, self.totals['rejected']
+        if self.progress:
+            self.progress({'batch': self.batches, **report, 'rejected': rejected})
+
+    def _fill_required(self, batch):
+        """
+        The upsert inserts before it finds the conflict, so every NOT NULL
+        column needs a value even for existing products; take the ones the
+        file lacks from the current rows (one query per batch)
+        """
+        missing = [Product._meta.get_field(column).attname for column in REQUIRED_FOR_NEW if column not in self.columns]
+        existing = [sku for _, sku, _, _ in batch if sku in self.skus]
+        if not missing or not existing:
+            return batch
+        current = {row.pop('skuCode'): row for row in Product.objects.filter(skuCode__in=existing).values('skuCode', *missing)}
+        filled = []
+        for number, sku, values, inventory in batch:
+            if sku in self.skus:
+                if sku not in current:
+                    self._reject(number, {'skuCode': 'Product was deleted during the import'})
+                    continue
+                values = {**current[sku], **values}
+            filled.append((number, sku, values, inventory))
+        return filled
+
+    def _remember_ids(self, products):
+        missing = [product.skuCode for product in products if product.pk is None]
+        for product in products:
+            if product.pk is not None:
+                self.skus[product.skuCode] = product.pk
+        if missing:
+            # Backends that can't return ids from an upsert
+            self.skus.update(Product.objects.filter(skuCode__in=missing).values_list('skuCode', 'productId'))
+
+    def _import_inventory(self, batch, report):
+        product_ids = [self.skus[sku] for _, sku, _, _ in batch]
+        existing = {}
+        # Locked, so a sale can't change a quantity between reading and overwriting it
+        rows = Inventory.objects.filter(product_id__in=product_ids).select_for_update().order_by('-inventoryId')
+        for row in rows:
+            existing[(row.product_id, row.location)] = row  # Oldest row wins if a location is duplicated
+
+        now = timezone.now()
+        created, updated, movements = [], [], []
+        for _, sku, _, values in batch:
+            product_id = self.skus[sku]
+            row = existing.get((product_id, values['location']))
+            if row is None:
+                created.append(Inventory(
+                    product_id=product_id,
+                    location=values['location'],
+                    quantity=values.get('quantity', 0),
+                    reorderLevel=values.get('reorderLevel', 0),
+                ))
+                continue
+            quantity = values.get('quantity', row.quantity)
+            reorder_level = values.get('reorderLevel', row.reorderLevel)
+            if (quantity, reorder_level) == (row.quantity, row.reorderLevel):
+                continue  # Unchanged rows keep their updatedAt, so delta sync skips them
+            if quantity != row.quantity:
+                movements.append(StockMovement(
+                    inventory=row, movementType='Adjustment', quantity=quantity - row.quantity,
+                    reference='Catalog import', user=self.user
+                ))
+            row.quantity, row.reorderLevel = quantity, reorder_level
+            updated.append(row)
+
+        Inventory.objects.bulk_create(created)
+        update_inventory(updated, now)
+        movements.extend(
+            StockMovement(
+                inventory=row, movementType='Adjustment', quantity=row.quantity, reference='Opening balance', user=self.user
+            )
+            for row in created if row.quantity
+        )
+        record_movements(movements)
+        report['inventoryCreated'] = len(created)
+        report['inventoryUpdated'] = len(updated)
+
+
+def update_inventory(rows, now):
+    """
+    Write quantity and reorderLevel of many inventory rows with one
+    UPDATE ... FROM (VALUES ...) per chunk. QuerySet.bulk_update builds a
+    CASE over every row for each column, which takes longer to compile
+    than the whole import.
+    """
+    table = connection.ops.quote_name(Inventory._meta.db_table)
+    pk, quantity, reorder_level, updated_at = (
+        connection.ops.quote_name(Inventory._meta.get_field(name).column)
+        for name in ('inventoryId', 'quantity', 'reorderLevel', 'updatedAt')
+    )
+    chunk_size = max(connection.ops.bulk_batch_size(['pk', 'quantity', 'reorderLevel'], rows), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            cursor.execute(
+                f'WITH v(id, quantity, reorder_level) AS (VALUES {", ".join(["(%s, %s, %s)"] * len(chunk))}) '
+                f'UPDATE {table} SET {quantity} = v.quantity, {reorder_level} = v.reorder_level, {updated_at} = %s '
+                f'FROM v WHERE {table}.{pk} = v.id',
+                [value for row in chunk for value in (row.pk, row.quantity, row.reorderLevel)] + [now]
+            )
+
+
+def import_catalog(file, fmt, user=None, location=None, batch_size=BATCH_SIZE, progress=None, filename=''):
+    """Import a binary CSV/XLSX file; returns the totals and the row errors"""
+    importer = CatalogImporter(user=user, location=location, batch_size=batch_size, progress=progress)
+    return importer.run(read_rows(file, fmt), filename=filename)
+
+
+def _decimal(value):
+    if value == '':
+        raise ValueError('Required')  # A blank cell must not zero an existing price or quantity
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('Must be a number')
+    if not number.is_finite() or number < 0:
+        raise ValueError('Must be a positive number')
+    return number
+
+
+def _integer(value):
+    number = _decimal(value)
+    if number != number.to_integral_value():
+        raise ValueError('Must be a whole number')
+    return int(number)
+
+
+def _check_limits(model, column, value):
+    """
+    Run the model field's validators (max_length, max_digits and
+    decimal_places, the integer range of the database), so an oversized
+    cell rejects its row instead of failing the batch's INSERT
+    """
+    try:
+        model._meta.get_field(column).run_validators(value)
+    except ValidationError as e:
+        raise ValueError(' '.join(e.messages))
+    return value
+
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # XLSX stores numeric SKUs and ids as floats
+    return str(value).strip()
+
+
+def _resolve(lookup, value, required):
+    """Primary key for an id or name cell"""
+    key = _text(value)
+    if not key:
+        if required:
+            raise ValueError('Required')
+        return None
+    if key in lookup:
+        return lookup[key]
+    key = key.lower()
+    if key not in lookup:
+        raise ValueError(f"Unknown: {_text(value)}")
+    if lookup[key] is None:
+        raise ValueError(f"Ambiguous name, use the id: {_text(value)}")
+    return lookup[key]
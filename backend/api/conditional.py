@@ -0,0 +1,130 @@
+"""
+Conditional GET
+ETag / Last-Modified support for list and detail endpoints, so a poll that
+finds nothing changed is answered 304 before anything is loaded or
+serialized.
+
+The validator is the latest modification timestamp and row count of the
+(filtered) queryset, or the catalog cache version. Requests carrying
+If-None-Match / If-Modified-Since check it with one cheap aggregate query;
+plain requests derive it from the rows they load anyway, so they cost no
+extra query.
+
+Lists only get an ETag: a deleted row lowers the count but not the latest
+timestamp, so Last-Modified alone could miss it. Details also get
+Last-Modified.
+"""
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    Answer list/retrieve with 304 Not Modified when the client's validators
+    still match. Set `modified_field` to a timestamp that every change
+    updates (e.g. an auto_now `updatedAt`) and that the serializer outputs,
+    and/or implement get_change_version() returning a version string that
+    every change bumps. The version wins when it isn't None.
+    """
+    modified_field = None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, self.get_list_validators, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, self.get_detail_validators, request, *args, **kwargs)
+
+    def change_version(self):
+        # get_change_version may come from a mixin later in the MRO (CachedCatalogMixin)
+        get_change_version = getattr(self, 'get_change_version', None)
+        return get_change_version() if get_change_version else None
+
+    def get_list_validators(self, response=None):
+        """(ETag seed, last modified) of the list, or (None, None) if it can't be validated"""
+        version = self.change_version()
+        if version is not None or not self.modified_field:
+            return version, None
+
+        if response is not None and isinstance(response.data, list):
+            # Unpaginated: the response holds every row the aggregate would see
+            stamps = [parse_datetime(row[self.modified_field]) for row in response.data if row.get(self.modified_field)]
+            return _seed(max(stamps, default=None), len(response.data)), None
+
+        latest = self.filter_queryset(self.get_queryset()).aggregate(
+            latest=Max(self.modified_field), count=Count('pk')
+        )
+        return _seed(latest['latest'], latest['count']), None
+
+    def get_detail_validators(self, response=None):
+        version = self.change_version()
+        if version is not None or not self.modified_field:
+            return version, None
+
+        if response is not None:
+            modified = parse_datetime(response.data.get(self.modified_field) or '')
+        else:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                modified = (
+                    self.filter_queryset(self.get_queryset())
+                    .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                    .values_list(self.modified_field, flat=True)
+                    .first()
+                )
+            except (TypeError, ValueError, ValidationError):
+                modified = None
+        if modified is None:
+            return None, None  # Not found (or never stamped); let retrieve answer
+        return _seed(modified), modified
+
+    def make_etag(self, request, seed):
+        # The representation also depends on the role (staff don't see costPrice) and the query string
+        role = getattr(request.user, 'role', '') or 'none'
+        return '"%s"' % hashlib.md5(f'{seed}:{role}:{request.get_full_path()}'.encode('utf-8')).hexdigest()
+
+    def conditional_response(self, handler, get_validators, request, *args, **kwargs):
+        if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+            seed, last_modified = get_validators()
+            if seed is None:
+                return handler(request, *args, **kwargs)
+            not_modified = get_conditional_response(
+                request, etag=self.make_etag(request, seed), last_modified=_timestamp(last_modified)
+            )
+            if not_modified is not None:
+                return self.add_validators(not_modified, request, seed, last_modified)
+            response = handler(request, *args, **kwargs)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            seed, last_modified = get_validators(response)
+            if seed is None:
+                return response
+
+        if response.status_code != 200:
+            return response
+        return self.add_validators(response, request, seed, last_modified)
+
+    def add_validators(self, response, request, seed, last_modified):
+        response['ETag'] = self.make_etag(request, seed)
+        if last_modified:
+            response['Last-Modified'] = http_date(_timestamp(last_modified))
+        # Let clients keep the copy but revalidate every time
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def _seed(modified, count=None):
+    # Same string whether the timestamp came from the database or the serialized rows
+    stamp = modified.astimezone(dt_timezone.utc).isoformat() if modified else ''
+    return stamp if count is None else f'{stamp}:{count}'
+
+
+def _timestamp(modified):
+    return int(modified.timestamp()) if modified else None
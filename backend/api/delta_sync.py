@@ -0,0 +1,87 @@
+"""
+Delta Sync
+Changes to the data offline POS terminals keep locally (products,
+inventory, categories, subcategories, customers) since a cursor, so a
+terminal catching up after a quiet hour downloads a handful of rows rather
+than the whole catalog.
+
+Changed rows are found through the indexed updatedAt of each model;
+deletions through SyncTombstone rows written by the post_delete receivers
+in api/signals.py. Writes that skip model signals must keep both up to date
+themselves: set updatedAt on queryset.update()/bulk_update(), and call
+record_tombstones() when deleting with a raw query.
+
+The cursor is the server time when the sync started. Each sync re-reads
+SYNC_CURSOR_OVERLAP seconds before the cursor, because a transaction that
+was still open when the cursor was taken commits rows stamped before it;
+clients apply rows by primary key, so the few repeated rows are harmless.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Category, Customer, Inventory, Product, SubCategory, SyncTombstone
+from .serializers import (
+    CategorySerializer, CustomerSerializer, InventorySerializer, ProductSerializer, SubCategorySerializer
+)
+
+# Response key -> (model, serializer)
+SYNC_MODELS = {
+    'categories': (Category, CategorySerializer),
+    'subcategories': (SubCategory, SubCategorySerializer),
+    'products': (Product, ProductSerializer),
+    'inventory': (Inventory, InventorySerializer),
+    'customers': (Customer, CustomerSerializer),
+}
+
+
+def record_tombstones(model, ids):
+    """Remember deleted primary keys of a synced model"""
+    SyncTombstone.objects.bulk_create([
+        SyncTombstone(model=model._meta.model_name, objectId=pk) for pk in ids
+    ])
+
+
+def parse_cursor(value):
+    """Cursor as an aware datetime; raises ValueError if it isn't one we issued"""
+    cursor = parse_datetime(value)
+    if cursor is None or timezone.is_naive(cursor):
+        raise ValueError(f"Invalid sync cursor: {value}")
+    return cursor
+
+
+def format_cursor(moment):
+    return moment.astimezone(dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def changes_since(since=None, context=None):
+    """
+    Rows changed and primary keys deleted since the cursor `since`, per
+    model, plus the cursor for the next sync. Without a cursor, or with one
+    older than the tombstone retention, every row is returned and `reset`
+    tells the client to replace its local copy.
+    """
+    now = timezone.now()
+    reset = since is None or since < now - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    after = None if reset else since - timedelta(seconds=settings.SYNC_CURSOR_OVERLAP)
+
+    deleted = {key: [] for key in SYNC_MODELS}
+    if not reset:
+        keys = {model._meta.model_name: key for key, (model, _) in SYNC_MODELS.items()}
+        tombstones = SyncTombstone.objects.filter(deletedAt__gte=after).order_by('deletedAt', 'tombstoneId')
+        for model_name, object_id in tombstones.values_list('model', 'objectId'):
+            if model_name in keys:
+                deleted[keys[model_name]].append(object_id)
+
+    changes = {}
+    for key, (model, serializer_class) in SYNC_MODELS.items():
+        rows = model.objects.order_by('updatedAt', model._meta.pk.name)
+        if not reset:
+            rows = rows.filter(updatedAt__gte=after)
+        changes[key] = {
+            'updated': serializer_class(rows, many=True, context=context).data,
+            'deleted': deleted[key],
+        }
+
+    return {'cursor': format_cursor(now), 'reset': reset, 'changes': changes}
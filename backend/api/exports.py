@@ -0,0 +1,131 @@
+"""
+Exports
+Streaming CSV / JSON Lines exports of the history tables (invoices,
+purchases, transactions, activity logs) for accounting.
+
+Rows are read with values_list() over queryset.iterator(), which uses a
+server-side cursor on PostgreSQL, and encoded as they arrive, so memory
+stays flat however many rows are exported. Output is sent in ~64 KB pieces,
+optionally gzipped on the fly.
+
+Date ranges are local days in REPORT_TIME_ZONE, like the sales reports,
+and timestamps are written in that time zone.
+"""
+import csv
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import ActivityLog, Invoice, Purchase, Transaction
+from .sales_summary import report_timezone
+
+CHUNK_SIZE = 2000  # Rows fetched per round trip
+BUFFER_SIZE = 64 * 1024  # Bytes per streamed piece
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def export(model, date_field, ordering, columns):
+    """Registry entry; `columns` are (column name, ORM path) pairs"""
+    return {'model': model, 'date_field': date_field, 'ordering': ordering, 'columns': columns}
+
+
+# Ordered by their (date, id) indexes, so the range filter and the order use one index
+EXPORTS = {
+    'invoices': export(Invoice, 'createdAt', ('createdAt', 'invoiceId'), (
+        ('invoiceId', 'invoiceId'), ('createdAt', 'createdAt'), ('paidAt', 'paidAt'), ('status', 'status'),
+        ('paymentMethod', 'paymentMethod'), ('customerId', 'customer_id'), ('customerName', 'customerName'),
+        ('customerPhone', 'customerPhone'), ('totalBeforeDiscount', 'totalBeforeDiscount'),
+        ('discount', 'discount'), ('tax', 'tax'), ('grandTotal', 'grandTotal'),
+        ('createdBy', 'createdByUser__username'), ('khqrShortHash', 'khqrShortHash'), ('note', 'note'),
+    )),
+    'purchases': export(Purchase, 'createdAt', ('createdAt', 'purchaseId'), (
+        ('purchaseId', 'purchaseId'), ('invoiceId', 'invoice_id'), ('createdAt', 'createdAt'),
+        ('productId', 'product_id'), ('skuCode', 'product__skuCode'), ('productName', 'product__productName'),
+        ('quantity', 'quantity'), ('pricePerUnit', 'pricePerUnit'), ('discount', 'discount'),
+        ('subtotal', 'subtotal'),
+    )),
+    'transactions': export(Transaction, 'transactionDate', ('transactionDate', 'transactionId'), (
+        ('transactionId', 'transactionId'), ('transactionDate', 'transactionDate'), ('invoiceId', 'invoice_id'),
+        ('customerId', 'customer_id'), ('amountPaid', 'amountPaid'), ('paymentMethod', 'paymentMethod'),
+        ('transactionStatus', 'transactionStatus'), ('paymentReference', 'paymentReference'),
+        ('recordedBy', 'recordedByUser__username'),
+    )),
+    'activitylogs': export(ActivityLog, 'createdAt', ('createdAt', 'logId'), (
+        ('logId', 'logId'), ('createdAt', 'createdAt'), ('user', 'user__username'),
+        ('actionType', 'actionType'), ('description', 'description'),
+    )),
+}
+
+
+def export_queryset(name, start=None, end=None):
+    """Rows of an export as value tuples, for local dates between `start` and `end` (inclusive)"""
+    spec = EXPORTS[name]
+    tz = report_timezone()
+    queryset = spec['model'].objects.all()
+    if start:
+        queryset = queryset.filter(**{f"{spec['date_field']}__gte": datetime.combine(start, time.min, tz)})
+    if end:
+        next_day = datetime.combine(end + timedelta(days=1), time.min, tz)
+        queryset = queryset.filter(**{f"{spec['date_field']}__lt": next_day})
+    return queryset.order_by(*spec['ordering']).values_list(*(path for _, path in spec['columns']))
+
+
+def stream_export(name, fmt, start=None, end=None, compress=False, chunk_size=CHUNK_SIZE):
+    """Generator of the encoded export, in pieces of about BUFFER_SIZE bytes"""
+    headers = [column for column, _ in EXPORTS[name]['columns']]
+    rows = export_queryset(name, start, end).iterator(chunk_size=chunk_size)
+    encode = _csv_lines if fmt == 'csv' else _json_lines
+    pieces = _buffered(encode(headers, _localized(rows)))
+    return _gzipped(pieces) if compress else pieces
+
+
+def _localized(rows):
+    tz = report_timezone()
+    for row in rows:
+        yield [value.astimezone(tz) if isinstance(value, datetime) else value for value in row]
+
+
+class _Line:
+    """File-like target for csv.writer that hands back each written line"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(headers, rows):
+    writer = csv.writer(_Line())
+    yield '\ufeff'  # BOM, so Excel opens Khmer text as UTF-8
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def _json_lines(headers, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(dict(zip(headers, row))) + '\n'
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _gzipped(pieces):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
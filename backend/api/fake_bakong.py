@@ -0,0 +1,183 @@
+"""
+Fake Bakong API
+Local stand-in for api-bakong.nbc.gov.kh that answers the endpoints used by
+KHQRService (renew_token, generate_deeplink_by_qr, check_transaction_by_md5
+and check_transaction_by_md5_list) with configurable latency, injected
+errors and paid/unpaid outcomes. Used by the KHQR benchmarks and tests so
+the payment path can be exercised without the real API; run it standalone
+with `manage.py run_fake_bakong`.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeBakongHandler(BaseHTTPRequestHandler):
+    """Answers Bakong /v1/ endpoints using the state held on the server"""
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            return self.send_json(self.server.stats())
+        self.send_json({'responseCode': 1, 'responseMessage': 'Not found'}, status=404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'null')
+        endpoint = self.path.rsplit('/', 1)[-1]
+        self.server.record_call(endpoint)
+
+        delay = self.server.response_delay()
+        if delay:
+            time.sleep(delay)
+
+        if self.server.inject_error():
+            return self.send_json({'responseCode': 1, 'responseMessage': 'Service unavailable'}, status=503)
+
+        handler = getattr(self, f'handle_{endpoint}', None)
+        if handler is None:
+            return self.send_json({'responseCode': 1, 'responseMessage': 'Unknown endpoint'}, status=404)
+        if endpoint != 'renew_token' and not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_json({'responseCode': 1, 'responseMessage': 'Unauthorized'}, status=401)
+        self.send_json(handler(body))
+
+    def handle_renew_token(self, body):
+        return {'responseCode': 0, 'data': {'token': 'fake-bakong-token'}}
+
+    def handle_generate_deeplink_by_qr(self, body):
+        short = hashlib.md5(body.get('qr', '').encode()).hexdigest()[:8]
+        return {'responseCode': 0, 'data': {'shortLink': f'https://bakong.example/{short}'}}
+
+    def handle_check_transaction_by_md5(self, body):
+        md5 = body.get('md5')
+        if self.server.is_paid(md5):
+            return {'responseCode': 0, 'data': self.server.transaction_for(md5)}
+        return {'responseCode': 1, 'errorCode': 1, 'responseMessage': 'Transaction could not be found'}
+
+    def handle_check_transaction_by_md5_list(self, body):
+        return {'responseCode': 0, 'data': [
+            {'md5': md5, 'status': 'SUCCESS', 'data': self.server.transaction_for(md5)}
+            if self.server.is_paid(md5) else {'md5': md5, 'status': 'FAILED', 'data': None}
+            for md5 in body
+        ]}
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBakongServer(ThreadingHTTPServer):
+    """
+    Threaded fake Bakong API.
+
+    Args:
+        latency: Seconds every response is delayed by
+        jitter: Extra random delay of up to this many seconds
+        error_rate: Fraction of calls answered with a 503
+        paid_md5s: MD5 hashes always reported as paid
+        paid_rate: Fraction of other MD5 hashes that get paid (picked
+            deterministically from the hash, so a QR stays paid or unpaid)
+        pay_after: Seconds after its first check before a paying QR shows
+            up as paid, like a customer scanning and confirming
+        seed: Random seed for jitter and errors
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 paid_md5s=(), paid_rate=0.0, pay_after=0.0, seed=None):
+        super().__init__((host, port), FakeBakongHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.paid_md5s = set(paid_md5s)
+        self.paid_rate = paid_rate
+        self.pay_after = pay_after
+        self.calls = {}
+        self.errors = 0
+        self.first_seen = {}
+        self._random = random.Random(seed)
+        self._calls_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def record_call(self, endpoint):
+        with self._calls_lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def response_delay(self):
+        if not self.jitter:
+            return self.latency
+        with self._calls_lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self._calls_lock:
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    def will_pay(self, md5):
+        if md5 in self.paid_md5s:
+            return True
+        return int(hashlib.md5(str(md5).encode()).hexdigest()[:8], 16) / 0x100000000 < self.paid_rate
+
+    def is_paid(self, md5):
+        if md5 in self.paid_md5s:
+            return True
+        if not self.will_pay(md5):
+            return False
+        with self._calls_lock:
+            first_seen = self.first_seen.setdefault(md5, time.monotonic())
+        return time.monotonic() - first_seen >= self.pay_after
+
+    def reset(self):
+        with self._calls_lock:
+            self.calls = {}
+            self.errors = 0
+            self.first_seen = {}
+
+    def stats(self):
+        with self._calls_lock:
+            return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()), 'errors': self.errors}
+
+    def transaction_for(self, md5):
+        return {
+            'hash': f'{md5}-hash'[:64],
+            'fromAccountId': 'customer@bank',
+            'amount': 1,
+            'currency': 'USD',
+            'acknowledgedDateMs': int(time.time() * 1000),
+        }
+
+    def start(self):
+        """Serve from a daemon thread; returns the server for chaining"""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-bakong', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,285 @@
+"""
+Invoice PDFs
+Renders invoices (with their purchase lines and the issuer's business
+details from UserProfile) to PDF with reportlab, and stores each rendering
+under the invoice id and a content version
+(invoice_pdfs/<id % 100>/<id>.<version>.v<RENDER_VERSION>.pdf).
+
+Paid invoices are final, so their version is simply 'paid': they are
+rendered once, on first request or by `manage.py render_invoice_pdfs`, and
+served from storage from then on (a later change to the business profile
+doesn't rewrite receipts already issued). Other invoices are versioned by
+a digest of everything printed, so an edit produces a new file.
+
+Khmer text needs a font with Khmer glyphs: set INVOICE_PDF_FONT to the
+path of a TTF (e.g. Noto Sans Khmer); the default is Helvetica.
+"""
+import hashlib
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from .models import Invoice, Purchase, UserProfile
+from .sales_summary import report_timezone
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so stored PDFs and ETags are replaced
+RENDER_VERSION = 1
+
+CURRENCY = 'USD'  # Invoices are charged in USD (see khqr_generation)
+FINAL_STATUSES = ('Paid',)
+
+
+def invoice_documents(queryset):
+    """
+    Everything printed on each invoice of a queryset, as plain dicts (so
+    they can be sent to worker processes), in three queries
+    """
+    invoices = queryset.select_related('createdByUser').prefetch_related(
+        Prefetch('purchases', queryset=Purchase.objects.select_related('product').order_by('purchaseId'))
+    )
+    invoices = list(invoices)
+    profiles = {
+        profile.user_id: profile
+        for profile in UserProfile.objects.filter(user_id__in={invoice.createdByUser_id for invoice in invoices})
+    }
+    return [_document(invoice, profiles.get(invoice.createdByUser_id)) for invoice in invoices]
+
+
+def invoice_document(invoice_id):
+    documents = invoice_documents(Invoice.objects.filter(pk=invoice_id))
+    return documents[0] if documents else None
+
+
+def _document(invoice, profile):
+    tz = report_timezone()
+    return {
+        'invoiceId': invoice.invoiceId,
+        'status': invoice.status,
+        'createdAt': timezone.localtime(invoice.createdAt, tz).strftime('%Y-%m-%d %H:%M'),
+        'paidAt': timezone.localtime(invoice.paidAt, tz).strftime('%Y-%m-%d %H:%M') if invoice.paidAt else None,
+        'paymentMethod': invoice.paymentMethod,
+        'customerName': invoice.customerName,
+        'customerPhone': invoice.customerPhone,
+        'cashier': invoice.createdByUser.username if invoice.createdByUser else None,
+        'note': invoice.note,
+        'totalBeforeDiscount': invoice.totalBeforeDiscount,
+        'discount': invoice.discount,
+        'tax': invoice.tax,
+        'grandTotal': invoice.grandTotal,
+        'business': {
+            'name': profile.businessName,
+            'address': profile.businessAddress,
+            'phone': profile.businessPhone,
+            'email': profile.businessEmail,
+            'taxId': profile.taxId,
+        } if profile else {},
+        'lines': [
+            {
+                'productName': line.product.productName if line.product else 'Deleted product',
+                'skuCode': line.product.skuCode if line.product else '',
+                'quantity': line.quantity,
+                'pricePerUnit': line.pricePerUnit,
+                'discount': line.discount,
+                'subtotal': line.subtotal,
+            }
+            for line in invoice.purchases.all()
+        ],
+    }
+
+
+def pdf_version(status, document=None):
+    """'paid' for final invoices, otherwise a digest of the printed content"""
+    if status in FINAL_STATUSES:
+        return status.lower()
+    content = json.dumps(document, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()[:12]
+
+
+def pdf_path(invoice_id, version):
+    return f'invoice_pdfs/{invoice_id % 100:02d}/{invoice_id}.{version}.v{RENDER_VERSION}.pdf'
+
+
+def pdf_etag(invoice_id, version):
+    """Strong ETag: the PDF bytes are fully determined by the version and RENDER_VERSION"""
+    return f'"invoice-{invoice_id}.{version}.v{RENDER_VERSION}"'
+
+
+def load_pdf(invoice_id, version):
+    """Stored PDF bytes, or None if this version hasn't been rendered yet"""
+    path = pdf_path(invoice_id, version)
+    if not default_storage.exists(path):
+        return None
+    with default_storage.open(path, 'rb') as stored:
+        return stored.read()
+
+
+def store_pdf(document, version, replace=False):
+    """Render one invoice and store it. Returns the PDF bytes."""
+    path = pdf_path(document['invoiceId'], version)
+    content = render_pdf(document)
+    if replace and default_storage.exists(path):
+        default_storage.delete(path)
+    saved = default_storage.save(path, ContentFile(content))
+    if saved != path:
+        # Another request stored the same version first; keep theirs
+        default_storage.delete(saved)
+    return content
+
+
+def render_pdf(document):
+    font, bold = _fonts()
+    styles = getSampleStyleSheet()
+    for style in styles.byName.values():
+        style.fontName = bold if style.name.startswith('Heading') or style.name == 'Title' else font
+    normal = styles['Normal']
+
+    def text(value):
+        return Paragraph(escape(str(value or '')).replace('\n', '<br/>'), normal)
+
+    business = document['business']
+    story = [Paragraph(escape(business.get('name') or 'Invoice'), styles['Title'])]
+    for label, key in (('', 'address'), ('Phone: ', 'phone'), ('Email: ', 'email'), ('Tax ID: ', 'taxId')):
+        if business.get(key):
+            story.append(text(f'{label}{business[key]}'))
+    story.append(Spacer(1, 6 * mm))
+
+    details = [
+        ['Invoice', f"#{document['invoiceId']}", 'Date', document['createdAt']],
+        ['Customer', document['customerName'], 'Status', document['status']],
+        ['Phone', document['customerPhone'] or '', 'Payment', document['paymentMethod']],
+        ['Cashier', document['cashier'] or '', 'Paid at', document['paidAt'] or ''],
+    ]
+    story.append(_table(details, [25 * mm, 65 * mm, 25 * mm, 55 * mm], font, bold_columns=(0, 2), bold=bold))
+    story.append(Spacer(1, 6 * mm))
+
+    rows = [['#', 'Item', 'Qty', 'Unit price', 'Discount', 'Subtotal']]
+    for number, line in enumerate(document['lines'], start=1):
+        item = line['productName'] + (f"\n{line['skuCode']}" if line['skuCode'] else '')
+        rows.append([
+            number, text(item), line['quantity'],
+            _money(line['pricePerUnit']), _money(line['discount']), _money(line['subtotal']),
+        ])
+    lines = Table(rows, colWidths=[10 * mm, 70 * mm, 15 * mm, 25 * mm, 25 * mm, 25 * mm], repeatRows=1)
+    lines.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, 0), (-1, 0), bold),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.75, colors.black),
+        ('LINEBELOW', (0, 1), (-1, -1), 0.25, colors.lightgrey),
+        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    story.append(lines)
+    story.append(Spacer(1, 4 * mm))
+
+    totals = [
+        ['Subtotal', _money(document['totalBeforeDiscount'])],
+        ['Discount', _money(document['discount'])],
+        ['Tax', _money(document['tax'])],
+        [f'Total ({CURRENCY})', _money(document['grandTotal'])],
+    ]
+    totals_table = Table(totals, colWidths=[40 * mm, 30 * mm], hAlign='RIGHT')
+    totals_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, -1), (-1, -1), bold),
+        ('LINEABOVE', (0, -1), (-1, -1), 0.75, colors.black),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ]))
+    story.append(totals_table)
+
+    if document['note']:
+        story.extend([Spacer(1, 6 * mm), text(f"Note: {document['note']}")])
+
+    buffer = io.BytesIO()
+    pdf = SimpleDocTemplate(
+        buffer, pagesize=A4, title=f"Invoice #{document['invoiceId']}",
+        leftMargin=20 * mm, rightMargin=20 * mm, topMargin=20 * mm, bottomMargin=20 * mm,
+        invariant=True,  # No creation timestamp, so the same invoice renders to the same bytes
+    )
+    pdf.build(story)
+    return buffer.getvalue()
+
+
+def _table(rows, widths, font, bold_columns, bold):
+    table = Table(rows, colWidths=widths, hAlign='LEFT')
+    table.setStyle(TableStyle(
+        [('FONTNAME', (0, 0), (-1, -1), font), ('VALIGN', (0, 0), (-1, -1), 'TOP')]
+        + [('FONTNAME', (column, 0), (column, -1), bold) for column in bold_columns]
+    ))
+    return table
+
+
+_registered_fonts = None
+
+
+def _fonts():
+    """(regular, bold) font names, registering INVOICE_PDF_FONT on first use"""
+    global _registered_fonts
+    if _registered_fonts is None:
+        path = getattr(settings, 'INVOICE_PDF_FONT', '')
+        if path:
+            pdfmetrics.registerFont(TTFont('InvoiceFont', path))
+            _registered_fonts = ('InvoiceFont', 'InvoiceFont')
+        else:
+            _registered_fonts = ('Helvetica', 'Helvetica-Bold')
+    return _registered_fonts
+
+
+def _money(value):
+    return f'{value:,.2f}'
+
+
+def render_document(job):
+    """Process pool task: store the PDF of one (document, version, force) if missing"""
+    document, version, force = job
+    if not force and default_storage.exists(pdf_path(document['invoiceId'], version)):
+        return 0
+    try:
+        store_pdf(document, version, replace=force)
+        return 1
+    except Exception as e:
+        logger.error(f"Failed to render PDF for invoice #{document['invoiceId']}: {str(e)}")
+        return 0
+
+
+def _init_worker():
+    # Workers may be spawned rather than forked; make settings and storage usable
+    django.setup()
+
+
+def prerender_pdfs(queryset, workers=None, force=False, batch_size=500, chunksize=8):
+    """
+    Render and store the PDFs of every invoice in a queryset with a process
+    pool. Documents are loaded here, `batch_size` invoices per query;
+    workers only render and store, so they never touch the database.
+    Returns (invoices, PDFs stored).
+    """
+    def jobs():
+        ids = list(queryset.order_by('invoiceId').values_list('invoiceId', flat=True))
+        for start in range(0, len(ids), batch_size):
+            for document in invoice_documents(Invoice.objects.filter(pk__in=ids[start:start + batch_size])):
+                yield document, pdf_version(document['status'], document), force
+
+    total = stored = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for result in pool.map(render_document, jobs(), chunksize=chunksize):
+            total += 1
+            stored += result
+    return total, stored
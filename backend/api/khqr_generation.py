@@ -0,0 +1,125 @@
+"""
+KHQR Code Generation
+Builds invoice QR codes and Bakong deeplinks off the request path. Creating
+a KHQR invoice only schedules the work (after the transaction commits); a
+small thread pool generates the QR and stores it with one UPDATE, and
+generate_khqr waits on the job already running for an invoice instead of
+starting a second one.
+
+Whichever path produces a QR code (this pool, or generate_khqr when it runs
+on another worker process than the job), it is stored with
+store_invoice_qr(), a conditional UPDATE that never replaces a QR code
+already stored: the first one wins and everyone re-reads it.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from .khqr_service import get_khqr_service
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+# Invoices are charged their grandTotal in USD, whichever path generates the QR code
+KHQR_CURRENCY = 'USD'
+
+_jobs = {}  # invoiceId -> Future of the running generation
+_lock = threading.RLock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'KHQR_QR_WORKERS', 2),
+                    thread_name_prefix='khqr-generator'
+                )
+    return _executor
+
+
+def schedule_invoice_qr(invoice, currency=KHQR_CURRENCY):
+    """Generate the invoice's QR code in the background once the current transaction commits"""
+    invoice_id, amount = invoice.invoiceId, invoice.grandTotal
+    transaction.on_commit(lambda: submit_invoice_qr(invoice_id, amount, currency))
+
+
+def submit_invoice_qr(invoice_id, amount, currency=KHQR_CURRENCY):
+    """Start generating an invoice's QR code, or return the job already doing it"""
+    with _lock:
+        job = _jobs.get(invoice_id)
+        if job is None:
+            job = _get_executor().submit(_generate, invoice_id, amount, currency)
+            _jobs[invoice_id] = job
+            job.add_done_callback(lambda done: _forget(invoice_id, done))
+    return job
+
+
+def wait_for_invoice_qr(invoice_id, timeout=None):
+    """
+    Block until a running generation for the invoice finishes.
+    Returns False if none is running. Raises TimeoutError if it is still
+    running after `timeout` seconds.
+    """
+    with _lock:
+        job = _jobs.get(invoice_id)
+    if job is None:
+        return False
+    job.result(timeout=timeout)
+    return True
+
+
+def _forget(invoice_id, job):
+    with _lock:
+        if _jobs.get(invoice_id) is job:
+            del _jobs[invoice_id]
+
+
+def _missing_qr(invoice_id):
+    # Never replace a QR code the customer may already be looking at
+    return Invoice.objects.filter(pk=invoice_id, status='Pending').filter(Q(khqrMd5__isnull=True) | Q(khqrMd5=''))
+
+
+def _qr_fields(qr_data, deeplink):
+    return {
+        'khqrCodeString': qr_data['qr_string'],
+        'khqrMd5': qr_data['md5_hash'],
+        'khqrDeeplink': deeplink or None,
+        'paymentMethod': 'KHQR',
+    }
+
+
+def store_invoice_qr(invoice_id, qr_data, deeplink=None):
+    """Store a generated QR code unless the invoice already has one or isn't pending; True if stored"""
+    return bool(_missing_qr(invoice_id).update(**_qr_fields(qr_data, deeplink)))
+
+
+async def astore_invoice_qr(invoice_id, qr_data, deeplink=None):
+    return bool(await _missing_qr(invoice_id).aupdate(**_qr_fields(qr_data, deeplink)))
+
+
+def _generate(invoice_id, amount, currency):
+    close_old_connections()
+    try:
+        khqr_service = get_khqr_service()
+        qr_data = khqr_service.generate_qr_code(invoice_id=invoice_id, amount=amount, currency=currency)
+        if not qr_data:
+            return None
+
+        deeplink = khqr_service.generate_deeplink(qr_data['qr_string'])
+
+        if not store_invoice_qr(invoice_id, qr_data, deeplink):
+            logger.info(f"Invoice #{invoice_id} already has a QR code or is no longer pending; discarded new one")
+            return None
+        return qr_data
+    except Exception as e:
+        # Log error but never take the worker down
+        logger.error(f"Failed to generate KHQR for invoice #{invoice_id}: {str(e)}")
+        return None
+    finally:
+        close_old_connections()
@@ -0,0 +1,149 @@
+"""
+KHQR QR Images
+Renders invoice QR codes to PNG and SVG on the server, for clients too slow
+to render them themselves. Images are rendered once and stored under the QR
+code's MD5 (khqr/<md5[:2]>/<md5>.v<version>.<format>), which never changes
+for a given QR string, so clients can cache them for good.
+
+Rendering uses reportlab's QR encoder and Pillow, both already required.
+"""
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+from reportlab.graphics.barcode import qrencoder
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Bump when the rendering changes so stored images and ETags are replaced
+RENDER_VERSION = 1
+
+MODULE_PIXELS = 8  # PNG pixels per QR module
+QUIET_ZONE = 4  # Blank modules around the code, as the QR spec requires
+
+
+def qr_matrix(qr_string):
+    """Rows of booleans (True = dark module) for a QR string"""
+    qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+    qr.addData(qr_string)
+    qr.make()
+    size = qr.getModuleCount()
+    return [[qr.isDark(row, col) for col in range(size)] for row in range(size)]
+
+
+def render_png(qr_string):
+    matrix = qr_matrix(qr_string)
+    size = len(matrix) + 2 * QUIET_ZONE
+    image = Image.new('1', (size, size), 1)
+    pixels = image.load()
+    for row, modules in enumerate(matrix):
+        for col, dark in enumerate(modules):
+            if dark:
+                pixels[col + QUIET_ZONE, row + QUIET_ZONE] = 0
+    image = image.resize((size * MODULE_PIXELS, size * MODULE_PIXELS), Image.NEAREST)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_svg(qr_string):
+    matrix = qr_matrix(qr_string)
+    size = len(matrix) + 2 * QUIET_ZONE
+
+    # One path segment per horizontal run of dark modules keeps the file small
+    path = []
+    for row, modules in enumerate(matrix):
+        col = 0
+        while col < len(modules):
+            if not modules[col]:
+                col += 1
+                continue
+            start = col
+            while col < len(modules) and modules[col]:
+                col += 1
+            path.append(f'M{start + QUIET_ZONE} {row + QUIET_ZONE}h{col - start}v1h-{col - start}z')
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(path)}" fill="#000"/>'
+        '</svg>'
+    )
+    return svg.encode('utf-8')
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def image_path(md5, fmt):
+    return f'khqr/{md5[:2]}/{md5}.v{RENDER_VERSION}.{fmt}'
+
+
+def image_etag(md5, fmt):
+    """Strong ETag: the image bytes are fully determined by the QR string and RENDER_VERSION"""
+    return f'"{md5}.v{RENDER_VERSION}.{fmt}"'
+
+
+def load_image(md5, fmt):
+    """Stored image bytes, or None if it hasn't been rendered yet"""
+    path = image_path(md5, fmt)
+    if not default_storage.exists(path):
+        return None
+    with default_storage.open(path, 'rb') as stored:
+        return stored.read()
+
+
+def store_image(md5, qr_string, fmt, replace=False):
+    """Render one image and store it under the QR code's MD5. Returns the image bytes."""
+    path = image_path(md5, fmt)
+    content = RENDERERS[fmt](qr_string)
+    if replace and default_storage.exists(path):
+        default_storage.delete(path)
+    saved = default_storage.save(path, ContentFile(content))
+    if saved != path:
+        # Another request stored the same image first; keep theirs
+        default_storage.delete(saved)
+    return content
+
+
+def render_images(job):
+    """Process pool task: store every missing format for one (md5, qr_string, force)"""
+    md5, qr_string, force = job
+    stored = 0
+    for fmt in RENDERERS:
+        if not force and default_storage.exists(image_path(md5, fmt)):
+            continue
+        try:
+            store_image(md5, qr_string, fmt, replace=force)
+            stored += 1
+        except Exception as e:
+            logger.error(f"Failed to render KHQR {fmt} for {md5}: {str(e)}")
+    return stored
+
+
+def _init_worker():
+    # Workers may be spawned rather than forked; make settings and storage usable
+    django.setup()
+
+
+def prerender_images(items, workers=None, force=False, chunksize=16):
+    """
+    Render images for many (md5, qr_string) pairs with a process pool.
+    Returns the number of images stored.
+    """
+    jobs = ((md5, qr_string, force) for md5, qr_string in items)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return sum(pool.map(render_images, jobs, chunksize=chunksize))
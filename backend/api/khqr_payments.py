@@ -0,0 +1,214 @@
+"""
+KHQR Payment Confirmation
+Checks pending KHQR invoices against Bakong in batches and marks the paid
+ones in bulk. Used by the poll_khqr_payments worker and the batch check API.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .activity_log import log_activity
+from .models import Invoice
+from .sales_summary import record_sales
+
+logger = logging.getLogger(__name__)
+
+# Bakong accepts at most 50 MD5 hashes per batch check
+BAKONG_BATCH_SIZE = 50
+
+# Adaptive polling: (invoices younger than, check at most every). Fresh invoices
+# are where customers are standing at the counter, so they are checked often;
+# invoices older than the last tier are no longer polled.
+POLL_SCHEDULE = [
+    (timedelta(minutes=2), timedelta(seconds=3)),
+    (timedelta(minutes=10), timedelta(seconds=10)),
+    (timedelta(hours=1), timedelta(minutes=1)),
+    (timedelta(hours=24), timedelta(minutes=5)),
+]
+
+# Fields written when an invoice is confirmed as paid
+PAID_FIELDS = ['status', 'paidAt', 'khqrTransactionHash', 'khqrShortHash', 'khqrPaymentData', 'khqrLastCheckedAt']
+
+
+def pending_khqr_invoices():
+    """Pending KHQR invoices that have a QR code to check"""
+    return Invoice.objects.filter(
+        status='Pending',
+        paymentMethod='KHQR',
+        khqrMd5__isnull=False
+    ).exclude(khqrMd5='')
+
+
+def due_khqr_invoices(now=None, schedule=POLL_SCHEDULE):
+    """
+    Pending KHQR invoices whose next check is due under the adaptive schedule.
+    Returns only the columns needed to poll, oldest check first.
+    """
+    now = now or timezone.now()
+    due = Q()
+    younger_than = None
+    for max_age, interval in schedule:
+        tier = Q(createdAt__gt=now - max_age)
+        if younger_than is not None:
+            tier &= Q(createdAt__lte=now - younger_than)
+        tier &= Q(khqrLastCheckedAt__isnull=True) | Q(khqrLastCheckedAt__lte=now - interval)
+        due |= tier
+        younger_than = max_age
+
+    return (
+        pending_khqr_invoices()
+        .filter(due)
+        # Never-checked invoices first; PostgreSQL would otherwise sort their NULLs last
+        .order_by(F('khqrLastCheckedAt').asc(nulls_first=True), 'invoiceId')
+        .only('invoiceId', 'khqrMd5', 'createdByUser', 'status')
+    )
+
+
+def chunked(items, size=BAKONG_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def paid_at_from(transaction_data):
+    """Payment time reported by Bakong (milliseconds), falling back to now"""
+    payment_timestamp_ms = transaction_data.get('acknowledgedDateMs') or transaction_data.get('createdDateMs')
+    if payment_timestamp_ms:
+        try:
+            return datetime.fromtimestamp(payment_timestamp_ms / 1000, tz=dt_timezone.utc)
+        except Exception as e:
+            logger.error(f"Error parsing timestamp {payment_timestamp_ms}: {e}")
+    return timezone.now()
+
+
+def apply_payment(invoice, transaction_data, now=None):
+    """Set the payment fields of an invoice from Bakong transaction data (not saved)"""
+    transaction_hash = transaction_data.get('hash') or ''
+    invoice.status = 'Paid'
+    invoice.paidAt = paid_at_from(transaction_data)
+    invoice.khqrTransactionHash = transaction_hash
+    invoice.khqrShortHash = transaction_hash[:8]
+    invoice.khqrPaymentData = transaction_data
+    invoice.khqrLastCheckedAt = now or timezone.now()
+    return invoice
+
+
+def payment_status(invoice):
+    """check_payment response body for the invoice's recorded payment state"""
+    if invoice.status == 'Paid':
+        payment_data = invoice.khqrPaymentData or {}
+        return {
+            'success': True,
+            'paid': True,
+            'payment_timestamp': invoice.paidAt.isoformat() if invoice.paidAt else None,
+            'transaction_hash': invoice.khqrTransactionHash,
+            'from_account': payment_data.get('fromAccountId'),
+            'amount': payment_data.get('amount'),
+            'currency': payment_data.get('currency'),
+            'payment_data': invoice.khqrPaymentData,
+            'invoice_status': invoice.status
+        }
+    return {
+        'success': True,
+        'paid': False,
+        'message': 'Payment not found yet',
+        'last_checked_at': invoice.khqrLastCheckedAt.isoformat() if invoice.khqrLastCheckedAt else None,
+        'invoice_status': invoice.status
+    }
+
+
+def check_invoices(invoices, khqr_service):
+    """
+    Check one chunk (at most 50) of invoices with a single Bakong call.
+    Returns {invoice: transaction_data} for the paid ones, or None if the
+    call failed.
+    """
+    by_md5 = {invoice.khqrMd5: invoice for invoice in invoices}
+    return _match_results(by_md5, khqr_service.batch_check_transactions_by_md5(list(by_md5)))
+
+
+async def acheck_invoices(invoices, khqr_service):
+    """Async check_invoices, for the ASGI views"""
+    by_md5 = {invoice.khqrMd5: invoice for invoice in invoices}
+    return _match_results(by_md5, await khqr_service.abatch_check_transactions_by_md5(list(by_md5)))
+
+
+def _match_results(by_md5, results):
+    if results is None:
+        return None
+
+    paid = {}
+    for result in results:
+        invoice = by_md5.get(result.get('md5'))
+        if invoice is not None and result.get('status') == 'SUCCESS' and result.get('data'):
+            paid[invoice] = result['data']
+    return paid
+
+
+@transaction.atomic
+def mark_invoices_paid(paid, checked_ids, source='KHQR'):
+    """
+    Persist a round of checks in a constant number of queries: confirmed
+    invoices get one bulk_update of the payment fields, every checked
+    invoice gets its khqrLastCheckedAt bumped in one UPDATE, and a single
+    aggregated activity log entry is written. Confirmed invoices are added
+    to the daily sales summary after commit.
+
+    Invoices that stopped being Pending since they were read (cancelled or
+    marked paid by hand) are left untouched.
+
+    Returns the list of invoice ids that were marked paid.
+    """
+    now = timezone.now()
+    if checked_ids:
+        Invoice.objects.filter(pk__in=checked_ids).update(khqrLastCheckedAt=now)
+    if not paid:
+        return []
+
+    still_pending = set(
+        Invoice.objects.select_for_update()
+        .filter(pk__in=[invoice.pk for invoice in paid], status='Pending')
+        .values_list('pk', flat=True)
+    )
+
+    updated = []
+    for invoice, transaction_data in paid.items():
+        if invoice.pk not in still_pending:
+            continue
+        updated.append(apply_payment(invoice, transaction_data, now))
+
+    if not updated:
+        return []
+
+    Invoice.objects.bulk_update(updated, PAID_FIELDS)
+    # bulk_update sends no signals, so add the sales to the daily summary here
+    paid_ids = [invoice.pk for invoice in updated]
+    transaction.on_commit(lambda: record_sales(paid_ids))
+
+    invoice_ids = sorted(invoice.pk for invoice in updated)
+    log_activity(
+        user=None,
+        actionType='UPDATE_INVOICE_STATUS',
+        description=f"{source} payment confirmed for {len(invoice_ids)} invoice(s): "
+                    f"{', '.join(f'#{invoice_id}' for invoice_id in invoice_ids)} (Pending → Paid)"
+    )
+    return invoice_ids
+
+
+def poll_once(khqr_service, now=None, limit=None):
+    """
+    Run one polling round over every due invoice.
+    Returns a dict with counts of checked, paid and failed chunks.
+    """
+    invoices = list(due_khqr_invoices(now)[:limit] if limit else due_khqr_invoices(now))
+    stats = {'due': len(invoices), 'checked': 0, 'paid': 0, 'failed_chunks': 0}
+
+    for chunk in chunked(invoices):
+        paid = check_invoices(chunk, khqr_service)
+        if paid is None:
+            stats['failed_chunks'] += 1
+            continue
+        stats['checked'] += len(chunk)
+        stats['paid'] += len(mark_invoices_paid(paid, [invoice.pk for invoice in chunk]))
+
+    return stats
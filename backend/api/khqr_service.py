@@ -3,16 +3,137 @@ KHQR Payment Service
 Handles Bakong KHQR API integration for payment processing
 """
 import requests
+import asyncio
+import base64
 import hashlib
+import json
 import logging
+import random
+import threading
+import time
 from datetime import datetime
 from decimal import Decimal
 from typing import Optional, Dict, Any
+import httpx
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 from bakong_khqr import KHQR
 
 logger = logging.getLogger(__name__)
 
+# Read timeouts (seconds) per Bakong endpoint; override with settings.KHQR_TIMEOUTS
+DEFAULT_TIMEOUTS = {
+    'renew_token': 10,
+    'generate_deeplink_by_qr': 10,
+    'check_transaction_by_md5': 5,
+    'check_transaction_by_hash': 5,
+    'check_bakong_account': 5,
+    'check_transaction_by_md5_list': 15,
+}
+
+# Responses worth retrying on read-only checks
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# Refresh tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide HTTP session for Bakong calls. Keeps TCP+TLS connections
+    alive in a pool so repeated checks skip the handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = getattr(settings, 'KHQR_POOL_MAXSIZE', 20)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Content-Type': 'application/json'})
+                _session = session
+    return _session
+
+
+_async_clients = {}
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Shared httpx client for async views, one per event loop (an AsyncClient
+    cannot be used across loops). Pools keep-alive connections like the sync
+    session does.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        pool_size = getattr(settings, 'KHQR_ASYNC_POOL_MAXSIZE', 200)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={'Content-Type': 'application/json'}
+        )
+        # Forget clients of loops that have been closed (e.g. per-request loops under WSGI)
+        for stale in [known for known in _async_clients if known.is_closed()]:
+            del _async_clients[stale]
+        _async_clients[loop] = client
+    return client
+
+
+class TokenCache:
+    """Bakong access token shared by every KHQRService in the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self.rejected = set()  # Tokens the API answered 401 for
+
+    def get(self) -> Optional[str]:
+        if self._token and time.time() < self._expires_at - TOKEN_EXPIRY_MARGIN:
+            return self._token
+        return None
+
+    def set(self, token: str, expires_at: Optional[float] = None):
+        self._token = token
+        self._expires_at = expires_at or token_expiry(token) or float('inf')
+
+    def invalidate(self, token: Optional[str] = None):
+        with self.lock:
+            if token is None or token == self._token:
+                if self._token:
+                    self.rejected.add(self._token)
+                self._token = None
+                self._expires_at = 0.0
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Read the `exp` claim of a JWT without verifying it (Bakong tokens are JWTs)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return None
+
+
+_token_cache = TokenCache()
+
+_service = None
+
+
+def get_khqr_service() -> 'KHQRService':
+    """Shared KHQRService instance for the process"""
+    global _service
+    if _service is None:
+        _service = KHQRService()
+    return _service
+
 
 class KHQRService:
     """Service class for handling KHQR payment operations"""
@@ -27,41 +148,62 @@ class KHQRService:
         self.app_icon_url = getattr(settings, 'KHQR_APP_ICON_URL', '')
         self.app_name = getattr(settings, 'KHQR_APP_NAME', '')
         self.app_deeplink_callback = getattr(settings, 'KHQR_APP_DEEPLINK_CALLBACK', '')
-        self._access_token = None
+        self.timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, 'KHQR_TIMEOUTS', {})}
+        self.connect_timeout = getattr(settings, 'KHQR_CONNECT_TIMEOUT', 3.05)
+        self.max_retries = getattr(settings, 'KHQR_MAX_RETRIES', 2)
+        self.retry_backoff = getattr(settings, 'KHQR_RETRY_BACKOFF', 0.25)
+        self.retry_backoff_max = getattr(settings, 'KHQR_RETRY_BACKOFF_MAX', 2.0)
+        self._khqr = None
+    
+    @property
+    def khqr(self) -> KHQR:
+        """KHQR SDK instance, built once and reused for every QR code"""
+        if self._khqr is None:
+            self._khqr = KHQR(bakong_token=self.bakong_token) if self.bakong_token else KHQR()
+        return self._khqr
     
     def get_access_token(self) -> Optional[str]:
         """
         Get or renew access token for KHQR API
         Returns: Access token string or None if failed
         """
-        # First, check if token is already cached
-        if self._access_token:
-            return self._access_token
-        
-        # Second, use the token from settings/env if available
-        if self.bakong_token:
-            self._access_token = self.bakong_token
-            logger.info("Using KHQR token from configuration")
-            return self._access_token
+        # First, check if token is already cached (shared across the process)
+        token = _token_cache.get()
+        if token:
+            return token
         
-        # Third, try to renew token via API (only if email is configured)
-        if not self.email:
-            logger.debug("No KHQR token or email configured")
-            return None
+        # Only one thread refreshes; the others wait and reuse its result
+        with _token_cache.lock:
+            token = _token_cache.get()
+            if token:
+                return token
             
-        try:
-            url = f"{self.base_url}/v1/renew_token"
-            payload = {"email": self.email}
-            headers = {"Content-Type": "application/json"}
+            # Second, use the token from settings/env if available and not rejected
+            if self.bakong_token and self.bakong_token not in _token_cache.rejected:
+                _token_cache.set(self.bakong_token)
+                logger.info("Using KHQR token from configuration")
+                return self.bakong_token
             
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            response.raise_for_status()
+            # Third, try to renew token via API (only if email is configured)
+            if not self.email:
+                logger.debug("No KHQR token or email configured")
+                return None
             
-            data = response.json()
+            token = self.renew_token()
+            if token:
+                _token_cache.set(token)
+            return token
+    
+    def renew_token(self) -> Optional[str]:
+        """
+        Request a new access token for the configured email
+        Returns: Access token string or None if failed
+        """
+        try:
+            data = self._post('renew_token', {"email": self.email}, auth=False)
             if data.get('responseCode') == 0:
-                self._access_token = data.get('data', {}).get('token')
                 logger.info("KHQR access token renewed successfully")
-                return self._access_token
+                return data.get('data', {}).get('token')
             else:
                 logger.debug(f"Token renewal not available: {data.get('responseMessage')}")
                 return None
@@ -69,6 +211,63 @@ class KHQRService:
             logger.debug(f"KHQR token not available (API registration may be required): {str(e)}")
             return None
     
+    def _timeout(self, endpoint: str):
+        return (self.connect_timeout, self.timeouts.get(endpoint, 10))
+    
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter so many pollers don't retry in lockstep"""
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * (2 ** attempt)))
+    
+    def _post(self, endpoint: str, payload, auth: bool = True, retry: bool = False) -> Dict[str, Any]:
+        """
+        POST to a Bakong endpoint over the shared session and return the JSON body.
+        
+        Args:
+            endpoint: Path after /v1/, also used to pick the timeout
+            payload: JSON body
+            auth: Send the bearer token (renewed once on 401)
+            retry: Retry connection errors, timeouts and 429/5xx with jittered
+                backoff. Only for idempotent checks.
+        """
+        url = f"{self.base_url}/v1/{endpoint}"
+        attempts = self.max_retries + 1 if retry else 1
+        renewed = False
+        attempt = 0
+        
+        while True:
+            headers = {}
+            token = None
+            if auth:
+                token = self.get_access_token()
+                if not token:
+                    raise PermissionError("No KHQR access token available")
+                headers['Authorization'] = f"Bearer {token}"
+            
+            try:
+                response = get_session().post(url, json=payload, headers=headers, timeout=self._timeout(endpoint))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                attempt += 1
+                if attempt >= attempts:
+                    raise
+                logger.warning(f"Bakong {endpoint} failed ({e.__class__.__name__}), retrying")
+                time.sleep(self._backoff(attempt - 1))
+                continue
+            
+            if response.status_code == 401 and auth and not renewed:
+                # Token expired or revoked: drop it everywhere and try once with a fresh one
+                _token_cache.invalidate(token)
+                renewed = True
+                continue
+            
+            if response.status_code in RETRY_STATUS_CODES and attempt + 1 < attempts:
+                attempt += 1
+                logger.warning(f"Bakong {endpoint} returned {response.status_code}, retrying")
+                time.sleep(self._backoff(attempt - 1))
+                continue
+            
+            response.raise_for_status()
+            return response.json()
+    
     def generate_qr_code(
         self,
         invoice_id: int,
@@ -96,13 +295,8 @@ class KHQRService:
                 logger.error("KHQR_MERCHANT_NAME is not configured")
                 raise ValueError("KHQR_MERCHANT_NAME is required but not configured")
             
-            logger.info(f"Generating KHQR QR code: invoice_id={invoice_id}, amount={amount}, currency={currency}")
-            logger.info(f"Using bakong_account_id: {self.bakong_account_id}")
-            logger.info(f"Using merchant_name: {self.merchant_name}")
-            logger.info(f"Using merchant_city: {self.merchant_city}")
-            
-            # Initialize KHQR instance with token
-            khqr = KHQR(bakong_token=self.bakong_token) if self.bakong_token else KHQR()
+            logger.debug(f"Generating KHQR QR code: invoice_id={invoice_id}, amount={amount}, currency={currency}")
+            khqr = self.khqr
             
             # Create QR code data (dynamic)
             # Signature: create_qr(bank_account, merchant_name, merchant_city, amount, currency, 
@@ -126,17 +320,7 @@ class KHQRService:
             # Calculate MD5 hash
             md5_hash = khqr.generate_md5(qr_string)
             
-            logger.info(f"Generated KHQR QR code for invoice #{invoice_id}, MD5: {md5_hash}")
-            
-            # Print to terminal for debugging
-            print(f"\n{'='*80}")
-            print(f"KHQR QR Code Generated for Invoice #{invoice_id}")
-            print(f"{'='*80}")
-            print(f"Amount: {amount} {currency}")
-            print(f"MD5: {md5_hash}")
-            print(f"QR String ({len(qr_string)} chars):")
-            print(qr_string)
-            print(f"{'='*80}\n")
+            logger.debug(f"Generated KHQR QR code for invoice #{invoice_id}, MD5: {md5_hash}")
             
             return {
                 'qr_string': qr_string,
@@ -167,35 +351,29 @@ class KHQRService:
             return None
         
         try:
-            url = f"{self.base_url}/v1/generate_deeplink_by_qr"
-            payload = {
-                "qr": qr_string,
-                "sourceInfo": {
-                    "appIconUrl": self.app_icon_url,
-                    "appName": self.app_name,
-                    "appDeepLinkCallback": self.app_deeplink_callback
-                }
-            }
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('responseCode') == 0:
-                deeplink = data.get('data', {}).get('shortLink')
-                logger.info("Generated KHQR deeplink successfully")
-                return deeplink
-            else:
-                logger.debug(f"Deeplink not available: {data.get('responseMessage')} (requires NBC merchant registration)")
-                return None
+            data = self._post('generate_deeplink_by_qr', self._deeplink_payload(qr_string))
+            return self._deeplink_from(data)
         except Exception as e:
             logger.debug(f"Deeplink generation skipped: {str(e)} (not required for QR code scanning)")
             return None
     
+    def _deeplink_payload(self, qr_string: str) -> Dict[str, Any]:
+        return {
+            "qr": qr_string,
+            "sourceInfo": {
+                "appIconUrl": self.app_icon_url,
+                "appName": self.app_name,
+                "appDeepLinkCallback": self.app_deeplink_callback
+            }
+        }
+    
+    def _deeplink_from(self, data: Dict[str, Any]) -> Optional[str]:
+        if data.get('responseCode') == 0:
+            logger.info("Generated KHQR deeplink successfully")
+            return data.get('data', {}).get('shortLink')
+        logger.debug(f"Deeplink not available: {data.get('responseMessage')} (requires NBC merchant registration)")
+        return None
+    
     def check_transaction_by_md5(self, md5_hash: str) -> Optional[Dict[str, Any]]:
         """
         Check transaction status using MD5 hash
@@ -214,40 +392,27 @@ class KHQRService:
         logger.info(f"Checking transaction with MD5: {md5_hash}")
         
         try:
-            url = f"{self.base_url}/v1/check_transaction_by_md5"
-            payload = {"md5": md5_hash}
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-            
-            logger.info(f"Calling Bakong API: {url}")
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            
-            logger.info(f"Bakong API status: {response.status_code}")
-            logger.info(f"Bakong API response: {response.text}")
-            
-            response.raise_for_status()
-            
-            data = response.json()
-            logger.info(f"Parsed response data: {data}")
-            
-            if data.get('responseCode') == 0:
-                logger.info(f"Transaction found for MD5: {md5_hash}")
-                logger.info(f"Transaction details: {data.get('data')}")
-                return data.get('data')
-            elif data.get('errorCode') == 1:
-                logger.debug(f"Transaction not found for MD5: {md5_hash}")
-                return None
-            else:
-                logger.error(f"Transaction check failed: {data.get('responseMessage')}")
-                return None
+            data = self._post('check_transaction_by_md5', {"md5": md5_hash}, retry=True)
+            return self._transaction_from(data, md5_hash)
         except Exception as e:
             logger.error(f"Error checking transaction by MD5: {str(e)}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             return None
     
+    def _transaction_from(self, data: Dict[str, Any], md5_hash: str) -> Optional[Dict[str, Any]]:
+        logger.debug(f"Bakong API response: {data}")
+        if data.get('responseCode') == 0:
+            logger.info(f"Transaction found for MD5: {md5_hash}")
+            logger.info(f"Transaction details: {data.get('data')}")
+            return data.get('data')
+        elif data.get('errorCode') == 1:
+            logger.debug(f"Transaction not found for MD5: {md5_hash}")
+            return None
+        else:
+            logger.error(f"Transaction check failed: {data.get('responseMessage')}")
+            return None
+    
     def check_transaction_by_hash(self, transaction_hash: str) -> Optional[Dict[str, Any]]:
         """
         Check transaction status using full transaction hash
@@ -264,17 +429,7 @@ class KHQRService:
             return None
         
         try:
-            url = f"{self.base_url}/v1/check_transaction_by_hash"
-            payload = {"hash": transaction_hash}
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._post('check_transaction_by_hash', {"hash": transaction_hash}, retry=True)
             if data.get('responseCode') == 0:
                 logger.info(f"Transaction found for hash: {transaction_hash[:16]}...")
                 return data.get('data')
@@ -304,17 +459,7 @@ class KHQRService:
             return False
         
         try:
-            url = f"{self.base_url}/v1/check_bakong_account"
-            payload = {"accountId": account_id}
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._post('check_bakong_account', {"accountId": account_id}, retry=True)
             return data.get('responseCode') == 0
         except Exception as e:
             logger.error(f"Error checking Bakong account: {str(e)}")
@@ -325,7 +470,7 @@ class KHQRService:
         Check multiple transactions at once using MD5 hashes
         
         Args:
-            md5_list: List of MD5 hashes (max 50)
+            md5_list: List of MD5 hashes (max 50; use khqr_payments.chunked for longer lists)
         
         Returns:
             List of transaction results or None if failed
@@ -340,22 +485,104 @@ class KHQRService:
             return None
         
         try:
-            url = f"{self.base_url}/v1/check_transaction_by_md5_list"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
+            data = self._post('check_transaction_by_md5_list', md5_list, retry=True)
+            return self._batch_results_from(data, len(md5_list))
+        except Exception as e:
+            logger.error(f"Error in batch transaction check: {str(e)}")
+            return None
+    
+    def _batch_results_from(self, data: Dict[str, Any], count: int) -> Optional[list]:
+        if data.get('responseCode') == 0:
+            logger.info(f"Batch checked {count} transactions")
+            return data.get('data', [])
+        logger.error(f"Batch transaction check failed: {data.get('responseMessage')}")
+        return None
+    
+    # ==================== ASYNC API (ASGI views) ====================
+    
+    async def aget_access_token(self) -> Optional[str]:
+        """Async get_access_token; the shared cache makes this a plain lookup almost always"""
+        token = _token_cache.get()
+        if token:
+            return token
+        return await sync_to_async(self.get_access_token, thread_sensitive=False)()
+    
+    async def _apost(self, endpoint: str, payload, auth: bool = True, retry: bool = False) -> Dict[str, Any]:
+        """Async _post over the shared httpx client, with the same retry and 401 handling"""
+        url = f"{self.base_url}/v1/{endpoint}"
+        attempts = self.max_retries + 1 if retry else 1
+        timeout = httpx.Timeout(self.timeouts.get(endpoint, 10), connect=self.connect_timeout)
+        renewed = False
+        attempt = 0
+        
+        while True:
+            headers = {}
+            token = None
+            if auth:
+                token = await self.aget_access_token()
+                if not token:
+                    raise PermissionError("No KHQR access token available")
+                headers['Authorization'] = f"Bearer {token}"
             
-            response = requests.post(url, json=md5_list, headers=headers, timeout=15)
-            response.raise_for_status()
+            try:
+                response = await get_async_client().post(url, json=payload, headers=headers, timeout=timeout)
+            except httpx.TransportError as e:
+                attempt += 1
+                if attempt >= attempts:
+                    raise
+                logger.warning(f"Bakong {endpoint} failed ({e.__class__.__name__}), retrying")
+                await asyncio.sleep(self._backoff(attempt - 1))
+                continue
             
-            data = response.json()
-            if data.get('responseCode') == 0:
-                logger.info(f"Batch checked {len(md5_list)} transactions")
-                return data.get('data', [])
-            else:
-                logger.error(f"Batch transaction check failed: {data.get('responseMessage')}")
-                return None
+            if response.status_code == 401 and auth and not renewed:
+                _token_cache.invalidate(token)
+                renewed = True
+                continue
+            
+            if response.status_code in RETRY_STATUS_CODES and attempt + 1 < attempts:
+                attempt += 1
+                logger.warning(f"Bakong {endpoint} returned {response.status_code}, retrying")
+                await asyncio.sleep(self._backoff(attempt - 1))
+                continue
+            
+            response.raise_for_status()
+            return response.json()
+    
+    async def agenerate_deeplink(self, qr_string: str) -> Optional[str]:
+        """Async generate_deeplink"""
+        if not await self.aget_access_token():
+            logger.debug("Deeplink not available: No API token (NBC registration required)")
+            return None
+        try:
+            data = await self._apost('generate_deeplink_by_qr', self._deeplink_payload(qr_string))
+            return self._deeplink_from(data)
+        except Exception as e:
+            logger.debug(f"Deeplink generation skipped: {str(e)} (not required for QR code scanning)")
+            return None
+    
+    async def acheck_transaction_by_md5(self, md5_hash: str) -> Optional[Dict[str, Any]]:
+        """Async check_transaction_by_md5"""
+        if not await self.aget_access_token():
+            logger.error("Cannot check transaction: No access token")
+            return None
+        try:
+            data = await self._apost('check_transaction_by_md5', {"md5": md5_hash}, retry=True)
+            return self._transaction_from(data, md5_hash)
+        except Exception as e:
+            logger.error(f"Error checking transaction by MD5: {str(e)}")
+            return None
+    
+    async def abatch_check_transactions_by_md5(self, md5_list: list) -> Optional[list]:
+        """Async batch_check_transactions_by_md5 (max 50 hashes)"""
+        if len(md5_list) > 50:
+            logger.warning("MD5 list exceeds 50 items, truncating")
+            md5_list = md5_list[:50]
+        if not await self.aget_access_token():
+            logger.error("Cannot check transactions: No access token")
+            return None
+        try:
+            data = await self._apost('check_transaction_by_md5_list', md5_list, retry=True)
+            return self._batch_results_from(data, len(md5_list))
         except Exception as e:
             logger.error(f"Error in batch transaction check: {str(e)}")
             return None
@@ -0,0 +1,211 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from api import khqr_service
+from api.fake_bakong import FakeBakongServer
+from api.khqr_payments import poll_once
+from api.models import Category, Inventory, Product, SubCategory, User
+from api.stock_ledger import record_movement
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+@contextmanager
+def fresh_khqr_client():
+    """Build the shared KHQRService from the overridden settings and restore it afterwards"""
+    saved = khqr_service._service, khqr_service._token_cache
+    khqr_service._service, khqr_service._token_cache = None, khqr_service.TokenCache()
+    try:
+        yield
+    finally:
+        khqr_service._service, khqr_service._token_cache = saved
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the KHQR payment path (create invoice -> generate QR -> poll until paid) "
+        "at a target concurrency against the fake Bakong API. Writes invoices to the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=100, help="Number of KHQR sales to run")
+        parser.add_argument('--concurrency', type=int, default=10, help="Sales in progress at once")
+        parser.add_argument('--latency', type=float, default=0.2, help="Fake Bakong response delay (seconds)")
+        parser.add_argument('--jitter', type=float, default=0.1, help="Extra random Bakong delay (seconds)")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of Bakong calls that fail with 503")
+        parser.add_argument('--paid-rate', type=float, default=1.0, help="Fraction of customers who pay")
+        parser.add_argument('--pay-after', type=float, default=2.0, help="Seconds a customer takes to pay")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between check_payment calls")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Give up on a sale after this many seconds")
+        parser.add_argument('--worker', action='store_true',
+                            help="Confirm payments with the background poller (KHQR_BACKGROUND_POLLING) "
+                                 "instead of per-request Bakong checks")
+        parser.add_argument('--tick', type=float, default=1.0, help="Poller round interval with --worker")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = FakeBakongServer(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            paid_rate=options['paid_rate'],
+            pay_after=options['pay_after'],
+            seed=options['seed']
+        ).start()
+
+        overrides = {
+            'KHQR_BASE_URL': server.base_url,
+            'KHQR_TOKEN': 'benchmark-token',
+            'KHQR_EMAIL': '',
+            'KHQR_BAKONG_ACCOUNT_ID': 'benchmark@devb',
+            'KHQR_MERCHANT_NAME': 'Benchmark',
+            'KHQR_POOL_MAXSIZE': max(20, options['concurrency']),
+            'KHQR_BACKGROUND_POLLING': options['worker'],
+        }
+
+        stop = threading.Event()
+        poller = None
+        try:
+            with override_settings(**overrides), fresh_khqr_client():
+                user, products = self.setup_data(options['payments'], options['concurrency'])
+
+                if options['worker']:
+                    poller = threading.Thread(target=self.poll, args=(stop, options['tick']), daemon=True)
+                    poller.start()
+
+                self.stdout.write(
+                    f"Running {options['payments']} KHQR sales, {options['concurrency']} at a time, "
+                    f"against {server.base_url}"
+                )
+                started = time.monotonic()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                    results = list(pool.map(
+                        lambda index: self.run_sale(user, products[index % len(products)], options),
+                        range(options['payments'])
+                    ))
+                elapsed = time.monotonic() - started
+        finally:
+            stop.set()
+            if poller:
+                poller.join()
+            server.stop()
+
+        self.report(results, elapsed, server.stats())
+
+    def setup_data(self, payments, concurrency):
+        """Benchmark user and one product per concurrent sale, with enough stock for the run"""
+        user, _ = User.objects.get_or_create(username='khqr-benchmark', defaults={'role': 'manager'})
+        category, _ = Category.objects.get_or_create(name='Benchmark')
+        subcategory, _ = SubCategory.objects.get_or_create(category=category, name='Benchmark')
+
+        products = []
+        for index in range(concurrency):
+            product, _ = Product.objects.get_or_create(
+                skuCode=f'BENCH-KHQR-{index:03d}',
+                defaults={'productName': f'Benchmark product {index}', 'description': '', 'unit': 'pcs',
+                          'subcategory': subcategory}
+            )
+            inventory = Inventory.objects.filter(product=product).order_by('inventoryId').first()
+            if inventory is None:
+                Inventory.objects.create(product=product, quantity=payments, reorderLevel=0, location='Benchmark')
+            elif inventory.quantity < payments:
+                change = payments - inventory.quantity
+                inventory.quantity = payments
+                inventory.save()
+                record_movement(inventory, 'Adjustment', change, reference='KHQR benchmark restock', user=user)
+            products.append(product)
+        return user, products
+
+    def run_sale(self, user, product, options):
+        """One customer: create a KHQR invoice, fetch its QR, poll until paid or timed out"""
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        result = {'create': None, 'qr': None, 'checks': [], 'confirm': None, 'error': None}
+        try:
+            started = time.monotonic()
+            response = client.post('/api/invoices/', {
+                'customerName': 'Benchmark',
+                'paymentMethod': 'KHQR',
+                'lineItems': [{'product': product.pk, 'quantity': 1, 'pricePerUnit': '1.00'}],
+            }, format='json')
+            result['create'] = time.monotonic() - started
+            if response.status_code != 201:
+                result['error'] = f"create invoice: HTTP {response.status_code}"
+                return result
+            invoice_id = response.data['invoiceId']
+
+            request_started = time.monotonic()
+            response = client.post(f'/api/invoices/{invoice_id}/generate_khqr/')
+            result['qr'] = time.monotonic() - request_started
+            if response.status_code != 200:
+                result['error'] = f"generate_khqr: HTTP {response.status_code}"
+                return result
+
+            while time.monotonic() - started < options['timeout']:
+                request_started = time.monotonic()
+                response = client.post(f'/api/invoices/{invoice_id}/check_payment/')
+                result['checks'].append(time.monotonic() - request_started)
+                if response.status_code == 200 and response.data.get('paid'):
+                    result['confirm'] = time.monotonic() - started
+                    return result
+                time.sleep(options['poll_interval'])
+            return result
+        except Exception as e:
+            result['error'] = str(e)
+            return result
+        finally:
+            connection.close()
+
+    def poll(self, stop, tick):
+        """Background poller, as `manage.py poll_khqr_payments` runs it"""
+        service = khqr_service.get_khqr_service()
+        try:
+            while not stop.wait(tick):
+                poll_once(service)
+        finally:
+            connection.close()
+
+    def report(self, results, elapsed, stats):
+        confirmed = [result for result in results if result['confirm'] is not None]
+        errors = [result for result in results if result['error']]
+        timed_out = len(results) - len(confirmed) - len(errors)
+
+        self.stdout.write(
+            f"\n{len(results)} sales in {elapsed:.1f}s: {len(confirmed)} confirmed, "
+            f"{timed_out} unpaid/timed out, {len(errors)} errors"
+        )
+        for error in sorted({result['error'] for result in errors})[:5]:
+            self.stdout.write(f"  error: {error}")
+
+        rows = [
+            ('create invoice', [result['create'] for result in results if result['create'] is not None]),
+            ('generate_khqr', [result['qr'] for result in results if result['qr'] is not None]),
+            ('check_payment', [check for result in results for check in result['checks']]),
+            ('time to confirm', [result['confirm'] for result in confirmed]),
+        ]
+        self.stdout.write(f"\n  {'latency (ms)':<18}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for label, values in rows:
+            values = sorted(values)
+            cells = [percentile(values, 50), percentile(values, 95), percentile(values, 99), values[-1] if values else None]
+            self.stdout.write(
+                f"  {label:<18}{len(values):>7}"
+                + ''.join(f"{value * 1000:>10.1f}" if value is not None else f"{'-':>10}" for value in cells)
+            )
+
+        calls = ', '.join(f"{endpoint} {count}" for endpoint, count in sorted(stats['calls'].items()))
+        self.stdout.write(f"\nBakong calls: {stats['total_calls']} ({calls or 'none'}), {stats['errors']} injected errors")
+        if confirmed:
+            self.stdout.write(f"Bakong calls per confirmed payment: {stats['total_calls'] / len(confirmed):.2f}")
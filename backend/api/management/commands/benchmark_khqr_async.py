@@ -0,0 +1,63 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.fake_bakong import FakeBakongServer
+from api.khqr_service import KHQRService
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sync (worker threads) and async (one event loop) throughput of KHQR "
+        "payment checks against a slow local fake Bakong API"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help="Payment checks per run")
+        parser.add_argument('--latency', type=float, default=1.0, help="Seconds the fake Bakong API takes per call")
+        parser.add_argument('--sync-threads', type=int, default=8,
+                            help="Worker threads for the sync run (e.g. gunicorn workers x threads)")
+        parser.add_argument('--concurrency', type=int, default=200, help="In-flight checks for the async run")
+
+    def handle(self, *args, **options):
+        md5s = [f'benchmark-{i:06d}' for i in range(options['requests'])]
+
+        with FakeBakongServer(latency=options['latency'], paid_md5s=md5s) as server:
+            khqr_service = KHQRService()
+            khqr_service.base_url = server.base_url
+            khqr_service.bakong_token = 'benchmark-token'
+            khqr_service.max_retries = 0
+
+            self.stdout.write(
+                f"{len(md5s)} checks against {server.base_url} with {options['latency']:.2f}s latency"
+            )
+            self.report(f"sync, {options['sync_threads']} threads",
+                        *self.run_sync(khqr_service, md5s, options['sync_threads']))
+            self.report(f"async, {options['concurrency']} in flight",
+                        *asyncio.run(self.run_async(khqr_service, md5s, options['concurrency'])))
+
+    def run_sync(self, khqr_service, md5s, threads):
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(khqr_service.check_transaction_by_md5, md5s))
+        return results, time.monotonic() - started
+
+    async def run_async(self, khqr_service, md5s, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(md5):
+            async with semaphore:
+                return await khqr_service.acheck_transaction_by_md5(md5)
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(check(md5) for md5 in md5s))
+        return results, time.monotonic() - started
+
+    def report(self, label, results, elapsed):
+        confirmed = sum(1 for result in results if result)
+        self.stdout.write(
+            f"  {label:<24} {elapsed:7.2f}s  {len(results) / elapsed:8.1f} checks/s  "
+            f"{confirmed}/{len(results)} confirmed"
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import StockMovement
+from api.stock_ledger import iter_ledger_balances, record_movements
+
+
+class Command(BaseCommand):
+    help = "Verify Inventory.quantity against the stock movement ledger, streaming in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--fix', action='store_true',
+            help="Record an Adjustment movement for each mismatch so the ledger matches Inventory.quantity"
+        )
+
+    def handle(self, *args, **options):
+        checked = 0
+        mismatches = []
+
+        for inventory_id, quantity, ledger_quantity in iter_ledger_balances(options['chunk_size']):
+            checked += 1
+            if quantity != ledger_quantity:
+                mismatches.append((inventory_id, quantity, ledger_quantity))
+                self.stdout.write(
+                    f"Inventory #{inventory_id}: quantity={quantity} ledger={ledger_quantity} "
+                    f"(diff {quantity - ledger_quantity:+d})"
+                )
+            if checked % 100000 == 0:
+                self.stdout.write(f"... {checked} rows checked")
+
+        if mismatches and options['fix']:
+            record_movements([
+                StockMovement(
+                    inventory_id=inventory_id,
+                    movementType='Adjustment',
+                    quantity=quantity - ledger_quantity,
+                    reference='Ledger reconciliation'
+                )
+                for inventory_id, quantity, ledger_quantity in mismatches
+            ])
+            self.stdout.write(self.style.WARNING(f"Recorded {len(mismatches)} reconciliation movements"))
+            return
+
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} of {checked} inventory rows disagree with the ledger")
+
+        self.stdout.write(self.style.SUCCESS(f"Ledger consistent for {checked} inventory rows"))
@@ -0,0 +1,28 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.media_gc import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded product images and QR codes no product or profile references (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age-hours', type=float, default=24,
+            help="Keep files younger than this, which may belong to a product being created (default: 24)"
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scanned, deleted, freed = collect_garbage(
+            min_age=timedelta(hours=options['min_age_hours']), dry_run=options['dry_run']
+        )
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(
+            f"{verb} {deleted} of {scanned} media file(s), {freed / 1024 / 1024:.1f} MB, "
+            f"in {time.monotonic() - started:.1f}s"
+        )
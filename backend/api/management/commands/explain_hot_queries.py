@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.query_plans import HOT_QUERIES, explain, table_rows
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the registered hot queries and flag sequential scans of large tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help="Only flag sequential scans of tables with at least this many rows"
+        )
+        parser.add_argument('--query', action='append', choices=sorted(HOT_QUERIES), help="Only check these queries")
+        parser.add_argument('--show-plans', action='store_true', help="Print the full plan of every query")
+        parser.add_argument('--fail', action='store_true', help="Exit with an error if any query is flagged")
+
+    def handle(self, *args, **options):
+        names = options['query'] or list(HOT_QUERIES)
+        rows = {}
+        flagged = []
+
+        for name in names:
+            try:
+                plan, scans = explain(HOT_QUERIES[name]())
+            except NotImplementedError as e:
+                raise CommandError(str(e))
+
+            problems = []
+            for table, kind in scans:
+                if kind != 'seq':
+                    continue
+                if table not in rows:
+                    rows[table] = table_rows(table)
+                if rows[table] >= options['min_rows']:
+                    problems.append(f"sequential scan of {table} ({rows[table]} rows)")
+
+            if problems:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(f"{name}: {'; '.join(problems)}"))
+            else:
+                tables = ', '.join(sorted({table for table, _ in scans})) or 'no tables'
+                self.stdout.write(f"{name}: ok ({tables})")
+            if options['show_plans'] or problems:
+                self.stdout.write(f"  {plan}".replace('\n', '\n  '))
+
+        if flagged and options['fail']:
+            raise CommandError(f"{len(flagged)} hot query(s) scan large tables: {', '.join(flagged)}")
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS(f"All {len(names)} hot queries use indexes"))
@@ -0,0 +1,50 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_import import BATCH_SIZE, ImportFileError, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Create or update products and inventory from a CSV or XLSX catalog file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or XLSX file; the header row holds the field names")
+        parser.add_argument('--location', help="Inventory location for rows without a location column")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help="Default: from the file extension")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        started = time.monotonic()
+
+        def progress(report):
+            self.stdout.write(
+                f"Batch {report['batch']}: {report['created']} created, {report['updated']} updated, "
+                f"{report['inventoryCreated'] + report['inventoryUpdated']} inventory rows, "
+                f"{report['rejected']} rejected"
+            )
+
+        try:
+            with path.open('rb') as file:
+                result = import_catalog(
+                    file,
+                    options['format'] or detect_format(path.name),
+                    location=options['location'],
+                    batch_size=options['batch_size'],
+                    progress=progress,
+                    filename=path.name,
+                )
+        except (OSError, ImportFileError) as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: " + '; '.join(
+                f"{column}: {message}" for column, message in error['errors'].items()
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['rows'] - result['rejected']} of {result['rows']} rows in "
+            f"{time.monotonic() - started:.1f}s: {result['created']} products created, {result['updated']} updated, "
+            f"{result['inventoryCreated']} inventory rows created, {result['inventoryUpdated']} updated"
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.khqr_payments import poll_once
+from api.khqr_service import get_khqr_service
+
+
+class Command(BaseCommand):
+    help = "Long-running worker that confirms pending KHQR payments with Bakong in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single polling round and exit")
+        parser.add_argument('--tick', type=float, default=2.0, help="Seconds between polling rounds")
+        parser.add_argument('--limit', type=int, default=None, help="Maximum invoices to check per round")
+
+    def handle(self, *args, **options):
+        khqr_service = get_khqr_service()
+        if not khqr_service.get_access_token():
+            raise CommandError("KHQR API token is not available. Set KHQR_TOKEN or KHQR_EMAIL.")
+
+        self.stdout.write(f"Polling {khqr_service.base_url} for KHQR payments")
+        try:
+            while True:
+                close_old_connections()
+                started = time.monotonic()
+                stats = poll_once(khqr_service, limit=options['limit'])
+
+                if stats['due']:
+                    self.stdout.write(
+                        f"Checked {stats['checked']}/{stats['due']} due invoices, "
+                        f"{stats['paid']} paid, {stats['failed_chunks']} failed chunks "
+                        f"in {time.monotonic() - started:.2f}s"
+                    )
+                if options['once']:
+                    return
+                time.sleep(max(0.0, options['tick'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
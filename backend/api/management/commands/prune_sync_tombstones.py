@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import SyncTombstone
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS (run periodically, e.g. nightly)"
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        # Cursors older than the cutoff get a full resync, so these are never read again
+        deleted, _ = SyncTombstone.objects.filter(deletedAt__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones older than {cutoff.isoformat()}"))
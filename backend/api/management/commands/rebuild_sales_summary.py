@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.sales_summary import rebuild_sales_summary
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales summary tables from paid invoices (backfill or repair)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First local date to rebuild (YYYY-MM-DD, default: all time)")
+        parser.add_argument('--end', help="Last local date to rebuild (YYYY-MM-DD, default: all time)")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('start', 'end'):
+            value = options[name]
+            if not value:
+                dates[name] = None
+                continue
+            try:
+                dates[name] = parse_date(value)
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                raise CommandError(f"Invalid --{name} date '{value}', use YYYY-MM-DD")
+
+        summary_rows, product_rows = rebuild_sales_summary(dates['start'], dates['end'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {summary_rows} daily summary rows and {product_rows} product rows"
+        ))
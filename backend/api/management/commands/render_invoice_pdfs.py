@@ -0,0 +1,41 @@
+import time
+from datetime import date, datetime, time as day_start
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.invoice_pdf import prerender_pdfs
+from api.models import Invoice
+from api.sales_summary import report_timezone
+
+
+class Command(BaseCommand):
+    help = "Render and store the PDFs of a month of invoices using a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('month', help="Local month of the invoices' creation date (YYYY-MM)")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+        parser.add_argument('--force', action='store_true', help="Re-render PDFs that are already stored")
+        parser.add_argument('--status', help="Only invoices with this status (e.g. Paid)")
+
+    def handle(self, *args, **options):
+        try:
+            year, month = (int(part) for part in options['month'].split('-'))
+            first = date(year, month, 1)
+        except ValueError:
+            raise CommandError(f"Invalid month '{options['month']}', use YYYY-MM")
+        following = date(year + month // 12, month % 12 + 1, 1)
+
+        tz = report_timezone()
+        invoices = Invoice.objects.filter(
+            createdAt__gte=datetime.combine(first, day_start.min, tz),
+            createdAt__lt=datetime.combine(following, day_start.min, tz),
+        )
+        if options['status']:
+            invoices = invoices.filter(status=options['status'])
+
+        started = time.monotonic()
+        total, stored = prerender_pdfs(invoices, workers=options['workers'], force=options['force'])
+        self.stdout.write(
+            f"Rendered {stored} PDF(s) for {total} invoice(s) of {first:%Y-%m} "
+            f"({total - stored} already stored) in {time.monotonic() - started:.1f}s"
+        )
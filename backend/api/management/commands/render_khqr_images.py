@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.khqr_images import RENDERERS, prerender_images
+from api.khqr_payments import pending_khqr_invoices
+
+
+class Command(BaseCommand):
+    help = "Pre-render PNG and SVG QR images for every pending KHQR invoice using a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+        parser.add_argument('--force', action='store_true', help="Re-render images that are already stored")
+
+    def handle(self, *args, **options):
+        items = list(
+            pending_khqr_invoices()
+            .exclude(khqrCodeString__isnull=True).exclude(khqrCodeString='')
+            .values_list('khqrMd5', 'khqrCodeString')
+            .distinct()
+        )
+        if not items:
+            self.stdout.write("No pending KHQR invoices")
+            return
+
+        started = time.monotonic()
+        stored = prerender_images(items, workers=options['workers'], force=options['force'])
+        self.stdout.write(
+            f"Rendered {stored} image(s) for {len(items)} QR code(s) "
+            f"({len(items) * len(RENDERERS) - stored} already stored) in {time.monotonic() - started:.1f}s"
+        )
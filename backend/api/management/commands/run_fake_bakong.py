@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_bakong import FakeBakongServer
+
+
+class Command(BaseCommand):
+    help = "Run the fake Bakong API locally (point KHQR_BASE_URL at it); GET /stats reports call counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds every response is delayed by")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay of up to this many seconds")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with a 503")
+        parser.add_argument('--paid-rate', type=float, default=1.0, help="Fraction of QR codes that get paid")
+        parser.add_argument('--pay-after', type=float, default=5.0,
+                            help="Seconds after the first check before a QR shows up as paid")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = FakeBakongServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            paid_rate=options['paid_rate'],
+            pay_after=options['pay_after'],
+            seed=options['seed']
+        )
+        self.stdout.write(f"Fake Bakong API on {server.base_url} (set KHQR_BASE_URL={server.base_url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f"Stopped: {server.stats()}")
+        finally:
+            server.server_close()
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.stock_ledger import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Store the ledger balance of every inventory row (run periodically, e.g. nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag-minutes', type=int, default=5,
+            help="Snapshot this many minutes in the past so in-flight transactions have committed"
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        taken_at = timezone.now() - timedelta(minutes=options['lag_minutes'])
+        try:
+            written = take_snapshot(taken_at, chunk_size=options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot at {taken_at.isoformat()} written for {written} inventory rows"
+        ))
@@ -0,0 +1,94 @@
+"""
+Media Garbage Collection
+Deletes uploaded media no row references anymore. Files in the
+content-addressed media storage can be shared by several rows, so they are
+never deleted when a product or profile changes; instead this counts the
+references to each file and removes the files nobody references.
+
+References are streamed from Product.image (a URL or path) and
+UserProfile.qrCodeImage with values_list() over iterator(), so only the
+reference counts are held in memory, not the rows; files are listed one
+directory at a time. Image variants (<hash>_thumbnail.webp) belong to their
+full size file and go with it. Files younger than `min_age` are kept: they
+may have just been uploaded for a product that isn't saved yet.
+"""
+import posixpath
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.utils import timezone
+from .media_storage import media_storage
+from .models import Product, UserProfile
+from .product_images import VARIANTS
+
+MEDIA_DIRECTORIES = ('products', 'qr_codes')  # Only these hold uploads; khqr/ and invoice_pdfs/ are caches
+CHUNK_SIZE = 2000
+
+
+def media_name(value):
+    """Storage name of a media URL or path, or None for anything outside MEDIA_URL (e.g. external images)"""
+    if not value:
+        return None
+    path = unquote(urlparse(value).path)
+    media_url = urlparse(settings.MEDIA_URL).path
+    if path.startswith(media_url):
+        path = path[len(media_url):]
+    elif path.startswith('/'):
+        return None
+    path = posixpath.normpath(path)
+    return path if path.split('/', 1)[0] in MEDIA_DIRECTORIES else None
+
+
+def owner_name(name):
+    """The stored file a variant belongs to (the name itself for anything else)"""
+    root, extension = posixpath.splitext(name)
+    for variant in VARIANTS:
+        if root.endswith(f'_{variant}'):
+            return root[:-len(variant) - 1] + extension
+    return name
+
+
+def reference_counts():
+    """Counter of storage name -> rows referencing it"""
+    references = Counter()
+    for value in Product.objects.exclude(image=None).values_list('image', flat=True).iterator(chunk_size=CHUNK_SIZE):
+        name = media_name(value)
+        if name:
+            references[owner_name(name)] += 1
+    profiles = UserProfile.objects.exclude(qrCodeImage='').exclude(qrCodeImage=None)
+    for value in profiles.values_list('qrCodeImage', flat=True).iterator(chunk_size=CHUNK_SIZE):
+        references[owner_name(value)] += 1
+    return references
+
+
+def stored_files(directory):
+    """Names of every file below `directory`, one directory listing at a time"""
+    if not media_storage.exists(directory):
+        return
+    directories, files = media_storage.listdir(directory)
+    for file_name in sorted(files):
+        yield posixpath.join(directory, file_name)
+    for subdirectory in sorted(directories):
+        yield from stored_files(posixpath.join(directory, subdirectory))
+
+
+def collect_garbage(min_age=timedelta(hours=24), dry_run=False):
+    """
+    Delete unreferenced media files older than `min_age`.
+    Returns (files scanned, files deleted, bytes freed).
+    """
+    references = reference_counts()
+    cutoff = timezone.now() - min_age
+    scanned = deleted = freed = 0
+    for directory in MEDIA_DIRECTORIES:
+        for name in stored_files(directory):
+            scanned += 1
+            if references[owner_name(name)] or media_storage.get_modified_time(name) > cutoff:
+                continue
+            deleted += 1
+            freed += media_storage.size(name)
+            if not dry_run:
+                media_storage.delete(name)
+    return scanned, deleted, freed
@@ -0,0 +1,64 @@
+"""
+Media Storage
+Content-addressed storage for uploaded media (product images, profile QR
+codes). Files are named by the SHA-256 of their bytes and sharded into
+nested directories, <directory>/<hash[:2]>/<hash[2:4]>/<hash><ext>, so the
+same photo uploaded twice is stored once and no directory grows past a few
+hundred entries.
+
+Because one file can be shared by several rows, nothing is deleted when a
+row changes or goes away; `manage.py collect_media_garbage` (api/media_gc.py)
+deletes the files no row references anymore.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that stores files under the hash of their content"""
+
+    def hashed_name(self, name, content):
+        """Storage name for `content` saved as `name` (only its directory and extension are kept)"""
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, basename = posixpath.split(name)
+        extension = posixpath.splitext(basename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self.save_if_missing(self.hashed_name(name, content), content, max_length)
+
+    def save_if_missing(self, name, content, max_length=None):
+        """
+        Store `content` under exactly `name` unless a file of that name
+        exists, which for a hashed name means the same bytes are stored
+        already. Also used for files derived from a stored one (e.g. image
+        variants) and named after it.
+        """
+        if self.exists(name):
+            # Refresh the age so the garbage collector doesn't take a file being reused
+            os.utime(self.path(name))
+            return name
+        saved = super().save(name, content, max_length)
+        if saved != name:
+            # Stored concurrently by another request; same content, keep theirs
+            self.delete(saved)
+        return name
+
+
+media_storage = ContentAddressedStorage()
+
+
+def get_media_storage():
+    """Storage callable for FileFields, so migrations reference it instead of serializing an instance"""
+    return media_storage
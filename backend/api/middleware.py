@@ -0,0 +1,25 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .activity_log import activity_log_batch
+
+
+class ActivityLogBatchMiddleware:
+    """Write every activity log entry produced by a request in one batch"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with activity_log_batch():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with activity_log_batch():
+            return await self.get_response(request)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_product_saleprice'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['createdAt', 'logId'], name='activitylog_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['createdAt', 'invoiceId'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transactionDate', 'transactionId'], name='transaction_date_idx'),
+        ),
+    ]
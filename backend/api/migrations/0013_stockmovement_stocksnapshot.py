@@ -0,0 +1,67 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Seed the ledger with one opening movement per existing inventory row."""
+    Inventory = apps.get_model('api', 'Inventory')
+    StockMovement = apps.get_model('api', 'StockMovement')
+    now = django.utils.timezone.now()
+
+    batch = []
+    for inventory_id, quantity in Inventory.objects.values_list('inventoryId', 'quantity').iterator(chunk_size=2000):
+        batch.append(StockMovement(
+            inventory_id=inventory_id,
+            movementType='Adjustment',
+            quantity=quantity,
+            reference='Opening balance',
+            createdAt=now,
+        ))
+        if len(batch) >= 2000:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('movementId', models.BigAutoField(primary_key=True, serialize=False)),
+                ('movementType', models.CharField(choices=[('Receipt', 'Receipt'), ('Sale', 'Sale'), ('Adjustment', 'Adjustment'), ('Cancellation', 'Cancellation'), ('Transfer', 'Transfer')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='api.inventory')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['inventory', 'createdAt'], name='stockmovement_inv_created_idx'), models.Index(fields=['createdAt'], name='stockmovement_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('snapshotId', models.BigAutoField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField()),
+                ('takenAt', models.DateTimeField()),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='api.inventory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['takenAt'], name='stocksnapshot_taken_idx')],
+                'constraints': [models.UniqueConstraint(fields=('inventory', 'takenAt'), name='stocksnapshot_inv_taken_uniq')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activitylog',
+            name='createdAt',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_alter_activitylog_createdat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('summaryId', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('paymentMethod', models.CharField(choices=[('Cash', 'Cash'), ('KHQR', 'KHQR')], max_length=20)),
+                ('invoiceCount', models.IntegerField(default=0)),
+                ('totalBeforeDiscount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'paymentMethod'), name='dailysales_date_method_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('summaryId', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='api.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='dailyproductsales_date_prod_uniq')],
+            },
+        ),
+    ]
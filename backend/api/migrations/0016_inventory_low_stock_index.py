@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_daily_sales_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('quantity__lte', models.F('reorderLevel'))), fields=['inventoryId'], name='inventory_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_inventory_low_stock_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'paymentMethod'], name='invoice_status_method_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['khqrMd5'], name='invoice_khqr_md5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['product', 'createdAt'], name='purchase_product_created_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# PostgreSQL-only GIN indexes for api/product_search.py. They are created
+# here rather than in Product.Meta so the schema still migrates on SQLite;
+# the indexed expressions must match the ones product_search queries with.
+SEARCH_INDEX_NAMES = ('product_search_vector_idx', 'product_name_trgm_idx', 'product_sku_trgm_idx')
+
+
+def search_indexes():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return [
+        GinIndex(
+            SearchVector('productName', 'skuCode', 'description', config='simple'),
+            name='product_search_vector_idx'
+        ),
+        GinIndex(fields=['productName'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+        GinIndex(fields=['skuCode'], opclasses=['gin_trgm_ops'], name='product_sku_trgm_idx'),
+    ]
+
+
+def add_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    Product = apps.get_model('api', 'Product')
+    for index in search_indexes():
+        schema_editor.add_index(Product, index)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in SEARCH_INDEX_NAMES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
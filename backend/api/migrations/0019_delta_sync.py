@@ -0,0 +1,67 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('tombstoneId', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=50)),
+                ('objectId', models.IntegerField()),
+                ('deletedAt', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['updatedAt', 'categoryId'], name='category_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['updatedAt', 'customerId'], name='customer_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['updatedAt', 'inventoryId'], name='inventory_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updatedAt', 'productId'], name='product_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subcategory',
+            index=models.Index(fields=['updatedAt', 'subcategoryId'], name='subcategory_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='synctombstone',
+            index=models.Index(fields=['deletedAt', 'tombstoneId'], name='synctombstone_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['createdAt', 'purchaseId'], name='purchase_created_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:06
+
+import api.media_storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_purchase_created_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='qrCodeImage',
+            field=models.ImageField(blank=True, null=True, storage=api.media_storage.get_media_storage, upload_to='qr_codes/'),
+        ),
+    ]
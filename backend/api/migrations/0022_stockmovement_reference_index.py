@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='movementType',
+            field=models.CharField(choices=[('Receipt', 'Receipt'), ('Sale', 'Sale'), ('Adjustment', 'Adjustment'), ('Cancellation', 'Cancellation')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['reference'], name='stockmovement_reference_idx'),
+        ),
+    ]
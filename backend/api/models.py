@@ -1,7 +1,65 @@
 from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
 
 from django.contrib.auth.models import AbstractUser
 
+from .media_storage import get_media_storage
+
+class FieldTrackerMixin:
+    """
+    Remembers the values of `tracked_fields` as they were loaded from the
+    database, so changes can be detected in signals without re-querying.
+    The snapshot lives on the instance itself and is reset after each save.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+    def get_previous_value(self, field_name):
+        """Value the field had when loaded or last saved (None for new or deferred fields)"""
+        return getattr(self, '_loaded_values', {}).get(field_name)
+
+    def has_changed(self, field_name):
+        loaded_values = getattr(self, '_loaded_values', {})
+        return field_name in loaded_values and loaded_values[field_name] != getattr(self, field_name)
+
+    def changed_fields(self):
+        """{field: (previous, current)} for every tracked field changed since it was loaded"""
+        return {
+            name: (previous, getattr(self, name))
+            for name, previous in getattr(self, '_loaded_values', {}).items()
+            if previous != getattr(self, name)
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Only fields actually written become the new "loaded" values
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and len(args) >= 4:
+            update_fields = args[3]  # save(force_insert, force_update, using, update_fields)
+        self._snapshot_tracked_fields(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot_tracked_fields(fields)
+
+    def _snapshot_tracked_fields(self, fields=None):
+        loaded_values = getattr(self, '_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        for name in self.tracked_fields:
+            if name in deferred or (fields is not None and name not in fields):
+                continue
+            loaded_values[name] = getattr(self, name)
+        self._loaded_values = loaded_values
+
+
 # Reusable role choices for model
 ROLE_CHOICES = [
     ('administrator', 'Administrator'),
@@ -19,7 +77,7 @@ class User(AbstractUser):
 class UserProfile(models.Model):
     profileId = models.AutoField(primary_key=True)
     user = models.OneToOneField('User', on_delete=models.CASCADE, related_name='profile')
-    qrCodeImage = models.ImageField(upload_to='qr_codes/', null=True, blank=True)  # QR code image file
+    qrCodeImage = models.ImageField(upload_to='qr_codes/', storage=get_media_storage, null=True, blank=True)  # QR code image file
     businessName = models.CharField(max_length=255, null=True, blank=True)
     businessAddress = models.TextField(null=True, blank=True)
     businessPhone = models.CharField(max_length=50, null=True, blank=True)
@@ -35,6 +93,12 @@ class Category(models.Model):
     categoryId = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updatedAt', 'categoryId'], name='category_updated_idx'),  # Delta sync
+        ]
 
     def __str__(self):
         return self.name
@@ -44,6 +108,12 @@ class SubCategory(models.Model):
     category = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='subcategories')
     name = models.CharField(max_length=255)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updatedAt', 'subcategoryId'], name='subcategory_updated_idx'),  # Delta sync
+        ]
 
     def __str__(self):
         return f"{self.name} → {self.category.name}"
@@ -83,12 +153,24 @@ class Product(models.Model):
     source = models.ForeignKey('Source', on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Active')
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updatedAt', 'productId'], name='product_updated_idx'),  # Delta sync
+        ]
 
     def __str__(self):
         return f"{self.productName} ({self.skuCode})"
 
 
-class Inventory(models.Model):
+# Inventory rows that need reordering. Queries must use this exact condition
+# for the database to pick the partial index below.
+LOW_STOCK = Q(quantity__lte=F('reorderLevel'))
+
+class Inventory(FieldTrackerMixin, models.Model):
+    tracked_fields = ('quantity',)
+
     inventoryId = models.AutoField(primary_key=True)
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='inventory_records')
     quantity = models.IntegerField()
@@ -96,10 +178,75 @@ class Inventory(models.Model):
     location = models.CharField(max_length=255)
     updatedAt = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Partial index holding only low-stock rows, so listing and
+            # counting them costs O(low-stock rows) rather than O(catalog)
+            models.Index(fields=['inventoryId'], condition=LOW_STOCK, name='inventory_low_stock_idx'),
+            models.Index(fields=['updatedAt', 'inventoryId'], name='inventory_updated_idx'),  # Delta sync
+        ]
+
     def __str__(self):
         return f"{self.product.productName} @ {self.location} — {self.quantity} units"
 
 
+# Reusable movement types for the stock ledger
+MOVEMENT_TYPE_CHOICES = [
+    ('Receipt', 'Receipt'),
+    ('Sale', 'Sale'),
+    ('Adjustment', 'Adjustment'),
+    ('Cancellation', 'Cancellation'),
+]
+
+class StockMovement(models.Model):
+    """Append-only ledger entry; the sum of an inventory's movements is its quantity."""
+    movementId = models.BigAutoField(primary_key=True)
+    inventory = models.ForeignKey('Inventory', on_delete=models.CASCADE, related_name='movements')
+    movementType = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES)
+    quantity = models.IntegerField()  # Signed: positive adds stock, negative removes it
+    reference = models.CharField(max_length=255, null=True, blank=True)  # e.g. 'Invoice #12', 'NewStock #3'
+    user = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    createdAt = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['inventory', 'createdAt'], name='stockmovement_inv_created_idx'),
+            models.Index(fields=['createdAt'], name='stockmovement_created_idx'),
+            models.Index(fields=['reference'], name='stockmovement_reference_idx'),  # Movements of one invoice
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only; record a new movement instead.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Stock movements are append-only and cannot be deleted.")
+
+    def __str__(self):
+        change = f"+{self.quantity}" if self.quantity > 0 else str(self.quantity)
+        return f"{self.movementType} {change} → Inventory #{self.inventory_id}"
+
+
+class StockSnapshot(models.Model):
+    """Ledger balance of one inventory row at a point in time."""
+    snapshotId = models.BigAutoField(primary_key=True)
+    inventory = models.ForeignKey('Inventory', on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    takenAt = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['inventory', 'takenAt'], name='stocksnapshot_inv_taken_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['takenAt'], name='stocksnapshot_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"Inventory #{self.inventory_id} = {self.quantity} @ {self.takenAt}"
+
+
 class NewStock(models.Model):
     newstockId = models.AutoField(primary_key=True)
     inventory = models.ForeignKey('Inventory', on_delete=models.CASCADE, related_name='stock_entries')
@@ -129,6 +276,12 @@ class Customer(models.Model):
     customerType = models.CharField(max_length=20, choices=CUSTOMER_TYPE_CHOICES)
     firstPurchaseDate = models.DateField(null=True, blank=True)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updatedAt', 'customerId'], name='customer_updated_idx'),  # Delta sync
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.customerType})"
@@ -146,7 +299,9 @@ INVOICE_STATUS_CHOICES = [
     ('Cancelled', 'Cancelled'),
 ]
 
-class Invoice(models.Model):
+class Invoice(FieldTrackerMixin, models.Model):
+    tracked_fields = ('status',)
+
     invoiceId = models.AutoField(primary_key=True)
     customer = models.ForeignKey('Customer', on_delete=models.SET_NULL, null=True, blank=True, related_name='invoices')
     customerName = models.CharField(max_length=255, default='Guest')  # Direct customer name input
@@ -172,6 +327,13 @@ class Invoice(models.Model):
     
     createdAt = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'paymentMethod'], name='invoice_status_method_idx'),
+            models.Index(fields=['khqrMd5'], name='invoice_khqr_md5_idx'),  # Payment lookup key
+            models.Index(fields=['createdAt', 'invoiceId'], name='invoice_created_idx'),  # Keyset pagination
+        ]
+
     def __str__(self):
         return f"Invoice #{self.invoiceId} — {self.customerName} — {self.status}"
 
@@ -186,6 +348,12 @@ class Purchase(models.Model):
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     createdAt = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'createdAt'], name='purchase_product_created_idx'),
+            models.Index(fields=['createdAt', 'purchaseId'], name='purchase_created_idx'),  # Exports by date
+        ]
+
     def __str__(self):
         return f"{self.quantity} × {self.product.productName if self.product else 'Unknown'} → Invoice #{self.invoice.invoiceId}"
     
@@ -216,6 +384,11 @@ class Transaction(models.Model):
     transactionDate = models.DateTimeField()
     recordedByUser = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, related_name='transactions_recorded')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['transactionDate', 'transactionId'], name='transaction_date_idx'),  # Keyset pagination
+        ]
+
     def __str__(self):
         return f"Txn #{self.transactionId} — {self.transactionStatus} ({self.amountPaid})"
     
@@ -224,7 +397,71 @@ class ActivityLog(models.Model):
     user = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, related_name='activity_logs')
     actionType = models.CharField(max_length=100)  # e.g., 'ADD_PRODUCT', 'DELETE_INVOICE'
     description = models.TextField()
-    createdAt = models.DateTimeField(auto_now_add=True)
+    createdAt = models.DateTimeField(default=timezone.now, editable=False)  # Set when the event happens, not when the batch is written
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['createdAt', 'logId'], name='activitylog_created_idx'),  # Keyset pagination
+        ]
+
+    def __str__(self):
+        return f"{self.actionType} by {self.user.username if self.user else 'Unknown'}"
+
+class DailySalesSummary(models.Model):
+    """
+    Paid sales per local day (REPORT_TIME_ZONE) and payment method, kept up
+    to date by api/sales_summary.py as invoices are paid or reversed.
+    """
+    summaryId = models.BigAutoField(primary_key=True)
+    date = models.DateField()
+    paymentMethod = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
+    invoiceCount = models.IntegerField(default=0)
+    totalBeforeDiscount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Sum of grandTotal
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'paymentMethod'], name='dailysales_date_method_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.paymentMethod}: {self.invoiceCount} invoices, {self.revenue}"
+
+
+class DailyProductSales(models.Model):
+    """Paid quantity and revenue per local day and product."""
+    summaryId = models.BigAutoField(primary_key=True)
+    date = models.DateField()
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Sum of line subtotals
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='dailyproductsales_date_prod_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} product #{self.product_id}: {self.quantity} sold, {self.revenue}"
+
+
+class SyncTombstone(models.Model):
+    """
+    Primary key of a deleted row, kept so offline terminals syncing with
+    /api/sync/ learn about the deletion. Pruned after
+    SYNC_TOMBSTONE_RETENTION_DAYS by `manage.py prune_sync_tombstones`.
+    """
+    tombstoneId = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=50)  # Model name, e.g. 'product'
+    objectId = models.IntegerField()
+    deletedAt = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deletedAt', 'tombstoneId'], name='synctombstone_deleted_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.actionType} by {self.user.username if self.user else 'Unknown'}"
\ No newline at end of file
+        return f"{self.model} #{self.objectId} deleted at {self.deletedAt}"
@@ -0,0 +1,193 @@
+"""
+Keyset (cursor) pagination for high-volume list endpoints.
+
+Pages are addressed by the ordering values of the last row seen instead of
+an OFFSET, so page 1000 costs the same single indexed range scan as page 1,
+and rows inserted while a client is paging never shift or duplicate results.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate on a compound key such as (createdAt, primary key).
+
+    Subclasses set `ordering` to the key (the last field must be unique) and
+    `page_size` to the default page length. Clients may ask for a different
+    length with `?page_size=` up to `max_page_size`.
+    """
+    ordering = ('-createdAt', '-pk')
+    page_size = 50
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        values, reverse = self.decode_cursor(request)
+        ordering = self.get_ordering(reverse)
+
+        if values is not None:
+            queryset = queryset.filter(self.get_after_filter(ordering, values))
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return list(self.ordering)
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def get_after_filter(self, ordering, values):
+        """
+        Build the row-value comparison `(a, b) > (x, y)` for the given ordering
+        as `a > x OR (a = x AND b > y)`, which every backend can index.
+        """
+        condition = Q()
+        equal_so_far = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_field(self, name):
+        if name == 'pk':
+            return self.model._meta.pk
+        return self.model._meta.get_field(name)
+
+    def encode_cursor(self, row, reverse):
+        values = [self.get_field(field.lstrip('-')).value_to_string(row) for field in self.ordering]
+        payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            raw_values = payload['v']
+            reverse = bool(payload.get('r', False))
+            if len(raw_values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw_values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        return values, reverse
+
+    def to_html(self):
+        return ''
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class ActivityLogPagination(KeysetPagination):
+    ordering = ('-createdAt', '-logId')
+    page_size = 100
+
+
+class InvoicePagination(KeysetPagination):
+    ordering = ('-createdAt', '-invoiceId')
+    page_size = 50
+
+
+class TransactionPagination(KeysetPagination):
+    ordering = ('-transactionDate', '-transactionId')
+    page_size = 50
+
+
+class StockMovementPagination(KeysetPagination):
+    ordering = ('-createdAt', '-movementId')
+    page_size = 100
+
+
+class LowStockPagination(KeysetPagination):
+    # Walks the low-stock partial index in key order
+    ordering = ('inventoryId',)
+    page_size = 100
@@ -0,0 +1,108 @@
+"""
+Product Images
+Uploaded product images are decoded with Pillow and re-encoded to WebP in a
+few sizes, instead of storing the client's file verbatim, so terminals on
+slow connections can load a small thumbnail for the product grid.
+
+The full size (at most FULL_SIZE pixels on its longest edge) is stored in
+the content-addressed media storage as products/<shard>/<hash>.webp, and
+each of VARIANTS next to it as <hash>_<variant>.webp; variant_name()
+derives a variant's URL from the stored image URL. The
+rotation in the EXIF Orientation tag is applied, then all metadata (EXIF, GPS
+position, camera details, ICC profile) is dropped.
+
+Decoding a large photo takes a few hundred MB and most of a CPU, so images
+are processed by a small thread pool (PRODUCT_IMAGE_WORKERS): a burst of
+uploads queues up instead of decoding side by side in every web worker.
+"""
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .media_storage import media_storage
+
+FULL_SIZE = 1280
+VARIANTS = {  # Variant -> longest edge in pixels
+    'medium': 480,
+    'thumbnail': 160,
+}
+MAX_PIXELS = 40_000_000  # Refuse to decode anything larger (e.g. a crafted 20000x20000 PNG)
+
+_lock = threading.Lock()
+_executor = None
+
+
+class ImageProcessingError(ValueError):
+    """The upload isn't an image Pillow can decode, or is too large to"""
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2),
+                    thread_name_prefix='product-image'
+                )
+    return _executor
+
+
+def process_image(file, quality=None):
+    """
+    Decode an image file and encode it to WebP at each size.
+    Returns ({'full': bytes, <variant>: bytes, ...}, (width, height)).
+    """
+    quality = quality or getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+    try:
+        image = Image.open(file)
+        if image.width * image.height > MAX_PIXELS:
+            raise ImageProcessingError(f'Image too large ({image.width}x{image.height} pixels)')
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale directly, which is much cheaper
+        image.draft('RGB', (FULL_SIZE, FULL_SIZE))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageProcessingError(f'Not a valid image: {str(e)}')
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    image.info = {}  # Nothing from the original file's metadata is written out
+
+    encoded = {}
+    for name, size in (('full', FULL_SIZE), *VARIANTS.items()):
+        # Each size is scaled down from the previous one (largest first)
+        image.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+        if name == 'full':
+            dimensions = image.size
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+        encoded[name] = buffer.getvalue()
+    return encoded, dimensions
+
+
+def variant_name(name, variant):
+    """Storage path or URL of a size of a product image stored by save_product_image()"""
+    if variant == 'full' or not name or not name.endswith('.webp'):
+        return name  # Uploaded before images were processed, or an external URL
+    return name[:-len('.webp')] + f'_{variant}.webp'
+
+
+def save_product_image(file):
+    """
+    Process an uploaded image on the image thread pool and store every size;
+    an image uploaded before is not written again.
+    Returns ({'full': path, <variant>: path, ...}, (width, height)).
+    Raises ImageProcessingError for files that aren't usable images.
+    """
+    encoded, dimensions = _get_executor().submit(process_image, file).result()
+    full = ContentFile(encoded['full'])
+    path = media_storage.hashed_name('products/image.webp', full)
+    # Variants first: once the full size exists, a later upload skips them all
+    names = {name: variant_name(path, name) for name in VARIANTS}
+    for name, file_name in names.items():
+        media_storage.save_if_missing(file_name, ContentFile(encoded[name]))
+    names['full'] = media_storage.save_if_missing(path, full)
+    return names, dimensions
@@ -0,0 +1,151 @@
+"""
+Product Search
+Server-side catalog search and filtering for ProductViewSet, so terminals
+fetch matching products instead of the whole catalog.
+
+On PostgreSQL, search terms are matched by prefix against a full-text
+vector of productName, skuCode and description, and by trigram similarity
+against productName and skuCode (typos, partial SKUs); both are backed by
+GIN indexes created in migration 0018. Other databases fall back to
+case-insensitive substring matching with a simple rank.
+
+Facet counts for status, subcategory and source come from one grouped
+query over the search results.
+"""
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from rest_framework.exceptions import ValidationError
+
+# Must stay identical to the expression indexed in migration 0018, or the
+# planner can't use the index
+SEARCH_CONFIG = 'simple'  # Product names mix English, Khmer and brand names; don't stem
+SEARCH_FIELDS = ('productName', 'skuCode', 'description')
+TRIGRAM_FIELDS = ('productName', 'skuCode')
+
+# Facet -> (ORM key, label shown to the user)
+FACET_KEYS = {'status': 'status', 'subcategory': 'subcategory_id', 'source': 'source_id'}
+FACET_LABELS = {'status': 'status', 'subcategory': 'subcategory__name', 'source': 'source__name'}
+
+MAX_TERM_LENGTH = 100
+
+
+# tsquery operators; \w would also split Khmer words at their vowel signs
+TSQUERY_SYNTAX = re.compile(r"[&|!():*<>'\\]")
+
+
+def search_terms(query):
+    """Words of a search query, stripped of tsquery syntax"""
+    return TSQUERY_SYNTAX.sub(' ', query[:MAX_TERM_LENGTH]).split()
+
+
+def search_products(queryset, query):
+    """Filter a product queryset to matches for `query`, annotated with `rank` (higher is better)"""
+    words = search_terms(query)
+    if not words:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, ' '.join(words), words)
+    return _fallback_search(queryset, words)
+
+
+def _postgres_search(queryset, text, words):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+
+    vector = SearchVector(*SEARCH_FIELDS, config=SEARCH_CONFIG)
+    # Prefix match every word, so results narrow as the cashier types
+    query = SearchQuery(' & '.join(f'{word}:*' for word in words), config=SEARCH_CONFIG, search_type='raw')
+
+    matches = Q(search=query)
+    for field in TRIGRAM_FIELDS:
+        matches |= Q(**{f'{field}__trigram_similar': text})
+
+    return queryset.alias(search=vector).filter(matches).annotate(
+        rank=SearchRank(F('search'), query)
+        + TrigramSimilarity('productName', text)
+        + Case(When(skuCode__iexact=text, then=Value(1.0)), default=Value(0.0))  # Scanned barcodes first
+    )
+
+
+def _fallback_search(queryset, words):
+    for word in words:
+        queryset = queryset.filter(
+            Q(productName__icontains=word) | Q(skuCode__icontains=word) | Q(description__icontains=word)
+        )
+    text = ' '.join(words)
+    return queryset.annotate(rank=Case(
+        When(skuCode__iexact=text, then=Value(3)),
+        When(productName__istartswith=text, then=Value(2)),
+        When(productName__icontains=text, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def parse_filters(params):
+    """
+    Product filters from query parameters as two dicts of ORM lookups: the
+    price range, and the facet filters (status, subcategory, source), which
+    facet_counts needs separately. Raises ValidationError for malformed values.
+    """
+    filters = {}
+    for name, lookup in (('min_price', 'salePrice__gte'), ('max_price', 'salePrice__lte')):
+        if params.get(name):
+            try:
+                filters[lookup] = Decimal(params[name])
+            except InvalidOperation:
+                raise ValidationError({name: 'Must be a number'})
+
+    facet_filters = {}
+    if params.get('status'):
+        facet_filters['status'] = params['status']
+    for name in ('subcategory', 'source'):
+        if params.get(name):
+            try:
+                facet_filters[FACET_KEYS[name]] = int(params[name])
+            except ValueError:
+                raise ValidationError({name: 'Must be an id'})
+    return filters, facet_filters
+
+
+def facet_counts(queryset, facet_filters):
+    """
+    Counts per status, subcategory and source in one grouped query, plus
+    the number of products matching every filter.
+
+    Each facet counts the products matching every *other* facet filter, so
+    picking a subcategory still shows how many products the other
+    subcategories have. `queryset` must not have the facet filters applied.
+    """
+    groups = (
+        queryset.order_by()
+        .values(*dict.fromkeys([*FACET_KEYS.values(), *FACET_LABELS.values()]))
+        .annotate(count=Count('pk'))
+    )
+
+    facets = {facet: defaultdict(lambda: {'count': 0}) for facet in FACET_KEYS}
+    total = 0
+    for group in groups:
+        matched = {
+            facet: key not in facet_filters or group[key] == facet_filters[key]
+            for facet, key in FACET_KEYS.items()
+        }
+        if all(matched.values()):
+            total += group['count']
+        for facet, key in FACET_KEYS.items():
+            if not all(ok for other, ok in matched.items() if other != facet):
+                continue
+            bucket = facets[facet][group[key]]
+            bucket['count'] += group['count']
+            bucket['label'] = group[FACET_LABELS[facet]]
+
+    return total, {
+        facet: sorted(
+            ({'value': value, **bucket} for value, bucket in buckets.items()),
+            key=lambda bucket: -bucket['count']
+        )
+        for facet, buckets in facets.items()
+    }
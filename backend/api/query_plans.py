@@ -0,0 +1,133 @@
+"""
+Query Plans
+Registry of the hot queries behind the busiest endpoints and workers, and
+helpers to EXPLAIN them and find sequential scans. Used by
+`manage.py explain_hot_queries` to catch plan regressions (a dropped index,
+a query no longer matching its index) before the tables are big enough for
+them to hurt.
+
+Register new hot paths with @hot_query; build the queryset the same way the
+code path does so the plan is the one production runs.
+"""
+import json
+import re
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+from .khqr_payments import pending_khqr_invoices
+from .models import LOW_STOCK, ActivityLog, Inventory, Invoice, Product, Purchase, SyncTombstone, Transaction
+from .pagination import ActivityLogPagination, InvoicePagination, LowStockPagination, TransactionPagination
+
+HOT_QUERIES = {}
+
+
+def hot_query(name):
+    def register(build):
+        HOT_QUERIES[name] = build
+        return build
+    return register
+
+
+@hot_query('khqr-payment-lookup')
+def payment_lookup():
+    return Invoice.objects.filter(khqrMd5='0' * 32)
+
+
+@hot_query('khqr-pending-invoices')
+def pending_invoices():
+    return pending_khqr_invoices().order_by('invoiceId').only('invoiceId', 'khqrMd5', 'createdByUser', 'status')
+
+
+@hot_query('low-stock')
+def low_stock():
+    return Inventory.objects.filter(LOW_STOCK).select_related('product').order_by(
+        *LowStockPagination.ordering
+    )[:LowStockPagination.page_size + 1]
+
+
+@hot_query('invoice-listing')
+def invoice_listing():
+    return Invoice.objects.select_related('createdByUser').order_by(
+        *InvoicePagination.ordering
+    )[:InvoicePagination.page_size + 1]
+
+
+@hot_query('activity-log-listing')
+def activity_log_listing():
+    return ActivityLog.objects.select_related('user').order_by(
+        *ActivityLogPagination.ordering
+    )[:ActivityLogPagination.page_size + 1]
+
+
+@hot_query('transaction-listing')
+def transaction_listing():
+    return Transaction.objects.order_by(*TransactionPagination.ordering)[:TransactionPagination.page_size + 1]
+
+
+@hot_query('product-sales-history')
+def product_sales_history():
+    return Purchase.objects.filter(product_id=1, createdAt__gte=timezone.now() - timedelta(days=30))
+
+
+@hot_query('delta-sync-products')
+def delta_sync_products():
+    return Product.objects.filter(updatedAt__gte=timezone.now() - timedelta(hours=1)).order_by('updatedAt', 'productId')
+
+
+@hot_query('delta-sync-tombstones')
+def delta_sync_tombstones():
+    return SyncTombstone.objects.filter(deletedAt__gte=timezone.now() - timedelta(hours=1)).order_by(
+        'deletedAt', 'tombstoneId'
+    )
+
+
+def explain(queryset):
+    """
+    Plan of a queryset as (raw plan text, [(table, kind)] of every table
+    read). kind is 'seq' for a full table scan, 'index' otherwise.
+    """
+    if connection.vendor == 'postgresql':
+        raw = queryset.explain(format='json')
+        return raw, list(_postgres_scans(json.loads(raw)[0]['Plan']))
+    if connection.vendor == 'sqlite':
+        raw = queryset.explain()
+        return raw, list(_sqlite_scans(raw))
+    raise NotImplementedError(f"Plan analysis is not supported on {connection.vendor}")
+
+
+def _postgres_scans(node):
+    table = node.get('Relation Name')
+    if table:
+        yield table, 'seq' if node['Node Type'] == 'Seq Scan' else 'index'
+    for child in node.get('Plans', []):
+        yield from _postgres_scans(child)
+
+
+# "SEARCH ..." is an index seek. "SCAN api_invoice" reads the whole table;
+# "SCAN api_invoice USING INDEX ..." walks an index in order and stops at the
+# LIMIT, unless the rows still need sorting afterwards, in which case every
+# row is read just the same.
+SQLITE_SCAN = re.compile(r'\b(SCAN|SEARCH) (?:TABLE )?(\w+)(.*)$')
+
+
+def _sqlite_scans(plan):
+    sorted_after = 'USE TEMP B-TREE FOR ORDER BY' in plan
+    for line in plan.splitlines():
+        match = SQLITE_SCAN.search(line)
+        if not match:
+            continue
+        operation, table, rest = match.groups()
+        full_scan = operation == 'SCAN' and ('INDEX' not in rest or sorted_after)
+        yield table, 'seq' if full_scan else 'index'
+
+
+def table_rows(table):
+    """Row count of a table: the planner's estimate on PostgreSQL, an exact count elsewhere"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            return max(row[0], 0) if row else 0
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,53 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class QRImageRenderer(BaseRenderer):
+    """
+    Lets clients ask for QR images by Accept header. Views return the image
+    bytes themselves; error bodies are still rendered as JSON.
+    """
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+class PNGRenderer(QRImageRenderer):
+    media_type = 'image/png'
+    format = 'png'
+
+
+class SVGRenderer(QRImageRenderer):
+    media_type = 'image/svg+xml'
+    format = 'svg'
+
+
+class PDFRenderer(QRImageRenderer):
+    """Invoice PDFs, passed through the same way as QR images"""
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Lets clients ask for exports by Accept header. The export view streams
+    its own response; error bodies are still rendered as JSON.
+    """
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
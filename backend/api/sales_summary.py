@@ -0,0 +1,249 @@
+"""
+Sales Summary
+Daily sales aggregates maintained incrementally. A paid invoice is added to
+DailySalesSummary / DailyProductSales for the local day it was paid (in
+REPORT_TIME_ZONE) and taken back out if it is cancelled, reopened or
+deleted, so sales reports read one row per day and payment method instead
+of scanning every invoice and purchase. Updates are applied after the
+invoice's transaction commits (see api/signals.py), so a crash in between
+can leave the tables behind.
+
+Run `manage.py rebuild_sales_summary` to backfill or repair the tables.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import Coalesce, RowNumber, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import DailyProductSales, DailySalesSummary, Invoice, Purchase
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ('invoiceCount', 'totalBeforeDiscount', 'discount', 'tax', 'revenue')
+PRODUCT_FIELDS = ('quantity', 'revenue')
+
+PERIODS = {
+    'day': None,
+    'week': TruncWeek,  # Weeks start on Monday
+    'month': TruncMonth,
+}
+
+# Default report length per period when no start date is given
+DEFAULT_SPANS = {
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12),
+    'month': timedelta(days=365),
+}
+
+
+def report_timezone():
+    return ZoneInfo(getattr(settings, 'REPORT_TIME_ZONE', settings.TIME_ZONE))
+
+
+def local_today():
+    return timezone.localtime(timezone.now(), report_timezone()).date()
+
+
+def sales_date(paid_at, created_at, tz=None):
+    """Local day a sale counts towards: when it was paid, or created if paid on creation"""
+    return timezone.localtime(paid_at or created_at, tz or report_timezone()).date()
+
+
+@transaction.atomic
+def record_sales(invoice_ids, sign=1):
+    """
+    Add paid invoices to the daily summaries (sign=-1 takes them back out).
+    Reads the invoices and their line items itself, so callers only pass
+    ids, and runs a constant number of queries however many are passed.
+    """
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return
+
+    tz = report_timezone()
+    dates = {}
+    summary_deltas = defaultdict(lambda: dict.fromkeys(SUMMARY_FIELDS, 0))
+    invoices = Invoice.objects.filter(pk__in=invoice_ids).values_list(
+        'invoiceId', 'paymentMethod', 'totalBeforeDiscount', 'discount', 'tax', 'grandTotal', 'paidAt', 'createdAt'
+    )
+    for invoice_id, method, total_before_discount, discount, tax, grand_total, paid_at, created_at in invoices:
+        dates[invoice_id] = day = sales_date(paid_at, created_at, tz)
+        delta = summary_deltas[(day, method)]
+        delta['invoiceCount'] += sign
+        delta['totalBeforeDiscount'] += sign * total_before_discount
+        delta['discount'] += sign * discount
+        delta['tax'] += sign * tax
+        delta['revenue'] += sign * grand_total
+
+    product_deltas = defaultdict(lambda: dict.fromkeys(PRODUCT_FIELDS, 0))
+    purchases = Purchase.objects.filter(invoice_id__in=dates, product__isnull=False).values_list(
+        'invoice_id', 'product_id', 'quantity', 'subtotal'
+    )
+    for invoice_id, product_id, quantity, subtotal in purchases:
+        delta = product_deltas[(dates[invoice_id], product_id)]
+        delta['quantity'] += sign * quantity
+        delta['revenue'] += sign * subtotal
+
+    _apply_deltas(DailySalesSummary, ('date', 'paymentMethod'), summary_deltas, SUMMARY_FIELDS)
+    _apply_deltas(DailyProductSales, ('date', 'product_id'), product_deltas, PRODUCT_FIELDS)
+
+
+def _apply_deltas(model, key_fields, deltas, fields):
+    """
+    Add deltas to summary rows keyed by `key_fields`: create missing rows,
+    lock the affected rows in key order (so concurrent updates can't
+    deadlock), then write them back with one bulk_update.
+    """
+    if not deltas:
+        return
+
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in deltas],
+        ignore_conflicts=True
+    )
+    first, second = key_fields
+    rows = model.objects.select_for_update().filter(**{
+        f'{first}__in': {key[0] for key in deltas},
+        f'{second}__in': {key[1] for key in deltas},
+    }).order_by(*key_fields)
+
+    changed = []
+    for row in rows:
+        delta = deltas.get((getattr(row, first), getattr(row, second)))
+        if delta is None:
+            continue
+        for field, value in delta.items():
+            setattr(row, field, getattr(row, field) + value)
+        changed.append(row)
+    model.objects.bulk_update(changed, fields)
+
+
+@transaction.atomic
+def rebuild_sales_summary(start=None, end=None):
+    """
+    Recompute the summaries from invoices and purchases for local dates
+    between `start` and `end` (inclusive; default: all time), aggregating
+    in the database. Returns (summary rows, product rows) written.
+    """
+    tz = report_timezone()
+    sold_on = TruncDate(Coalesce('paidAt', 'createdAt'), tzinfo=tz)
+    line_sold_on = TruncDate(Coalesce('invoice__paidAt', 'invoice__createdAt'), tzinfo=tz)
+
+    date_range = Q()
+    if start:
+        date_range &= Q(date__gte=start)
+    if end:
+        date_range &= Q(date__lte=end)
+
+    DailySalesSummary.objects.filter(date_range).delete()
+    DailyProductSales.objects.filter(date_range).delete()
+
+    summaries = (
+        Invoice.objects.filter(status='Paid')
+        .annotate(date=sold_on).filter(date_range)
+        .values('date', 'paymentMethod')
+        .annotate(
+            invoiceCount=Count('invoiceId'),
+            totalBeforeDiscount_sum=Sum('totalBeforeDiscount'),
+            discount_sum=Sum('discount'),
+            tax_sum=Sum('tax'),
+            revenue=Sum('grandTotal'),
+        )
+        .order_by()
+    )
+    summary_rows = DailySalesSummary.objects.bulk_create([
+        DailySalesSummary(
+            date=row['date'], paymentMethod=row['paymentMethod'], invoiceCount=row['invoiceCount'],
+            totalBeforeDiscount=row['totalBeforeDiscount_sum'], discount=row['discount_sum'],
+            tax=row['tax_sum'], revenue=row['revenue']
+        )
+        for row in summaries
+    ], batch_size=1000)
+
+    products = (
+        Purchase.objects.filter(invoice__status='Paid', product__isnull=False)
+        .annotate(date=line_sold_on).filter(date_range)
+        .values('date', 'product_id')
+        .annotate(quantity_sum=Sum('quantity'), revenue=Sum('subtotal'))
+        .order_by()
+    )
+    product_rows = DailyProductSales.objects.bulk_create([
+        DailyProductSales(date=row['date'], product_id=row['product_id'],
+                          quantity=row['quantity_sum'], revenue=row['revenue'])
+        for row in products
+    ], batch_size=1000)
+
+    logger.info(f"Rebuilt sales summary: {len(summary_rows)} daily rows, {len(product_rows)} product rows")
+    return len(summary_rows), len(product_rows)
+
+
+def _period_of(period):
+    trunc = PERIODS[period]
+    return F('date') if trunc is None else trunc('date')
+
+
+def sales_report(start, end, period='day', top=5):
+    """
+    Revenue, tax, discount, payment-method split and top products per
+    period between two local dates (inclusive), read from the summaries.
+    """
+    period_of = _period_of(period)
+
+    buckets = {}
+    rows = (
+        DailySalesSummary.objects.filter(date__gte=start, date__lte=end)
+        .annotate(period=period_of)
+        .values('period', 'paymentMethod')
+        .annotate(**{f'{field}_sum': Sum(field) for field in SUMMARY_FIELDS})
+        .order_by('period', 'paymentMethod')
+    )
+    for row in rows:
+        bucket = buckets.setdefault(row['period'], {
+            'period': row['period'].isoformat(),
+            **{field: 0 for field in SUMMARY_FIELDS},
+            'paymentMethods': {},
+            'topProducts': [],
+        })
+        for field in SUMMARY_FIELDS:
+            bucket[field] += row[f'{field}_sum']
+        bucket['paymentMethods'][row['paymentMethod']] = {
+            'invoiceCount': row['invoiceCount_sum'],
+            'revenue': _money(row['revenue_sum']),
+        }
+
+    if top:
+        ranked = (
+            DailyProductSales.objects.filter(date__gte=start, date__lte=end)
+            .annotate(period=period_of)
+            .values('period', 'product_id', 'product__productName')
+            .annotate(quantity_sum=Sum('quantity'), revenue_sum=Sum('revenue'))
+            .annotate(rank=Window(RowNumber(), partition_by=[F('period')], order_by=F('revenue_sum').desc()))
+            .filter(rank__lte=top)
+            .order_by('period', 'rank')
+        )
+        for row in ranked:
+            bucket = buckets.get(row['period'])
+            if bucket is not None:
+                bucket['topProducts'].append({
+                    'productId': row['product_id'],
+                    'productName': row['product__productName'],
+                    'quantity': row['quantity_sum'],
+                    'revenue': _money(row['revenue_sum']),
+                })
+
+    results = []
+    for bucket in buckets.values():
+        for field in SUMMARY_FIELDS[1:]:
+            bucket[field] = _money(bucket[field])
+        results.append(bucket)
+    return results
+
+
+def _money(value):
+    return str(Decimal(value or 0).quantize(Decimal('0.01')))
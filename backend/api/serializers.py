@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
 from .models import (
     User,
     UserProfile,
@@ -13,8 +16,11 @@ from .models import (
     Invoice,
     Purchase,
     Transaction,
-    ActivityLog
+    ActivityLog,
+    StockMovement
 )
+from .activity_log import log_activity
+from .stock_ledger import record_movements
 
 class UserSerializer(serializers.ModelSerializer):
     # Make password write-only so it won't be exposed in API responses
@@ -50,12 +56,12 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['categoryId', 'name', 'createdAt']
+        fields = ['categoryId', 'name', 'createdAt', 'updatedAt']
         
 class SubCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = SubCategory
-        fields = ['subcategoryId', 'category', 'name', 'createdAt']
+        fields = ['subcategoryId', 'category', 'name', 'createdAt', 'updatedAt']
 
 class SourceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -65,7 +71,7 @@ class SourceSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['productId', 'productName', 'description', 'image', 'skuCode', 'unit', 'costPrice', 'salePrice', 'discount', 'status', 'subcategory', 'source', 'createdAt']
+        fields = ['productId', 'productName', 'description', 'image', 'skuCode', 'unit', 'costPrice', 'salePrice', 'discount', 'status', 'subcategory', 'source', 'createdAt', 'updatedAt']
     
     def to_representation(self, instance):
         """Hide costPrice from staff users"""
@@ -84,6 +90,26 @@ class InventorySerializer(serializers.ModelSerializer):
         model = Inventory
         fields = ['inventoryId', 'product', 'quantity', 'reorderLevel', 'location', 'updatedAt']
 
+class LowStockSerializer(serializers.ModelSerializer):
+    """Inventory row with the product details a reorder list needs (product must be select_related)"""
+    productName = serializers.CharField(source='product.productName', read_only=True)
+    skuCode = serializers.CharField(source='product.skuCode', read_only=True)
+    unit = serializers.CharField(source='product.unit', read_only=True)
+    shortage = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Inventory
+        fields = ['inventoryId', 'product', 'productName', 'skuCode', 'unit', 'quantity', 'reorderLevel',
+                  'shortage', 'location', 'updatedAt']
+
+    def get_shortage(self, obj):
+        return obj.reorderLevel - obj.quantity
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ['movementId', 'inventory', 'movementType', 'quantity', 'reference', 'user', 'createdAt']
+
 class NewStockSerializer(serializers.ModelSerializer):
     productName = serializers.SerializerMethodField()
     productSku = serializers.SerializerMethodField()
@@ -111,13 +137,24 @@ class NewStockSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
-        fields = ['customerId', 'name', 'businessAddress', 'phone', 'email', 'customerType', 'firstPurchaseDate', 'createdAt']
+        fields = ['customerId', 'name', 'businessAddress', 'phone', 'email', 'customerType', 'firstPurchaseDate', 'createdAt', 'updatedAt']
 
 class PurchaseNestedSerializer(serializers.ModelSerializer):
     class Meta:
         model = Purchase
         fields = ['product', 'quantity', 'pricePerUnit', 'discount']
 
+class PurchaseLineItemSerializer(serializers.Serializer):
+    """
+    Write-only invoice line. The product is accepted as a raw PK so that
+    InvoiceSerializer can resolve every line's product in a single query
+    instead of one lookup per line.
+    """
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+    pricePerUnit = serializers.DecimalField(max_digits=10, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, default=Decimal('0.00'))
+
 class PurchaseReadSerializer(serializers.ModelSerializer):
     """Serializer for reading purchase details with product name"""
     productName = serializers.CharField(source='product.productName', read_only=True)
@@ -128,7 +165,7 @@ class PurchaseReadSerializer(serializers.ModelSerializer):
 
 class InvoiceSerializer(serializers.ModelSerializer):
     # Allow submitting purchases together
-    lineItems = PurchaseNestedSerializer(many=True, write_only=True)
+    lineItems = PurchaseLineItemSerializer(many=True, write_only=True)
     
     # Tax percentage input (user enters percentage like 10 for 10%)
     taxPercentage = serializers.DecimalField(max_digits=5, decimal_places=2, write_only=True, required=False, default=Decimal('0.00'))
@@ -152,23 +189,29 @@ class InvoiceSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['invoiceId', 'createdByUser', 'createdAt', 'paidAt']
 
+    def validate_lineItems(self, line_items):
+        """Resolve all line-item products with one query"""
+        if not line_items:
+            raise serializers.ValidationError("At least one line item is required.")
+
+        product_ids = {item['product'] for item in line_items}
+        products = Product.objects.in_bulk(product_ids)
+
+        missing = sorted(product_ids - products.keys())
+        if missing:
+            raise serializers.ValidationError(f"Invalid product id(s): {', '.join(map(str, missing))}")
+
+        for item in line_items:
+            item['product'] = products[item['product']]
+        return line_items
+
+    @transaction.atomic
     def create(self, validated_data):
         line_items_data = validated_data.pop('lineItems')
-        
-        # Validate inventory availability BEFORE creating invoice
-        for item_data in line_items_data:
-            try:
-                inventory = Inventory.objects.get(product=item_data['product'])
-                if inventory.quantity < item_data['quantity']:
-                    raise serializers.ValidationError({
-                        'lineItems': f"Insufficient stock for {item_data['product'].productName}. "
-                                   f"Available: {inventory.quantity}, Requested: {item_data['quantity']}"
-                    })
-            except Inventory.DoesNotExist:
-                raise serializers.ValidationError({
-                    'lineItems': f"No inventory record found for product: {item_data['product'].productName}"
-                })
-        
+
+        # Reserve stock first: lock rows and decrement in one statement
+        inventory_changes = self._reserve_stock(line_items_data)
+
         # Calculate totals before creating invoice
         total_before_discount = Decimal('0.00')
         total_discount = Decimal('0.00')
@@ -194,20 +237,111 @@ class InvoiceSerializer(serializers.ModelSerializer):
         # Now create the invoice with all required fields
         invoice = Invoice.objects.create(**validated_data)
 
-        # Create purchase line items
-        # NOTE: Inventory reduction is handled by the signal in signals.py
+        # Create purchase line items in one INSERT.
+        # NOTE: bulk_create does not fire post_save, so the inventory signal in
+        # signals.py does not decrement stock a second time.
+        purchases = []
         for item_data in line_items_data:
             subtotal = item_data['pricePerUnit'] * item_data['quantity']
             subtotal -= item_data.get('discount', Decimal('0.00'))
 
-            Purchase.objects.create(
+            purchases.append(Purchase(
                 invoice=invoice,
                 subtotal=subtotal,
                 **item_data
+            ))
+        Purchase.objects.bulk_create(purchases)
+
+        self._log_inventory_changes(inventory_changes, invoice)
+        record_movements([
+            StockMovement(
+                inventory=inventory,
+                movementType='Sale',
+                quantity=new_qty - previous_qty,
+                reference=f"Invoice #{invoice.invoiceId}",
+                user=invoice.createdByUser
             )
+            for inventory, previous_qty, new_qty in inventory_changes
+        ])
 
         return invoice
 
+    def _reserve_stock(self, line_items_data):
+        """
+        Lock the inventory rows for every product on the ticket and decrement
+        them with a single conditional UPDATE.
+
+        Rows are locked in primary-key order so two concurrent tickets touching
+        the same products always acquire locks in the same order and cannot
+        deadlock. The UPDATE only matches rows that still hold enough stock, so
+        a row that would go negative is never written.
+
+        Returns a list of (inventory, previous_quantity, new_quantity) tuples.
+        """
+        requested = {}
+        products = {}
+        for item_data in line_items_data:
+            product = item_data['product']
+            products[product.pk] = product
+            requested[product.pk] = requested.get(product.pk, 0) + item_data['quantity']
+
+        # One SELECT ... FOR UPDATE for all products, in a deterministic order.
+        # If a product has several inventory rows, the oldest one is used.
+        inventories = {}
+        locked_rows = (
+            Inventory.objects.select_for_update()
+            .filter(product_id__in=requested.keys())
+            .order_by('inventoryId')
+        )
+        for inventory in locked_rows:
+            inventories.setdefault(inventory.product_id, inventory)
+
+        for product_id, quantity in requested.items():
+            inventory = inventories.get(product_id)
+            if inventory is None:
+                raise serializers.ValidationError({
+                    'lineItems': f"No inventory record found for product: {products[product_id].productName}"
+                })
+            if inventory.quantity < quantity:
+                raise serializers.ValidationError({
+                    'lineItems': f"Insufficient stock for {products[product_id].productName}. "
+                               f"Available: {inventory.quantity}, Requested: {quantity}"
+                })
+
+        guard = Q()
+        whens = []
+        for product_id, quantity in requested.items():
+            inventory = inventories[product_id]
+            guard |= Q(pk=inventory.pk, quantity__gte=quantity)
+            whens.append(When(pk=inventory.pk, then=F('quantity') - quantity))
+
+        updated = Inventory.objects.filter(guard).update(
+            quantity=Case(*whens, default=F('quantity')),
+            updatedAt=timezone.now(),
+        )
+        if updated != len(requested):
+            # Only possible if the rows were changed without taking the lock
+            raise serializers.ValidationError({
+                'lineItems': "Stock changed while the invoice was being created. Please try again."
+            })
+
+        changes = []
+        for product_id, quantity in requested.items():
+            inventory = inventories[product_id]
+            inventory.product = products[product_id]  # Reuse the loaded product, no extra query
+            changes.append((inventory, inventory.quantity, inventory.quantity - quantity))
+        return changes
+
+    def _log_inventory_changes(self, inventory_changes, invoice):
+        """Queue the inventory adjustment logs for a new invoice (written in one batch)"""
+        for inventory, previous_qty, new_qty in inventory_changes:
+            log_activity(
+                user=invoice.createdByUser,
+                actionType='UPDATE_INVENTORY',
+                description=f"Inventory adjusted for {inventory.product.productName}: "
+                            f"{previous_qty} → {new_qty} ({new_qty - previous_qty}) - Invoice #{invoice.invoiceId}"
+            )
+
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
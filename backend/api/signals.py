@@ -1,35 +1,49 @@
-from django.db.models.signals import post_save, pre_save, post_delete
+import logging
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from .models import (
-    Purchase, Inventory, Invoice, ActivityLog,
+    Purchase, Inventory, Invoice,
     Product, Category, SubCategory, Source, NewStock, Customer, User
 )
+from .activity_log import log_activity
+from .catalog_cache import invalidate_catalog
+from .delta_sync import record_tombstones
+from .sales_summary import record_sales
+from .stock_ledger import record_movement, restock_invoice
 
-# Store previous states for activity logging
-_model_previous_states = {}
-_invoice_previous_status = {}
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Purchase)
 def update_inventory_on_purchase(sender, instance, created, **kwargs):
     """
-    Automatically reduce inventory when a purchase is created.
-    This signal is triggered when creating invoices with line items.
-    NOTE: Stock validation is done in InvoiceSerializer.create() before creating Purchase records.
+    Automatically reduce inventory when a purchase is created one at a time
+    (admin inline, purchases API).
+    NOTE: Invoice line items are bulk-created by InvoiceSerializer.create(),
+    which locks and decrements stock itself, so they never reach this signal.
     """
-    if created:
-        try: 
-            inventory = Inventory.objects.get(product=instance.product)
-            
-            # Reduce inventory (validation already done in serializer)
-            inventory.quantity -= instance.quantity
-            inventory.save()
-        except Inventory.DoesNotExist:
-            # This should not happen if serializer validation works correctly
-            # But we log it for debugging purposes
-            print(f"WARNING: No inventory record found for product: {instance.product.productName}")
-            pass  # Don't raise error in signal to avoid transaction issues
+    if not created:
+        return
+    with transaction.atomic():
+        # Lock the row like InvoiceSerializer.create does, so concurrent sales
+        # can't overwrite each other; several rows per product use the oldest
+        inventory = (
+            Inventory.objects.select_for_update()
+            .filter(product_id=instance.product_id)
+            .order_by('inventoryId')
+            .first()
+        )
+        if inventory is None:
+            # Don't raise in the signal; the purchase itself is still valid
+            logger.warning("No inventory record found for product: %s", instance.product)
+            return
+        
+        # Reduce inventory (validation already done in serializer)
+        inventory.quantity -= instance.quantity
+        inventory.save()
+        record_movement(inventory, 'Sale', -instance.quantity, reference=f"Invoice #{instance.invoice_id}")
 
 
 # ==================== ACTIVITY LOGGING ====================
@@ -45,6 +59,41 @@ def get_current_user_from_instance(instance):
     return None
 
 
+# ----- Delta Sync Tombstones -----
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_delete, sender=Inventory)
+@receiver(post_delete, sender=Customer)
+def record_sync_tombstone(sender, instance, **kwargs):
+    """Keep the deleted primary key so terminals syncing with /api/sync/ drop the row."""
+    record_tombstones(sender, [instance.pk])
+
+
+@receiver(pre_delete, sender=Source)
+def touch_products_of_deleted_source(sender, instance, **kwargs):
+    """Deleting a source nulls Product.source with an UPDATE that skips auto_now; mark the products changed."""
+    instance.products.update(updatedAt=timezone.now())
+
+
+# ----- Catalog Cache Invalidation -----
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Drop cached catalog responses of the changed model."""
+    if sender is Source:
+        # Deleting a source nulls Product.source with an UPDATE that sends no signals
+        invalidate_catalog(Source, Product)
+    else:
+        invalidate_catalog(sender)
+
+
 # ----- Product Activity Logging -----
 @receiver(post_save, sender=Product)
 def log_product_activity(sender, instance, created, **kwargs):
@@ -52,13 +101,13 @@ def log_product_activity(sender, instance, created, **kwargs):
     user = get_current_user_from_instance(instance)
     
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=user,
             actionType='CREATE_PRODUCT',
             description=f"Created product: {instance.productName} (SKU: {instance.skuCode})"
         )
     else:
-        ActivityLog.objects.create(
+        log_activity(
             user=user,
             actionType='UPDATE_PRODUCT',
             description=f"Updated product: {instance.productName} (SKU: {instance.skuCode})"
@@ -68,7 +117,7 @@ def log_product_activity(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Product)
 def log_product_deletion(sender, instance, **kwargs):
     """Log when products are deleted."""
-    ActivityLog.objects.create(
+    log_activity(
         user=None,
         actionType='DELETE_PRODUCT',
         description=f"Deleted product: {instance.productName} (SKU: {instance.skuCode})"
@@ -80,13 +129,13 @@ def log_product_deletion(sender, instance, **kwargs):
 def log_category_activity(sender, instance, created, **kwargs):
     """Log when categories are created or updated."""
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='CREATE_CATEGORY',
             description=f"Created category: {instance.name}"
         )
     else:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='UPDATE_CATEGORY',
             description=f"Updated category: {instance.name}"
@@ -96,7 +145,7 @@ def log_category_activity(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Category)
 def log_category_deletion(sender, instance, **kwargs):
     """Log when categories are deleted."""
-    ActivityLog.objects.create(
+    log_activity(
         user=None,
         actionType='DELETE_CATEGORY',
         description=f"Deleted category: {instance.name}"
@@ -104,39 +153,33 @@ def log_category_deletion(sender, instance, **kwargs):
 
 
 # ----- Inventory Activity Logging -----
-@receiver(pre_save, sender=Inventory)
-def store_previous_inventory_quantity(sender, instance, **kwargs):
-    """Store previous inventory quantity for comparison."""
-    if instance.pk:
-        try:
-            previous = Inventory.objects.get(pk=instance.pk)
-            _model_previous_states[f'inventory_{instance.pk}'] = previous.quantity
-        except Inventory.DoesNotExist:
-            pass
-
-
 @receiver(post_save, sender=Inventory)
 def log_inventory_activity(sender, instance, created, **kwargs):
     """Log when inventory is created or updated."""
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='CREATE_INVENTORY',
             description=f"Created inventory for: {instance.product.productName} - Quantity: {instance.quantity} @ {instance.location}"
         )
     else:
-        previous_qty = _model_previous_states.get(f'inventory_{instance.pk}')
+        # Previous quantity comes from the values the instance was loaded with (no extra query)
+        previous_qty = instance.get_previous_value('quantity')
         if previous_qty is not None and previous_qty != instance.quantity:
             change = instance.quantity - previous_qty
             change_text = f"+{change}" if change > 0 else str(change)
-            ActivityLog.objects.create(
+            log_activity(
                 user=None,
                 actionType='UPDATE_INVENTORY',
                 description=f"Inventory adjusted for {instance.product.productName}: {previous_qty} → {instance.quantity} ({change_text})"
             )
-        # Clean up
-        if f'inventory_{instance.pk}' in _model_previous_states:
-            del _model_previous_states[f'inventory_{instance.pk}']
+
+
+@receiver(post_save, sender=Inventory)
+def record_opening_stock(sender, instance, created, **kwargs):
+    """Open the stock ledger for a new inventory row with its initial quantity."""
+    if created and instance.quantity:
+        record_movement(instance, 'Adjustment', instance.quantity, reference='Opening balance')
 
 
 # ----- NewStock Activity Logging -----
@@ -144,7 +187,7 @@ def log_inventory_activity(sender, instance, created, **kwargs):
 def log_newstock_activity(sender, instance, created, **kwargs):
     """Log when new stock is added."""
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=instance.addedByUser,
             actionType='ADD_STOCK',
             description=f"Added {instance.quantity} units of {instance.inventory.product.productName} from {instance.supplier.name if instance.supplier else 'Unknown supplier'}"
@@ -153,18 +196,13 @@ def log_newstock_activity(sender, instance, created, **kwargs):
 
 # ----- Invoice Activity Logging -----
 @receiver(pre_save, sender=Invoice)
-def store_previous_invoice_status_and_set_paid_timestamp(sender, instance, **kwargs):
-    """Store previous invoice status and set paidAt timestamp when changing to Paid."""
-    if instance.pk:
-        try:
-            previous = Invoice.objects.get(pk=instance.pk)
-            _invoice_previous_status[instance.pk] = previous.status
-            
-            # If status is changing from non-Paid to Paid, set paidAt timestamp
-            if previous.status != 'Paid' and instance.status == 'Paid':
-                instance.paidAt = timezone.now()
-        except Invoice.DoesNotExist:
-            pass
+def set_paid_timestamp(sender, instance, **kwargs):
+    """Set paidAt timestamp when the status changes to Paid."""
+    previous_status = instance.get_previous_value('status')
+    
+    # If status is changing from non-Paid to Paid, set paidAt timestamp
+    if previous_status is not None and previous_status != 'Paid' and instance.status == 'Paid':
+        instance.paidAt = timezone.now()
 
 
 @receiver(post_save, sender=Invoice)
@@ -173,32 +211,61 @@ def log_invoice_activity(sender, instance, created, **kwargs):
     user = instance.createdByUser
     
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=user,
             actionType='CREATE_INVOICE',
             description=f"Created invoice #{instance.invoiceId} for {instance.customer.name if instance.customer else 'Unknown'} - Total: ${instance.grandTotal} - Status: {instance.status}"
         )
     else:
         # Check if status changed
-        previous_status = _invoice_previous_status.get(instance.pk)
+        previous_status = instance.get_previous_value('status')
         if previous_status and previous_status != instance.status:
-            ActivityLog.objects.create(
+            log_activity(
                 user=user,
                 actionType='UPDATE_INVOICE_STATUS',
                 description=f"Invoice #{instance.invoiceId} status changed: {previous_status} → {instance.status}"
             )
         else:
-            ActivityLog.objects.create(
+            log_activity(
                 user=user,
                 actionType='UPDATE_INVOICE',
                 description=f"Updated invoice #{instance.invoiceId}"
             )
 
 
+@receiver(post_save, sender=Invoice)
+def update_sales_summary(sender, instance, created, **kwargs):
+    """Add invoices to the daily sales summary when they are paid, remove them when reversed."""
+    # Applied after commit: line items of new invoices are created after the
+    # invoice, and every sale touches the same few summary rows, so their
+    # locks are held for one short transaction instead of the whole request
+    invoice_id = instance.invoiceId
+    previous_status = None if created else instance.get_previous_value('status')
+    if previous_status != 'Paid' and instance.status == 'Paid':
+        transaction.on_commit(lambda: record_sales([invoice_id]))
+    elif previous_status == 'Paid' and instance.status != 'Paid':
+        transaction.on_commit(lambda: record_sales([invoice_id], sign=-1))
+
+
+@receiver(post_save, sender=Invoice)
+def restock_cancelled_invoice(sender, instance, created, **kwargs):
+    """Return a cancelled invoice's items to stock, recorded as Cancellation movements."""
+    if not created and instance.status == 'Cancelled' and instance.get_previous_value('status') != 'Cancelled':
+        with transaction.atomic():
+            restock_invoice(instance.invoiceId, user=instance.createdByUser)
+
+
+@receiver(pre_delete, sender=Invoice)
+def remove_deleted_sale(sender, instance, **kwargs):
+    """Take a deleted paid invoice out of the sales summary while its line items still exist."""
+    if instance.status == 'Paid':
+        record_sales([instance.invoiceId], sign=-1)
+
+
 @receiver(post_delete, sender=Invoice)
 def log_invoice_deletion(sender, instance, **kwargs):
     """Log when invoices are deleted."""
-    ActivityLog.objects.create(
+    log_activity(
         user=instance.createdByUser,
         actionType='DELETE_INVOICE',
         description=f"Deleted invoice #{instance.invoiceId}"
@@ -210,13 +277,13 @@ def log_invoice_deletion(sender, instance, **kwargs):
 def log_customer_activity(sender, instance, created, **kwargs):
     """Log when customers are created or updated."""
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='CREATE_CUSTOMER',
             description=f"Created customer: {instance.name} ({instance.customerType})"
         )
     else:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='UPDATE_CUSTOMER',
             description=f"Updated customer: {instance.name}"
@@ -226,7 +293,7 @@ def log_customer_activity(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Customer)
 def log_customer_deletion(sender, instance, **kwargs):
     """Log when customers are deleted."""
-    ActivityLog.objects.create(
+    log_activity(
         user=None,
         actionType='DELETE_CUSTOMER',
         description=f"Deleted customer: {instance.name}"
@@ -238,13 +305,13 @@ def log_customer_deletion(sender, instance, **kwargs):
 def log_user_activity(sender, instance, created, **kwargs):
     """Log when users are created or updated."""
     if created:
-        ActivityLog.objects.create(
+        log_activity(
             user=None,
             actionType='CREATE_USER',
             description=f"Created user: {instance.username} with role: {instance.role}"
         )
     else:
-        ActivityLog.objects.create(
+        log_activity(
             user=instance,
             actionType='UPDATE_USER',
             description=f"Updated user profile: {instance.username}"
@@ -254,7 +321,7 @@ def log_user_activity(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=User)
 def log_user_deletion(sender, instance, **kwargs):
     """Log when users are deleted."""
-    ActivityLog.objects.create(
+    log_activity(
         user=None,
         actionType='DELETE_USER',
         description=f"Deleted user: {instance.username}"
@@ -0,0 +1,161 @@
+"""
+Stock Ledger
+Append-only record of every change to Inventory.quantity, with periodic
+snapshot balances so historical quantities never need a full ledger scan.
+
+Snapshots are taken for every inventory row at once (see the
+take_stock_snapshot command), so the balance of any row at time T is the
+snapshot at the latest snapshot time <= T plus the movements after it.
+"""
+import logging
+from django.db.models import F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Inventory, StockMovement, StockSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def record_movement(inventory, movement_type, quantity, reference=None, user=None):
+    """Append a single movement for an inventory row"""
+    return StockMovement.objects.create(
+        inventory=inventory,
+        movementType=movement_type,
+        quantity=quantity,
+        reference=reference,
+        user=user
+    )
+
+
+def record_movements(movements):
+    """Append many unsaved StockMovement instances with one INSERT"""
+    return StockMovement.objects.bulk_create(movements)
+
+
+def restock_invoice(invoice_id, user=None):
+    """
+    Put back the stock an invoice's sales took, with one Cancellation
+    movement per inventory row. Only what is still outstanding is restored,
+    so cancelling the same invoice again changes nothing.
+    Returns the number of rows restocked. Call inside a transaction.
+    """
+    reference = f"Invoice #{invoice_id}"
+    outstanding = dict(
+        StockMovement.objects.filter(reference=reference, movementType__in=('Sale', 'Cancellation'))
+        .order_by('inventory')
+        .values('inventory')
+        .annotate(total=Sum('quantity'))
+        .filter(total__lt=0)
+        .values_list('inventory', 'total')
+    )
+    if not outstanding:
+        return 0
+
+    # Same lock order as invoice creation, so the two can't deadlock
+    list(Inventory.objects.select_for_update().filter(pk__in=outstanding).order_by('pk').values_list('pk'))
+    now = timezone.now()
+    for inventory_id, total in outstanding.items():
+        Inventory.objects.filter(pk=inventory_id).update(quantity=F('quantity') - total, updatedAt=now)
+    record_movements([
+        StockMovement(inventory_id=inventory_id, movementType='Cancellation', quantity=-total, reference=reference, user=user)
+        for inventory_id, total in outstanding.items()
+    ])
+    return len(outstanding)
+
+
+def latest_snapshot_time(at=None):
+    """Time of the most recent snapshot taken at or before `at`"""
+    snapshots = StockSnapshot.objects.all()
+    if at is not None:
+        snapshots = snapshots.filter(takenAt__lte=at)
+    return snapshots.aggregate(latest=Max('takenAt'))['latest']
+
+
+def balance_as_of(inventory_id, at=None):
+    """
+    Ledger quantity of one inventory row at `at` (default: now), read from
+    the nearest earlier snapshot plus the movements recorded after it.
+    """
+    at = at or timezone.now()
+    snapshot = (
+        StockSnapshot.objects.filter(inventory_id=inventory_id, takenAt__lte=at)
+        .order_by('-takenAt')
+        .values('quantity', 'takenAt')
+        .first()
+    )
+
+    movements = StockMovement.objects.filter(inventory_id=inventory_id, createdAt__lte=at)
+    balance = 0
+    if snapshot:
+        balance = snapshot['quantity']
+        movements = movements.filter(createdAt__gt=snapshot['takenAt'])
+
+    return balance + (movements.aggregate(total=Sum('quantity'))['total'] or 0)
+
+
+def with_ledger_balance(queryset, snapshot_time, at=None):
+    """
+    Annotate an Inventory queryset with `ledgerQuantity`, computed in the
+    same statement as the rows so both sides are read from one consistent
+    view of the database.
+    """
+    movements = StockMovement.objects.filter(inventory=OuterRef('pk'))
+    if snapshot_time is not None:
+        movements = movements.filter(createdAt__gt=snapshot_time)
+    if at is not None:
+        movements = movements.filter(createdAt__lte=at)
+    movement_total = movements.values('inventory').annotate(total=Sum('quantity')).values('total')
+
+    balance = Coalesce(Subquery(movement_total, output_field=IntegerField()), Value(0))
+    if snapshot_time is not None:
+        snapshot_quantity = StockSnapshot.objects.filter(
+            inventory=OuterRef('pk'), takenAt=snapshot_time
+        ).values('quantity')
+        balance = balance + Coalesce(Subquery(snapshot_quantity, output_field=IntegerField()), Value(0))
+
+    return queryset.annotate(ledgerQuantity=balance)
+
+
+def iter_ledger_balances(chunk_size=5000, at=None):
+    """
+    Stream (inventoryId, quantity, ledgerQuantity) for every inventory row,
+    paging by primary key so memory stays flat however large the tables get.
+    """
+    snapshot_time = latest_snapshot_time(at)
+    last_id = 0
+    while True:
+        chunk = list(
+            with_ledger_balance(Inventory.objects.filter(pk__gt=last_id), snapshot_time, at)
+            .order_by('pk')
+            .values_list('inventoryId', 'quantity', 'ledgerQuantity')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield from chunk
+        last_id = chunk[-1][0]
+
+
+def take_snapshot(taken_at=None, chunk_size=5000):
+    """
+    Store the ledger balance of every inventory row as of `taken_at`.
+    Returns the number of snapshot rows written.
+    """
+    taken_at = taken_at or timezone.now()
+    previous = latest_snapshot_time()
+    if previous is not None and previous >= taken_at:
+        raise ValueError(f"A snapshot already exists at or after {taken_at.isoformat()}")
+
+    written = 0
+    batch = []
+    for inventory_id, _quantity, ledger_quantity in iter_ledger_balances(chunk_size, at=taken_at):
+        batch.append(StockSnapshot(inventory_id=inventory_id, quantity=ledger_quantity, takenAt=taken_at))
+        if len(batch) >= chunk_size:
+            StockSnapshot.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        StockSnapshot.objects.bulk_create(batch)
+        written += len(batch)
+
+    logger.info(f"Stock snapshot at {taken_at.isoformat()}: {written} rows")
+    return written
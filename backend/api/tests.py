@@ -1,30 +1,67 @@
-from django.test import TestCase
-from .models import User, Category, SubCategory, Source, Product, Inventory, Purchase, Customer, Invoice
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+import gzip
+from unittest import mock
+import json
+import requests
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import (
+    User, UserProfile, Category, SubCategory, Source, Product, Inventory, NewStock,
+    Purchase, Customer, Invoice, Transaction, ActivityLog, DailySalesSummary, DailyProductSales, SyncTombstone, LOW_STOCK
+)
+from . import async_views, khqr_service
+from .fake_bakong import FakeBakongServer
+from .activity_log import activity_log_batch, log_activity
+from .catalog_cache import get_or_build
+from .khqr_generation import wait_for_invoice_qr
+from .khqr_images import image_path
+from .khqr_payments import due_khqr_invoices, mark_invoices_paid
+from .product_images import variant_name
+from .query_plans import _postgres_scans, _sqlite_scans
+from .serializers import InvoiceSerializer
+from .views import InventoryViewSet, InvoiceViewSet, NewStockViewSet
+from .stock_ledger import balance_as_of, iter_ledger_balances, record_movement, take_snapshot
 from decimal import Decimal
-from datetime import datetime
 
 class InventoryUpdateTest(TestCase):
 
     def setUp(self):
         # Create a user
-        self.user = User.objects.create(
-            name='Test User',
+        self.user = User.objects.create_user(
+            username='testuser',
             email='test@example.com',
-            passwordHash='hashedpassword',
-            role='Admin'
+            password='hashedpassword',
+            role='administrator'
         )
 
         # Create a category
         self.category = Category.objects.create(
-            name='Electronics',
-            description='Electronic devices'
+            name='Electronics'
         )
 
         # Create a subcategory
         self.subcategory = SubCategory.objects.create(
             category=self.category,
-            name='Phones',
-            description='Mobile phones'
+            name='Phones'
         )
 
         # Create a source
@@ -39,6 +76,7 @@ class InventoryUpdateTest(TestCase):
             description='Latest model smartphone',
             skuCode='SMARTX001',
             unit='pcs',
+            costPrice=Decimal('500.00'),
             subcategory=self.subcategory,
             source=self.source
         )
@@ -48,7 +86,6 @@ class InventoryUpdateTest(TestCase):
         self.inventory = Inventory.objects.create(
             product=self.product,
             quantity=self.initial_quantity,
-            costPrice=Decimal('500.00'),
             reorderLevel=20,
             location='Warehouse A'
         )
@@ -71,8 +108,7 @@ class InventoryUpdateTest(TestCase):
             tax=Decimal('0.00'),
             grandTotal=Decimal('1000.00'),
             paymentMethod='Cash',
-            invoiceDate=datetime.now(),
-            status='Draft'
+            status='Pending'
         )
 
     def test_inventory_decreases_on_purchase(self):
@@ -120,4 +156,1619 @@ class InventoryUpdateTest(TestCase):
         purchase.save()
         self.inventory.refresh_from_db()
         # The quantity should not change again because the signal only fires on `created=True`
-        self.assertEqual(self.inventory.quantity, quantity_after_first_purchase)
\ No newline at end of file
+        self.assertEqual(self.inventory.quantity, quantity_after_first_purchase)
+
+    def test_purchase_with_several_inventory_rows_uses_the_oldest(self):
+        other = Inventory.objects.create(product=self.product, quantity=7, reorderLevel=1, location='Warehouse B')
+        Purchase.objects.create(
+            invoice=self.invoice,
+            product=self.product,
+            quantity=3,
+            pricePerUnit=Decimal('600.00'),
+            discount=Decimal('0.00'),
+            subtotal=Decimal('1800.00')
+        )
+        self.inventory.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, self.initial_quantity - 3)
+        self.assertEqual(other.quantity, 7)
+        self.assertEqual(self.inventory.movements.filter(movementType='Sale').get().quantity, -3)
+
+
+class InvoiceCreationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cashier', password='secret', role='manager')
+        category = Category.objects.create(name='Drinks')
+        self.subcategory = SubCategory.objects.create(category=category, name='Soda')
+
+    def make_product(self, sku, quantity):
+        product = Product.objects.create(
+            productName=f'Product {sku}',
+            description='',
+            skuCode=sku,
+            unit='pcs',
+            subcategory=self.subcategory
+        )
+        Inventory.objects.create(product=product, quantity=quantity, reorderLevel=5, location='Shop')
+        return product
+
+    def create_invoice(self, line_items):
+        serializer = InvoiceSerializer(data={
+            'customerName': 'Walk-in',
+            'paymentMethod': 'Cash',
+            'lineItems': line_items,
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(createdByUser=self.user)
+
+    def line(self, product, quantity):
+        return {'product': product.pk, 'quantity': quantity, 'pricePerUnit': '2.50'}
+
+    def test_stock_is_decremented_once_per_line(self):
+        first = self.make_product('A1', 10)
+        second = self.make_product('B1', 4)
+
+        invoice = self.create_invoice([self.line(first, 3), self.line(second, 4), self.line(first, 2)])
+
+        self.assertEqual(invoice.purchases.count(), 3)
+        self.assertEqual(invoice.grandTotal, Decimal('22.50'))
+        self.assertEqual(Inventory.objects.get(product=first).quantity, 5)
+        self.assertEqual(Inventory.objects.get(product=second).quantity, 0)
+
+    def test_insufficient_stock_rolls_back(self):
+        first = self.make_product('A1', 10)
+        second = self.make_product('B1', 1)
+
+        with self.assertRaises(serializers.ValidationError):
+            self.create_invoice([self.line(first, 3), self.line(second, 2)])
+
+        self.assertEqual(Invoice.objects.count(), 0)
+        self.assertEqual(Inventory.objects.get(product=first).quantity, 10)
+        self.assertEqual(Inventory.objects.get(product=second).quantity, 1)
+
+    def test_unknown_product_is_rejected(self):
+        serializer = InvoiceSerializer(data={
+            'customerName': 'Walk-in',
+            'paymentMethod': 'Cash',
+            'lineItems': [{'product': 999, 'quantity': 1, 'pricePerUnit': '1.00'}],
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('lineItems', serializer.errors)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        small = [self.line(self.make_product('S1', 50), 1)]
+        large = [self.line(self.make_product(f'L{i}', 50), 1) for i in range(20)]
+
+        with CaptureQueriesContext(connection) as small_queries:
+            self.create_invoice(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            self.create_invoice(large)
+
+        self.assertEqual(len(large_queries), len(small_queries))
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Pins the maximum number of queries for every list and detail endpoint.
+    Each model is seeded with several related rows so an N+1 regression
+    blows the budget instead of going unnoticed.
+    """
+
+    # endpoint: (max queries for list, max queries for detail)
+    QUERY_BUDGETS = {
+        'users': (1, 1),
+        'user-profiles': (1, 1),
+        'categories': (1, 1),
+        'subcategories': (1, 1),
+        'sources': (1, 1),
+        'products': (1, 1),
+        'inventory': (1, 1),
+        'newstock': (1, 1),
+        'customers': (1, 1),
+        'invoices': (2, 2),
+        'purchases': (1, 1),
+        'transactions': (1, 1),
+        'activitylogs': (1, 1),
+        'stock-movements': (1, 1),
+    }
+    ROWS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.seed()
+
+    @classmethod
+    def seed(cls):
+        cls.admin = User.objects.create_user(username='admin', password='secret', role='administrator')
+        for i in range(cls.ROWS):
+            source = Source.objects.create(name=f'Supplier {i}')
+            customer = Customer.objects.create(
+                name=f'Customer {i}', businessAddress='Street 1', phone='012', customerType='Individual'
+            )
+            user = User.objects.create_user(username=f'user{i}', password='secret', role='staff')
+            UserProfile.objects.create(user=user, businessName=f'Shop {i}')
+            category = Category.objects.create(name=f'Category {i}')
+            subcategory = SubCategory.objects.create(category=category, name=f'Sub {i}')
+            product = Product.objects.create(
+                productName=f'Product {i}', description='', skuCode=f'SKU{i}', unit='pcs',
+                subcategory=subcategory, source=source
+            )
+            inventory = Inventory.objects.create(product=product, quantity=100, reorderLevel=5, location='Shop')
+            NewStock.objects.create(
+                inventory=inventory, quantity=10, purchasePrice=Decimal('1.00'),
+                receivedDate='2025-01-01', supplier=source, addedByUser=user
+            )
+            invoice = Invoice.objects.create(
+                customer=customer, createdByUser=user, totalBeforeDiscount=Decimal('2.00'),
+                grandTotal=Decimal('2.00'), paymentMethod='Cash'
+            )
+            for _ in range(2):
+                Purchase.objects.create(
+                    invoice=invoice, product=product, quantity=1,
+                    pricePerUnit=Decimal('1.00'), subtotal=Decimal('1.00')
+                )
+            Transaction.objects.create(
+                invoice=invoice, customer=customer, amountPaid=Decimal('2.00'), paymentMethod='Cash',
+                transactionStatus='Completed', transactionDate=timezone.now(), recordedByUser=user
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assertMaxQueries(self, budget, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        if len(queries) > budget:
+            executed = '\n'.join(query['sql'] for query in queries.captured_queries)
+            self.fail(f"{url} ran {len(queries)} queries, budget is {budget}:\n{executed}")
+        return response
+
+    def test_endpoints_stay_within_query_budget(self):
+        for endpoint, (list_budget, detail_budget) in self.QUERY_BUDGETS.items():
+            with self.subTest(endpoint=endpoint):
+                response = self.assertMaxQueries(list_budget, f'/api/{endpoint}/')
+                rows = response.data['results'] if isinstance(response.data, dict) else response.data
+                self.assertGreaterEqual(len(rows), self.ROWS)
+
+                pk = next(iter(rows[0].values()))
+                self.assertMaxQueries(detail_budget, f'/api/{endpoint}/{pk}/')
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='secret', role='administrator')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        ActivityLog.objects.all().delete()
+        ActivityLog.objects.bulk_create(
+            ActivityLog(user=self.admin, actionType='TEST', description=f'Entry {i}') for i in range(25)
+        )
+        # Force timestamp ties so ordering has to fall back to the primary key
+        ActivityLog.objects.update(createdAt=timezone.now())
+
+    def test_walks_full_history_without_gaps_or_duplicates(self):
+        seen = []
+        url = '/api/activitylogs/?page_size=10'
+        pages = 0
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['logId'] for row in response.data['results'])
+            url = response.data['next']
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(ActivityLog.objects.values_list('logId', flat=True), reverse=True))
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/activitylogs/?page_size=10').data
+        self.assertIsNone(first['previous'])
+
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(
+            [row['logId'] for row in back['results']],
+            [row['logId'] for row in first['results']]
+        )
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/activitylogs/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class StockLedgerTest(TestCase):
+
+    def setUp(self):
+        self.manager = User.objects.create_user(username='manager', password='secret', role='manager')
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+        category = Category.objects.create(name='Snacks')
+        subcategory = SubCategory.objects.create(category=category, name='Chips')
+        self.product = Product.objects.create(
+            productName='Chips', description='', skuCode='CHIPS', unit='bag', subcategory=subcategory
+        )
+        self.inventory = Inventory.objects.create(product=self.product, quantity=20, reorderLevel=5, location='Shop')
+
+    def test_every_stock_change_is_recorded(self):
+        self.client.post('/api/newstock/', {
+            'inventory': self.inventory.pk, 'quantity': 10, 'purchasePrice': '1.00', 'receivedDate': '2025-01-01'
+        })
+        self.client.post('/api/invoices/', {
+            'customerName': 'Walk-in', 'paymentMethod': 'Cash',
+            'lineItems': [{'product': self.product.pk, 'quantity': 4, 'pricePerUnit': '2.00'}]
+        }, format='json')
+        self.client.patch(f'/api/inventory/{self.inventory.pk}/', {'quantity': 25})
+
+        movements = list(self.inventory.movements.order_by('movementId').values_list('movementType', 'quantity'))
+        self.assertEqual(movements, [('Adjustment', 20), ('Receipt', 10), ('Sale', -4), ('Adjustment', -1)])
+
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_stock_changes_keep_sales_made_after_the_row_was_read(self):
+        def sell_first(perform):
+            # A sale commits after the request read and validated the inventory row
+            def wrapper(view, serializer):
+                Inventory.objects.filter(pk=self.inventory.pk).update(quantity=F('quantity') - 3)
+                record_movement(self.inventory, 'Sale', -3)
+                perform(view, serializer)
+            return wrapper
+
+        with mock.patch.object(NewStockViewSet, 'perform_create', sell_first(NewStockViewSet.perform_create)):
+            self.client.post('/api/newstock/', {
+                'inventory': self.inventory.pk, 'quantity': 10, 'purchasePrice': '1.00', 'receivedDate': '2025-01-01'
+            })
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 27)
+
+        with mock.patch.object(InventoryViewSet, 'perform_update', sell_first(InventoryViewSet.perform_update)):
+            self.client.patch(f'/api/inventory/{self.inventory.pk}/', {'reorderLevel': 8})
+            self.client.patch(f'/api/inventory/{self.inventory.pk}/', {'quantity': 30})
+        self.inventory.refresh_from_db()
+        self.assertEqual((self.inventory.quantity, self.inventory.reorderLevel), (30, 8))
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_balance_as_of_uses_snapshot_plus_later_movements(self):
+        before = timezone.now()
+        record_movement(self.inventory, 'Sale', -5)
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=15)
+
+        take_snapshot(timezone.now())
+        record_movement(self.inventory, 'Receipt', 7)
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=22)
+
+        self.assertEqual(balance_as_of(self.inventory.pk, before), 20)
+        self.assertEqual(balance_as_of(self.inventory.pk), 22)
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_check_reports_and_fixes_drift(self):
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=18)
+
+        with self.assertRaises(CommandError):
+            call_command('check_stock_ledger', stdout=StringIO())
+
+        call_command('check_stock_ledger', '--fix', stdout=StringIO())
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_cancelled_invoice_returns_its_stock_once(self):
+        response = self.client.post('/api/invoices/', {
+            'customerName': 'Walk-in', 'paymentMethod': 'Cash',
+            'lineItems': [{'product': self.product.pk, 'quantity': 4, 'pricePerUnit': '2.00'}]
+        }, format='json')
+        invoice = Invoice.objects.get(pk=response.data['invoiceId'])
+
+        invoice.status = 'Cancelled'
+        invoice.save()
+        # Reopening and cancelling again must not restock twice
+        invoice.status = 'Pending'
+        invoice.save()
+        invoice.status = 'Cancelled'
+        invoice.save()
+
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 20)
+        self.assertEqual(
+            list(self.inventory.movements.filter(movementType='Cancellation').values_list('quantity', 'reference')),
+            [(4, f'Invoice #{invoice.pk}')]
+        )
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_admin_quantity_edits_are_recorded(self):
+        request = RequestFactory().post('/admin/api/inventory/')
+        request.user = self.manager
+        inventory = Inventory.objects.get(pk=self.inventory.pk)
+        inventory.quantity = 12
+        admin.site._registry[Inventory].save_model(request, inventory, None, change=True)
+
+        self.assertEqual(self.inventory.movements.filter(movementType='Adjustment').last().quantity, -8)
+        call_command('check_stock_ledger', stdout=StringIO())
+
+    def test_movements_are_append_only(self):
+        movement = self.inventory.movements.get()
+        movement.quantity = 99
+        with self.assertRaises(ValueError):
+            movement.save()
+
+    def test_movements_filter_by_inventory(self):
+        response = self.client.get(f'/api/stock-movements/?inventory={self.inventory.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+        response = self.client.get('/api/stock-movements/?inventory=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('inventory', response.data)
+
+
+class ActivityLogWriterTest(TestCase):
+
+    def test_entries_wait_for_commit_and_rolled_back_work_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                log_activity(actionType='KEPT', description='outer')
+                try:
+                    with transaction.atomic():
+                        log_activity(actionType='DROPPED', description='inner')
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                log_activity(actionType='KEPT', description='after savepoint')
+                self.assertEqual(ActivityLog.objects.count(), 0)
+
+        self.assertEqual(
+            list(ActivityLog.objects.order_by('logId').values_list('actionType', 'description')),
+            [('KEPT', 'outer'), ('KEPT', 'after savepoint')]
+        )
+
+    def test_batch_scope_writes_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            with activity_log_batch():
+                with self.captureOnCommitCallbacks(execute=True):
+                    for i in range(10):
+                        log_activity(actionType='TEST', description=f'Entry {i}')
+                self.assertEqual(ActivityLog.objects.count(), 0)
+
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(ActivityLog.objects.count(), 10)
+
+
+class FieldTrackingTest(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tools')
+        subcategory = SubCategory.objects.create(category=category, name='Hammers')
+        product = Product.objects.create(
+            productName='Hammer', description='', skuCode='HAM', unit='pcs', subcategory=subcategory
+        )
+        Inventory.objects.create(product=product, quantity=10, reorderLevel=2, location='Shop')
+        Invoice.objects.create(totalBeforeDiscount=Decimal('5.00'), grandTotal=Decimal('5.00'), paymentMethod='Cash')
+
+    def test_inventory_change_is_detected_without_refetching(self):
+        inventory = Inventory.objects.select_related('product').get()
+        inventory.quantity = 7
+        self.assertEqual(inventory.changed_fields(), {'quantity': (10, 7)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                inventory.save(update_fields=['quantity', 'updatedAt'])
+
+        self.assertFalse(inventory.has_changed('quantity'))
+        log = ActivityLog.objects.get(actionType='UPDATE_INVENTORY')
+        self.assertIn('10 → 7 (-3)', log.description)
+
+    def test_partial_save_keeps_unsaved_fields_as_changed(self):
+        inventory = Inventory.objects.get()
+        inventory.quantity, inventory.reorderLevel = 7, 5
+        inventory.save(update_fields=['reorderLevel'])
+
+        self.assertEqual(inventory.changed_fields(), {'quantity': (10, 7)})
+        self.assertEqual(inventory.get_previous_value('quantity'), 10)
+
+    def test_invoice_status_change_sets_paid_timestamp(self):
+        invoice = Invoice.objects.get()
+        invoice.status = 'Paid'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.save()
+
+        self.assertIsNotNone(invoice.paidAt)
+        self.assertEqual(invoice.get_previous_value('status'), 'Paid')
+        self.assertTrue(ActivityLog.objects.filter(actionType='UPDATE_INVOICE_STATUS').exists())
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body or {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+@override_settings(
+    KHQR_BASE_URL='http://bakong.test', KHQR_TOKEN='', KHQR_EMAIL='shop@example.com', KHQR_RETRY_BACKOFF=0
+)
+class KHQRClientTest(TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        patches = [
+            mock.patch.object(khqr_service, 'get_session', return_value=self.session),
+            mock.patch.object(khqr_service, '_token_cache', khqr_service.TokenCache()),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def calls_to(self, endpoint):
+        return [c for c in self.session.post.call_args_list if c.args[0].endswith(endpoint)]
+
+    def test_token_is_shared_across_service_instances(self):
+        self.session.post.side_effect = lambda url, **kwargs: (
+            FakeResponse(200, {'responseCode': 0, 'data': {'token': 'fresh-token'}})
+            if url.endswith('renew_token') else FakeResponse(200, {'responseCode': 1, 'errorCode': 1})
+        )
+
+        khqr_service.KHQRService().check_transaction_by_md5('abc')
+        khqr_service.KHQRService().check_transaction_by_md5('def')
+
+        self.assertEqual(len(self.calls_to('renew_token')), 1)
+        self.assertEqual(
+            self.calls_to('check_transaction_by_md5')[-1].kwargs['headers']['Authorization'], 'Bearer fresh-token'
+        )
+
+    def test_checks_retry_transient_failures(self):
+        khqr_service._token_cache.set('token')
+        self.session.post.side_effect = [
+            requests.ConnectionError(),
+            FakeResponse(503),
+            FakeResponse(200, {'responseCode': 0, 'data': {'hash': 'abc'}}),
+        ]
+
+        self.assertEqual(khqr_service.KHQRService().check_transaction_by_md5('abc'), {'hash': 'abc'})
+        self.assertEqual(self.session.post.call_count, 3)
+
+    def test_expired_token_is_renewed_once(self):
+        khqr_service._token_cache.set('stale-token')
+        self.session.post.side_effect = [
+            FakeResponse(401),
+            FakeResponse(200, {'responseCode': 0, 'data': {'token': 'fresh-token'}}),
+            FakeResponse(200, {'responseCode': 0, 'data': {'hash': 'abc'}}),
+        ]
+
+        self.assertEqual(khqr_service.KHQRService().check_transaction_by_md5('abc'), {'hash': 'abc'})
+        self.assertEqual(khqr_service._token_cache.get(), 'fresh-token')
+
+
+class StandInBakongHandler(BaseHTTPRequestHandler):
+    """Minimal Bakong batch-check endpoint: MD5s in `paid_md5s` are reported as paid"""
+    paid_md5s = set()
+    requests_seen = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests_seen.append((self.path, body))
+        data = [
+            {'md5': md5, 'status': 'SUCCESS', 'data': {'hash': f'hash-{md5}', 'acknowledgedDateMs': 1735689600000}}
+            if md5 in self.paid_md5s else {'md5': md5, 'status': 'FAILED', 'data': None}
+            for md5 in body
+        ]
+        payload = json.dumps({'responseCode': 0, 'data': data}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class KHQRPollerTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInBakongHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.enterContext(self.settings(KHQR_BASE_URL=base_url, KHQR_TOKEN='test-token', KHQR_BACKGROUND_POLLING=True))
+        self.enterContext(mock.patch.object(khqr_service, '_service', None))
+        self.enterContext(mock.patch.object(khqr_service, '_token_cache', khqr_service.TokenCache()))
+        StandInBakongHandler.requests_seen = []
+        StandInBakongHandler.paid_md5s = {'md5-0', 'md5-60'}
+
+        self.user = User.objects.create_user(username='cashier', password='secret', role='manager')
+        self.invoices = [
+            Invoice.objects.create(
+                createdByUser=self.user, totalBeforeDiscount=Decimal('1.00'), grandTotal=Decimal('1.00'),
+                paymentMethod='KHQR', khqrMd5=f'md5-{i}'
+            )
+            for i in range(75)
+        ]
+
+    def test_poller_confirms_payments_in_chunks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('poll_khqr_payments', '--once', stdout=StringIO())
+
+        self.assertEqual([len(body) for _, body in StandInBakongHandler.requests_seen], [50, 25])
+        self.assertEqual(
+            set(Invoice.objects.filter(status='Paid').values_list('khqrMd5', flat=True)), {'md5-0', 'md5-60'}
+        )
+        self.assertFalse(Invoice.objects.filter(khqrLastCheckedAt__isnull=True).exists())
+        self.assertEqual(ActivityLog.objects.filter(actionType='UPDATE_INVOICE_STATUS').count(), 2)
+
+        # Checked invoices are not due again until their backoff interval passes
+        StandInBakongHandler.requests_seen = []
+        call_command('poll_khqr_payments', '--once', stdout=StringIO())
+        self.assertEqual(StandInBakongHandler.requests_seen, [])
+
+    def test_never_checked_invoices_are_polled_first(self):
+        now = timezone.now()
+        checked = [invoice.pk for invoice in self.invoices[:50]]
+        Invoice.objects.filter(pk__in=checked).update(khqrLastCheckedAt=now - timedelta(minutes=1))
+
+        due = due_khqr_invoices(now)[:25]
+        self.assertIn('NULLS FIRST', str(due.query))  # PostgreSQL sorts NULLs last by default
+        self.assertEqual([invoice.pk for invoice in due], [invoice.pk for invoice in self.invoices[50:]])
+
+    def test_check_payment_reads_local_state(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post(f'/api/invoices/{self.invoices[0].pk}/check_payment/')
+        self.assertFalse(response.data['paid'])
+
+        call_command('poll_khqr_payments', '--once', stdout=StringIO())
+        StandInBakongHandler.requests_seen = []
+
+        response = client.post(f'/api/invoices/{self.invoices[0].pk}/check_payment/')
+        self.assertTrue(response.data['paid'])
+        self.assertEqual(response.data['transaction_hash'], 'hash-md5-0')
+        self.assertEqual(StandInBakongHandler.requests_seen, [])
+
+    def test_batch_check_payments_chunks_and_bulk_updates(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post('/api/invoices/batch_check_payments/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['checked'], 75)
+        self.assertEqual(response.data['paid'], 2)
+        self.assertEqual([chunk['size'] for chunk in response.data['chunks']], [50, 25])
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual(ActivityLog.objects.filter(actionType='UPDATE_INVOICE_STATUS').count(), 1)
+
+
+class AsyncPaymentViewTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeBakongServer(paid_md5s={'md5-paid'}).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.enterContext(self.settings(KHQR_BASE_URL=self.server.base_url, KHQR_TOKEN='test-token'))
+        self.enterContext(mock.patch.object(khqr_service, '_service', None))
+        self.enterContext(mock.patch.object(khqr_service, '_token_cache', khqr_service.TokenCache()))
+        self.server.reset()
+
+        self.user = User.objects.create_user(username='cashier', password='secret', role='manager')
+        self.token = Token.objects.create(user=self.user)
+        self.paid, self.unpaid = [
+            Invoice.objects.create(
+                createdByUser=self.user, totalBeforeDiscount=Decimal('1.00'), grandTotal=Decimal('1.00'),
+                paymentMethod='KHQR', khqrMd5=md5
+            )
+            for md5 in ('md5-paid', 'md5-unpaid')
+        ]
+        self.factory = AsyncRequestFactory()
+
+    def post(self, path, token=True):
+        headers = {'Authorization': f'Token {self.token.key}'} if token else {}
+        return self.factory.post(path, headers=headers)
+
+    async def test_check_payment_confirms_payment(self):
+        response = await async_views.check_payment(self.post('/'), pk=self.paid.pk)
+        body = json.loads(response.content)
+        self.assertTrue(body['paid'])
+        self.assertEqual(body['invoice_status'], 'Paid')
+
+        invoice = await Invoice.objects.aget(pk=self.paid.pk)
+        self.assertEqual(invoice.status, 'Paid')
+        self.assertIsNotNone(invoice.paidAt)
+
+        response = await async_views.check_payment(self.post('/'), pk=self.unpaid.pk)
+        self.assertFalse(json.loads(response.content)['paid'])
+        self.assertEqual(self.server.calls['check_transaction_by_md5'], 2)
+
+    async def test_check_payment_keeps_changes_made_during_the_bakong_call(self):
+        service = khqr_service.get_khqr_service()
+        check = service.acheck_transaction_by_md5
+
+        async def cancelled_meanwhile(md5):
+            result = await check(md5)
+            await Invoice.objects.filter(pk=self.unpaid.pk).aupdate(status='Cancelled', note='Customer left')
+            return result
+
+        with mock.patch.object(service, 'acheck_transaction_by_md5', cancelled_meanwhile):
+            response = await async_views.check_payment(self.post('/'), pk=self.unpaid.pk)
+        self.assertEqual(json.loads(response.content)['invoice_status'], 'Cancelled')
+
+        invoice = await Invoice.objects.aget(pk=self.unpaid.pk)
+        self.assertEqual((invoice.status, invoice.note), ('Cancelled', 'Customer left'))
+        self.assertIsNotNone(invoice.khqrLastCheckedAt)
+
+    async def test_batch_check_payments(self):
+        response = await async_views.batch_check_payments(self.post('/'))
+        body = json.loads(response.content)
+        self.assertEqual((body['checked'], body['paid']), (2, 1))
+        self.assertEqual(body['updated_invoices'], [self.paid.pk])
+
+    async def test_requires_token(self):
+        response = await async_views.check_payment(self.post('/', token=False), pk=self.paid.pk)
+        self.assertEqual(response.status_code, 401)
+        response = await async_views.check_payment(self.post('/'), pk=0)
+        self.assertEqual(response.status_code, 404)
+
+
+class FakeBakongTest(TestCase):
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(khqr_service, '_token_cache', khqr_service.TokenCache()))
+
+    def service_for(self, server):
+        service = khqr_service.KHQRService()
+        service.base_url = server.base_url
+        service.bakong_token = 'test-token'
+        service.retry_backoff = 0
+        return service
+
+    def test_paid_rate_and_pay_delay(self):
+        with FakeBakongServer(paid_rate=0.5, pay_after=60) as server:
+            service = self.service_for(server)
+            md5s = [f'md5-{i}' for i in range(200)]
+            paying = [md5 for md5 in md5s if server.will_pay(md5)]
+            self.assertTrue(60 < len(paying) < 140)
+
+            # Nobody has paid yet: customers take pay_after seconds from the first check
+            self.assertEqual(service.batch_check_transactions_by_md5(md5s[:50]), [
+                {'md5': md5, 'status': 'FAILED', 'data': None} for md5 in md5s[:50]
+            ])
+            server.pay_after = 0
+            self.assertIsNotNone(service.check_transaction_by_md5(paying[0]))
+            self.assertEqual(server.stats()['total_calls'], 2)
+
+    def test_injected_errors_are_retried(self):
+        with FakeBakongServer(error_rate=1.0, paid_md5s={'md5-paid'}) as server:
+            service = self.service_for(server)
+            self.assertIsNone(service.check_transaction_by_md5('md5-paid'))
+            self.assertEqual(server.stats()['errors'], service.max_retries + 1)
+
+            server.error_rate = 0
+            self.assertEqual(service.check_transaction_by_md5('md5-paid')['hash'], 'md5-paid-hash')
+
+
+class DeferredQRGenerationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.server = FakeBakongServer(latency=0.2).start()
+        self.addCleanup(self.server.stop)
+        self.enterContext(self.settings(
+            KHQR_BASE_URL=self.server.base_url, KHQR_TOKEN='test-token',
+            KHQR_BAKONG_ACCOUNT_ID='shop@devb', KHQR_MERCHANT_NAME='Shop'
+        ))
+        self.enterContext(mock.patch.object(khqr_service, '_service', None))
+        self.enterContext(mock.patch.object(khqr_service, '_token_cache', khqr_service.TokenCache()))
+
+        self.user = User.objects.create_user(username='cashier', password='secret', role='manager')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        self.product = Product.objects.create(
+            productName='Cola', description='', skuCode='C1', unit='pcs', subcategory=subcategory
+        )
+        Inventory.objects.create(product=self.product, quantity=10, reorderLevel=1, location='Shop')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_invoice_creation_does_not_wait_for_bakong(self):
+        started = time.monotonic()
+        response = self.client.post('/api/invoices/', {
+            'customerName': 'Walk-in',
+            'paymentMethod': 'KHQR',
+            'lineItems': [{'product': self.product.pk, 'quantity': 1, 'pricePerUnit': '1.50'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(time.monotonic() - started, 0.2)
+
+        # generate_khqr returns the QR produced in the background instead of making another
+        invoice_id = response.data['invoiceId']
+        response = self.client.post(f'/api/invoices/{invoice_id}/generate_khqr/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(wait_for_invoice_qr(invoice_id))
+
+        invoice = Invoice.objects.get(pk=invoice_id)
+        self.assertEqual(response.data['md5_hash'], invoice.khqrMd5)
+        self.assertTrue(invoice.khqrDeeplink)
+        self.assertEqual(self.server.stats()['calls'], {'generate_deeplink_by_qr': 1})
+
+    def test_inline_generation_keeps_a_qr_stored_by_another_worker(self):
+        invoice = Invoice.objects.create(
+            createdByUser=self.user, totalBeforeDiscount=Decimal('2.50'), grandTotal=Decimal('2.50'),
+            paymentMethod='Cash'
+        )
+
+        def generate_qr_code(invoice_id, amount, currency):
+            # The background job of another worker process stores its QR code first
+            Invoice.objects.filter(pk=invoice_id).update(khqrCodeString='stored-qr', khqrMd5='stored-md5')
+            return {'qr_string': f'late-qr-{amount}-{currency}', 'md5_hash': 'late-md5'}
+
+        service = mock.Mock(bakong_account_id='shop@devb', generate_deeplink=mock.Mock(return_value=None))
+        service.generate_qr_code.side_effect = generate_qr_code
+        with mock.patch('api.views.get_khqr_service', return_value=service):
+            response = self.client.post(f'/api/invoices/{invoice.pk}/generate_khqr/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['md5_hash'], 'stored-md5')
+        service.generate_qr_code.assert_called_once_with(invoice_id=invoice.pk, amount=Decimal('2.50'), currency='USD')
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.khqrCodeString, invoice.khqrMd5), ('stored-qr', 'stored-md5'))
+
+
+class KHQRImageTest(TestCase):
+
+    QR_STRING = (
+        '00020101021229180014benchmark@devb520459995303840540115802KH5909Benchmark6010Phnom Penh'
+        '62150301x010110701t99340013179219286423901131792279264239630401FC'
+    )
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user(username='staff', password='secret', role='staff')
+        self.invoice = Invoice.objects.create(
+            createdByUser=self.user, totalBeforeDiscount=Decimal('1.00'), grandTotal=Decimal('1.00'),
+            paymentMethod='KHQR', khqrCodeString=self.QR_STRING, khqrMd5='f55ce6001591c45f6548d1f69374b076'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_image_is_rendered_once_and_revalidated_by_etag(self):
+        url = f'/api/invoices/{self.invoice.pk}/khqr.png'
+        response = self.client.get(url, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(default_storage.exists(image_path(self.invoice.khqrMd5, 'png')))
+
+        with mock.patch('api.views.store_image') as store_image:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            store_image.assert_not_called()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f'/api/invoices/{self.invoice.pk}/khqr.svg')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.content.startswith(b'<svg'))
+
+    def test_batch_prerender(self):
+        out = StringIO()
+        call_command('render_khqr_images', '--workers', '1', stdout=out)
+        self.assertIn('Rendered 2 image(s) for 1 QR code(s)', out.getvalue())
+        self.assertTrue(default_storage.exists(image_path(self.invoice.khqrMd5, 'svg')))
+
+        out = StringIO()
+        call_command('render_khqr_images', '--workers', '1', stdout=out)
+        self.assertIn('Rendered 0 image(s)', out.getvalue())
+
+
+class SalesSummaryTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='secret', role='manager')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        self.product = Product.objects.create(
+            productName='Cola', description='', skuCode='C1', unit='pcs', subcategory=subcategory
+        )
+        Inventory.objects.create(product=self.product, quantity=100, reorderLevel=5, location='Shop')
+        # 20:00 UTC is already the next day in Phnom Penh (UTC+7)
+        self.paid_at = datetime(2025, 3, 1, 20, 0, tzinfo=dt_timezone.utc)
+
+    def make_invoice(self, total, method='KHQR', quantity=2):
+        invoice = Invoice.objects.create(
+            createdByUser=self.user, totalBeforeDiscount=Decimal(total), grandTotal=Decimal(total),
+            paymentMethod=method, khqrMd5=f'md5-{Invoice.objects.count()}'
+        )
+        Purchase.objects.create(
+            invoice=invoice, product=self.product, quantity=quantity,
+            pricePerUnit=Decimal(total) / quantity, subtotal=Decimal(total)
+        )
+        return invoice
+
+    def pay(self, invoice):
+        invoice.status = 'Paid'
+        # paidAt is stamped by the pre_save signal
+        with mock.patch('django.utils.timezone.now', return_value=self.paid_at):
+            with self.captureOnCommitCallbacks(execute=True):
+                invoice.save()
+
+    def summary(self):
+        return list(DailySalesSummary.objects.values_list('date', 'paymentMethod', 'invoiceCount', 'revenue'))
+
+    def test_paid_invoices_update_the_summary_incrementally(self):
+        first, second = self.make_invoice('10.00'), self.make_invoice('4.00')
+        self.assertEqual(self.summary(), [])
+
+        self.pay(first)
+        self.pay(second)
+        day = date(2025, 3, 2)
+        self.assertEqual(self.summary(), [(day, 'KHQR', 2, Decimal('14.00'))])
+        self.assertEqual(DailyProductSales.objects.get(date=day, product=self.product).quantity, 4)
+
+        second.status = 'Cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertEqual(self.summary(), [(day, 'KHQR', 1, Decimal('10.00'))])
+
+        first.delete()
+        self.assertEqual(self.summary(), [(day, 'KHQR', 0, Decimal('0.00'))])
+
+    def test_bulk_payment_confirmation_is_counted(self):
+        invoices = [self.make_invoice('5.00') for _ in range(3)]
+        acknowledged_ms = int(self.paid_at.timestamp() * 1000)
+        paid = {invoice: {'hash': f'hash-{invoice.pk}', 'acknowledgedDateMs': acknowledged_ms} for invoice in invoices[:2]}
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_invoices_paid(paid, [invoice.pk for invoice in invoices])
+
+        self.assertEqual(self.summary(), [(date(2025, 3, 2), 'KHQR', 2, Decimal('10.00'))])
+
+    def test_check_payment_racing_the_poller_is_counted_once(self):
+        invoice = self.make_invoice('10.00')
+        payment = {'hash': 'hash-poller', 'acknowledgedDateMs': int(self.paid_at.timestamp() * 1000)}
+
+        def check_transaction_by_md5(md5):
+            # The poller confirms the invoice while check_payment waits on Bakong
+            mark_invoices_paid({Invoice.objects.get(pk=invoice.pk): payment}, [invoice.pk])
+            return {'hash': 'hash-request', 'acknowledgedDateMs': payment['acknowledgedDateMs'] + 5000}
+
+        service = mock.Mock(get_access_token=mock.Mock(return_value='token'))
+        service.check_transaction_by_md5.side_effect = check_transaction_by_md5
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('api.views.get_khqr_service', return_value=service), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/invoices/{invoice.pk}/check_payment/')
+
+        self.assertTrue(response.data['paid'])
+        self.assertEqual(self.summary(), [(date(2025, 3, 2), 'KHQR', 1, Decimal('10.00'))])
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.paidAt, invoice.khqrTransactionHash), (self.paid_at, 'hash-poller'))
+
+    def test_mark_as_paid_after_the_poller_confirmed_is_counted_once(self):
+        invoice = self.make_invoice('10.00')
+        payment = {'hash': 'hash-poller', 'acknowledgedDateMs': int(self.paid_at.timestamp() * 1000)}
+
+        def get_object(view):
+            # The poller confirms the invoice right after the view loaded it
+            stale = Invoice.objects.get(pk=invoice.pk)
+            mark_invoices_paid({Invoice.objects.get(pk=invoice.pk): payment}, [invoice.pk])
+            return stale
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.object(InvoiceViewSet, 'get_object', autospec=True, side_effect=get_object), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/invoices/{invoice.pk}/mark_as_paid/')
+
+        self.assertEqual(response.data['message'], 'Invoice is already marked as paid')
+        self.assertEqual(self.summary(), [(date(2025, 3, 2), 'KHQR', 1, Decimal('10.00'))])
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.paidAt, invoice.khqrTransactionHash), (self.paid_at, 'hash-poller'))
+
+    def test_rebuild_matches_incremental_totals(self):
+        for total, method in (('10.00', 'KHQR'), ('3.50', 'Cash'), ('6.50', 'KHQR')):
+            self.pay(self.make_invoice(total, method))
+        incremental = sorted(self.summary())
+        products = list(DailyProductSales.objects.values_list('date', 'product', 'quantity', 'revenue'))
+
+        DailySalesSummary.objects.update(revenue=0)
+        call_command('rebuild_sales_summary', stdout=StringIO())
+
+        self.assertEqual(sorted(self.summary()), incremental)
+        self.assertEqual(list(DailyProductSales.objects.values_list('date', 'product', 'quantity', 'revenue')), products)
+
+    def test_report_endpoint(self):
+        self.pay(self.make_invoice('10.00'))
+        self.pay(self.make_invoice('2.00', 'Cash', quantity=1))
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get('/api/reports/sales/', {'period': 'month', 'start': '2025-03-01', 'end': '2025-03-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['timezone'], 'Asia/Phnom_Penh')
+        [month] = response.data['results']
+        self.assertEqual(month['period'], '2025-03-01')
+        self.assertEqual((month['invoiceCount'], month['revenue']), (2, '12.00'))
+        self.assertEqual(month['paymentMethods']['Cash'], {'invoiceCount': 1, 'revenue': '2.00'})
+        self.assertEqual(month['topProducts'][0]['quantity'], 3)
+
+        self.assertEqual(client.get('/api/reports/sales/', {'period': 'year'}).status_code, 400)
+        self.assertEqual(client.get('/api/reports/sales/', {'start': '2025-13-01'}).status_code, 400)
+
+        client.force_authenticate(User.objects.create_user(username='staff', password='secret', role='staff'))
+        self.assertEqual(client.get('/api/reports/sales/').status_code, 403)
+
+
+class LowStockTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='staff', password='secret', role='staff')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        for i, quantity in enumerate([0, 5, 6, 2, 50]):
+            product = Product.objects.create(
+                productName=f'Product {i}', description='', skuCode=f'P{i}', unit='pcs', subcategory=subcategory
+            )
+            Inventory.objects.create(product=product, quantity=quantity, reorderLevel=5, location='Shop')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_low_stock_list_is_paginated_with_product_details(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/inventory/low-stock/', {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            [(row['productName'], row['shortage']) for row in response.data['results']],
+            [('Product 0', 5), ('Product 1', 0)]
+        )
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['skuCode'] for row in response.data['results']], ['P3'])
+        self.assertIsNone(response.data['next'])
+
+    def test_low_stock_count(self):
+        response = self.client.get('/api/inventory/low-stock/count/')
+        self.assertEqual(response.data, {'count': 3})
+        response = self.client.get('/api/inventory/low-stock/count/', {'location': 'Warehouse'})
+        self.assertEqual(response.data, {'count': 0})
+
+    def test_queries_use_the_partial_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Other planners may prefer a sequential scan on a five-row table")
+        plan = Inventory.objects.filter(LOW_STOCK).order_by('inventoryId').explain()
+        self.assertIn('inventory_low_stock_idx', plan)
+
+
+class QueryPlanTest(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plans of near-empty tables are planner specific")
+        out = StringIO()
+        call_command('explain_hot_queries', '--min-rows', '0', '--fail', stdout=out)
+        self.assertIn('All 9 hot queries use indexes', out.getvalue())
+
+    def test_sequential_scans_are_detected(self):
+        self.assertEqual(
+            list(_sqlite_scans('3 0 0 SCAN api_invoice\n9 0 0 SEARCH api_user USING INTEGER PRIMARY KEY (rowid=?)')),
+            [('api_invoice', 'seq'), ('api_user', 'index')]
+        )
+        # An index walk whose rows are sorted afterwards still reads every row
+        self.assertEqual(
+            list(_sqlite_scans('6 0 0 SCAN api_invoice USING INDEX some_fk_idx\n58 0 0 USE TEMP B-TREE FOR ORDER BY')),
+            [('api_invoice', 'seq')]
+        )
+        plan = {'Node Type': 'Limit', 'Plans': [
+            {'Node Type': 'Nested Loop', 'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'api_invoice'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'api_user'},
+            ]},
+        ]}
+        self.assertEqual(list(_postgres_scans(plan)), [('api_invoice', 'seq'), ('api_user', 'index')])
+
+
+class ProductSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()  # Catalog responses are cached across tests
+        self.user = User.objects.create_user(username='staff', password='secret', role='staff')
+        drinks = Category.objects.create(name='Drinks')
+        self.soda = SubCategory.objects.create(category=drinks, name='Soda')
+        self.water = SubCategory.objects.create(category=drinks, name='Water')
+        self.source = Source.objects.create(name='Wholesaler')
+        for name, sku, subcategory, price, status in [
+            ('Coca Cola 330ml', 'CC330', self.soda, '0.75', 'Active'),
+            ('Cola Zero', 'CZ330', self.soda, '0.80', 'Active'),
+            ('Mineral Water', 'MW500', self.water, '0.50', 'Active'),
+            ('Sparkling Water with cola flavour', 'SW500', self.water, '1.20', 'Inactive'),
+        ]:
+            Product.objects.create(
+                productName=name, description='', skuCode=sku, unit='pcs', subcategory=subcategory,
+                source=self.source, salePrice=Decimal(price), status=status
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_search_ranks_and_counts_facets(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/search/', {'q': 'cola', 'subcategory': self.soda.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([p['skuCode'] for p in response.data['results']], ['CZ330', 'CC330'])
+        self.assertNotIn('costPrice', response.data['results'][0])
+
+        # The subcategory facet ignores its own filter; the others apply it
+        facets = response.data['facets']
+        self.assertEqual(
+            {(f['label'], f['count']) for f in facets['subcategory']}, {('Soda', 2), ('Water', 1)}
+        )
+        self.assertEqual([(f['value'], f['count']) for f in facets['status']], [('Active', 2)])
+        self.assertEqual([(f['label'], f['count']) for f in facets['source']], [('Wholesaler', 2)])
+
+    def test_exact_sku_ranks_first(self):
+        response = self.client.get('/api/products/search/', {'q': 'mw500'})
+        self.assertEqual([p['skuCode'] for p in response.data['results']], ['MW500'])
+
+    def test_list_applies_filters(self):
+        response = self.client.get('/api/products/', {'max_price': '0.78', 'status': 'Active'})
+        self.assertEqual([p['skuCode'] for p in response.data], ['CC330', 'MW500'])
+        self.assertEqual(len(self.client.get('/api/products/').data), 4)
+        self.assertEqual(self.client.get('/api/products/', {'min_price': 'cheap'}).status_code, 400)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=True)
+class CatalogCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        self.product = Product.objects.create(
+            productName='Cola', description='', skuCode='C1', unit='pcs', subcategory=subcategory,
+            costPrice=Decimal('0.40'), salePrice=Decimal('0.75')
+        )
+        self.manager = User.objects.create_user(username='manager', password='secret', role='manager')
+        self.staff = User.objects.create_user(username='staff', password='secret', role='staff')
+        self.client = APIClient()
+
+    def test_responses_are_cached_until_the_model_changes(self):
+        self.client.force_authenticate(self.manager)
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data[0]['salePrice'], '0.75')
+
+        self.product.salePrice = Decimal('0.90')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['salePrice'], '0.90')
+
+        # Other models' cached responses are untouched
+        self.client.get('/api/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'HIT')
+
+    def test_cache_varies_by_role(self):
+        self.client.force_authenticate(self.manager)
+        self.assertIn('costPrice', self.client.get(f'/api/products/{self.product.pk}/').data)
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotIn('costPrice', response.data)
+
+        self.assertEqual(self.client.get('/api/products/999/').status_code, 404)
+
+    def test_concurrent_misses_build_once(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return ['rows']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_build('stampede', build))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual([value for value, _ in results], [['rows']] * 5)
+
+    @override_settings(CATALOG_CACHE_ENABLED=False)
+    def test_disabled_cache_validates_from_the_database(self):
+        self.client.force_authenticate(self.manager)
+        response = self.client.get('/api/products/')
+        self.assertNotIn('X-Cache', response)
+        etag = response['ETag']
+
+        # The cache version would only live in this process, so the rows' updatedAt validates instead
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        detail = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(
+            self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304
+        )
+
+        self.product.salePrice = Decimal('0.90')
+        self.product.save()
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='manager', password='secret', role='manager')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        self.product = Product.objects.create(
+            productName='Cola', description='', skuCode='C1', unit='pcs', subcategory=subcategory
+        )
+        self.inventory = Inventory.objects.create(product=self.product, quantity=10, reorderLevel=2, location='Shop')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_list_answers_304_without_serializing(self):
+        response = self.client.get('/api/inventory/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with mock.patch('api.views.InventorySerializer.to_representation') as to_representation:
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/inventory/', HTTP_IF_NONE_MATCH=etag)
+            to_representation.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.inventory.quantity = 9
+        self.inventory.save()
+        response = self.client.get('/api/inventory/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Deleting a row changes the validator too
+        Inventory.objects.create(product=self.product, quantity=1, reorderLevel=2, location='Back')
+        etag = self.client.get('/api/inventory/')['ETag']
+        Inventory.objects.filter(location='Back').delete()
+        self.assertEqual(self.client.get('/api/inventory/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_supports_last_modified(self):
+        url = f'/api/inventory/{self.inventory.pk}/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get('/api/inventory/999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/inventory/abc/').status_code, 404)
+
+    @override_settings(CATALOG_CACHE_ENABLED=True)
+    def test_catalog_etag_follows_cache_version(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Staff get a different representation, so a different ETag
+        self.client.force_authenticate(User.objects.create_user(username='staff', password='secret', role='staff'))
+        self.assertNotEqual(self.client.get('/api/products/')['ETag'], etag)
+
+
+class DeltaSyncTest(TestCase):
+
+    def setUp(self):
+        self.enterContext(self.settings(SYNC_CURSOR_OVERLAP=0))
+        self.user = User.objects.create_user(username='staff', password='secret', role='staff')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        self.source = Source.objects.create(name='Supplier')
+        self.products = [
+            Product.objects.create(
+                productName=f'Product {i}', description='', skuCode=f'P{i}', unit='pcs',
+                subcategory=subcategory, source=self.source
+            )
+            for i in range(3)
+        ]
+        self.inventory = Inventory.objects.create(
+            product=self.products[0], quantity=10, reorderLevel=2, location='Shop'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None):
+        response = self.client.get('/api/sync/', {'since': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sync_returns_only_changes_since_the_cursor(self):
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['changes']['products']['updated']), 3)
+        self.assertNotIn('costPrice', data['changes']['products']['updated'][0])
+
+        self.assertEqual(
+            {key: changes['updated'] for key, changes in self.sync(data['cursor'])['changes'].items()},
+            {'categories': [], 'subcategories': [], 'products': [], 'inventory': [], 'customers': []}
+        )
+
+        cursor = data['cursor']
+        self.products[1].salePrice = Decimal('2.50')
+        self.products[1].save()
+        deleted_product, deleted_inventory = self.products[2].pk, self.inventory.pk
+        self.products[2].delete()
+        self.inventory.delete()
+
+        with self.assertNumQueries(6):  # One per model plus the tombstones
+            data = self.sync(cursor)
+        self.assertFalse(data['reset'])
+        products = data['changes']['products']
+        self.assertEqual([row['productId'] for row in products['updated']], [self.products[1].pk])
+        self.assertEqual(products['deleted'], [deleted_product])
+        self.assertEqual(data['changes']['inventory']['deleted'], [deleted_inventory])
+
+    def test_deleting_a_source_marks_its_products_changed(self):
+        cursor = self.sync()['cursor']
+        self.source.delete()
+        updated = self.sync(cursor)['changes']['products']['updated']
+        self.assertEqual(len(updated), 3)
+        self.assertTrue(all(row['source'] is None for row in updated))
+
+    def test_old_or_invalid_cursor(self):
+        expired = (timezone.now() - timezone.timedelta(days=31)).isoformat()
+        self.assertTrue(self.sync(expired)['reset'])
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/', {'since': '2025-01-01T00:00:00'}).status_code, 400)
+
+    def test_prune_tombstones(self):
+        self.inventory.delete()
+        SyncTombstone.objects.update(deletedAt=timezone.now() - timezone.timedelta(days=31))
+        self.products[0].delete()
+        call_command('prune_sync_tombstones', stdout=StringIO())
+        self.assertEqual(list(SyncTombstone.objects.values_list('model', flat=True)), ['product'])
+
+
+class CatalogImportTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='secret', role='manager')
+        category = Category.objects.create(name='Drinks')
+        self.subcategory = SubCategory.objects.create(category=category, name='Soda')
+        Source.objects.create(name='Acme')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='catalog.csv', **data):
+        return self.client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile(name, content.encode('utf-8')), **data}
+        )
+
+    def test_import_creates_products_and_inventory(self):
+        content = (
+            'skuCode,productName,unit,salePrice,subcategory,source,quantity\n'
+            'C1,Cola,can,1.50,Soda,acme,24\n'
+            'C2,"Cola, zero",can,1.60,%d,,0\n'
+            'C3,Broken,can,abc,Juice,,5\n'
+            'C1,Cola again,can,1.50,Soda,,1\n' % self.subcategory.pk
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload(content, location='Shop')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['inventoryCreated']), (2, 2))
+        self.assertEqual(
+            [(error['row'], sorted(error['errors'])) for error in response.data['errors']],
+            [(4, ['salePrice', 'subcategory']), (5, ['skuCode'])]
+        )
+        self.assertEqual(len(response.data['batches']), 1)
+
+        cola = Product.objects.get(skuCode='C1')
+        self.assertEqual((cola.salePrice, cola.source.name), (Decimal('1.50'), 'Acme'))
+        self.assertEqual(Inventory.objects.get(product=cola).quantity, 24)
+        self.assertEqual(ActivityLog.objects.filter(actionType='IMPORT_CATALOG').count(), 1)
+        self.assertFalse(ActivityLog.objects.filter(actionType='CREATE_PRODUCT').exists())
+        self.assertTrue(all(quantity == ledger for _, quantity, ledger in iter_ledger_balances()))
+
+    def test_values_beyond_the_column_limits_reject_their_row(self):
+        content = (
+            'skuCode,productName,unit,salePrice,discount,subcategory,quantity\n'
+            'C1,Cola,can,1.50,0,Soda,24\n'
+            f'C2,{"x" * 256},{"y" * 51},123456789.00,1000,Soda,{10 ** 19}\n'
+            f'{"S" * 101},Tea,box,1.255,0,Soda,1\n'
+        )
+        response = self.upload(content, location='Shop')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(
+            [(error['row'], sorted(error['errors'])) for error in response.data['errors']],
+            [(3, ['discount', 'productName', 'quantity', 'salePrice', 'unit']), (4, ['skuCode'])]
+        )
+
+    def test_reimport_updates_only_the_given_columns(self):
+        self.upload('skuCode,productName,unit,costPrice,salePrice,subcategory,quantity,location\n'
+                    'C1,Cola,can,1.00,1.50,Soda,24,Shop\n')
+        cola = Product.objects.get(skuCode='C1')
+
+        response = self.upload('skuCode,salePrice,quantity,location\nC1,1.75,20,Shop\nNEW,2.00,1,Shop\n')
+        self.assertEqual((response.data['updated'], response.data['inventoryUpdated']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['errors'], {
+            'productName': 'Required for new products',
+            'unit': 'Required for new products',
+            'subcategory': 'Required for new products',
+        })
+        cola.refresh_from_db()
+        self.assertEqual((cola.productName, cola.costPrice, cola.salePrice), ('Cola', Decimal('1.00'), Decimal('1.75')))
+        inventory = Inventory.objects.get(product=cola)
+        self.assertEqual(inventory.quantity, 20)
+        self.assertEqual(balance_as_of(inventory.pk), 20)
+
+    def test_command_reports_each_batch(self):
+        rows = ''.join(f'P{i},Product {i},pcs,Soda\n' for i in range(5))
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('skuCode,productName,unit,subcategory\n' + rows)
+        out = StringIO()
+        call_command('import_catalog', file.name, '--batch-size', '2', stdout=out)
+        self.assertEqual(out.getvalue().count('Batch '), 3)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_bad_files_are_rejected(self):
+        self.assertEqual(self.upload('skuCode,colour\nC1,red\n').status_code, 400)
+        self.assertEqual(self.upload('skuCode,quantity\nC1,1\n').status_code, 400)  # No location
+        self.assertEqual(self.upload('a,b', name='catalog.txt').status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user(username='staff', password='secret', role='staff'))
+        self.assertEqual(self.upload('skuCode\nC1\n').status_code, 403)
+
+    def test_unreadable_files_are_rejected(self):
+        def post(name, content):
+            return self.client.post('/api/products/import/', {'file': SimpleUploadedFile(name, content)})
+
+        # An Excel "CSV" export in Latin-1
+        content = b'skuCode,productName,unit,subcategory\nP,Tea,pcs,Soda\nC,Caf\xe9,pcs,Soda\n'
+        response = post('catalog.csv', content)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 3 is not UTF-8', response.data['error'])
+        self.assertEqual(post('catalog.csv', b'skuCode\n' + b'x' * 200000 + b'\n').status_code, 400)  # csv.Error
+        self.assertEqual(post('catalog.xlsx', b'not a zip file').status_code, 400)
+        self.assertFalse(Product.objects.exists())
+
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as file:
+            file.write(content)
+        with self.assertRaisesMessage(CommandError, '1 products of earlier rows were already imported'):
+            call_command('import_catalog', file.name, '--batch-size', '1', stdout=StringIO())
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='secret', role='manager')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        ActivityLog.objects.all().delete()
+        ActivityLog.objects.bulk_create([
+            # 20:00 UTC on Mar 1 is already Mar 2 in Phnom Penh
+            ActivityLog(user=self.user, actionType='TEST', description='ស្វាគមន៍, "quoted"',
+                        createdAt=datetime(2025, 3, 1, 20, 0, tzinfo=dt_timezone.utc)),
+            ActivityLog(user=None, actionType='TEST', description='Second',
+                        createdAt=datetime(2025, 3, 3, 1, 0, tzinfo=dt_timezone.utc)),
+        ])
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_streams_rows_in_local_time(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/exports/activitylogs.csv', {'start': '2025-03-02', 'end': '2025-03-02'})
+            rows = self.content(response).decode('utf-8-sig').splitlines()
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="activitylogs-2025-03-02-2025-03-02.csv"')
+        self.assertEqual(rows[0], 'logId,createdAt,user,actionType,description')
+        self.assertEqual(len(rows), 2)
+        self.assertIn('2025-03-02T03:00:00+07:00,manager,TEST,"ស្វាគមន៍, ""quoted"""', rows[1])
+
+    def test_jsonl_export_can_be_gzipped(self):
+        response = self.client.get('/api/exports/activitylogs.jsonl', {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.content(response)).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['description'] for line in lines], ['ស្វាគមន៍, "quoted"', 'Second'])
+        self.assertIsNone(json.loads(lines[1])['user'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/exports/activitylogs.csv', {'start': '2025-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/users.csv').status_code, 404)
+        self.client.force_authenticate(User.objects.create_user(username='staff', password='secret', role='staff'))
+        self.assertEqual(self.client.get('/api/exports/invoices.csv').status_code, 403)
+
+
+class ProductImageUploadTest(TestCase):
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user(username='staff', password='secret', role='staff')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name):
+        return self.client.post('/api/upload/', {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def stored(self, url):
+        return Image.open(default_storage.open(url.split(settings.MEDIA_URL, 1)[1]))
+
+    def test_photo_is_reencoded_resized_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display
+        exif[0x010F] = 'Camera maker'
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, format='JPEG', exif=exif)
+
+        response = self.upload(buffer.getvalue(), 'photo.jpg')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.data['variants']), {'full', 'medium', 'thumbnail'})
+        self.assertEqual((response.data['width'], response.data['height']), (640, 1280))
+        self.assertEqual(response.data['url'], response.data['variants']['full'])
+        self.assertEqual(variant_name(response.data['url'], 'thumbnail'), response.data['variants']['thumbnail'])
+
+        for variant, size in (('full', (640, 1280)), ('medium', (240, 480)), ('thumbnail', (80, 160))):
+            image = self.stored(response.data['variants'][variant])
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, size)
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_invalid_images_are_rejected(self):
+        self.assertEqual(self.upload(b'not an image', 'photo.png').status_code, 400)
+        self.assertEqual(self.upload(b'GIF89a', 'photo.exe').status_code, 400)
+        self.assertFalse(default_storage.exists('products'))
+
+    def test_same_image_is_stored_once(self):
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(buffer, format='PNG')
+        first = self.upload(buffer.getvalue(), 'a.png').data
+        second = self.upload(buffer.getvalue(), 'b.png').data
+        self.assertEqual(first['variants'], second['variants'])
+
+        path = first['url'].split(settings.MEDIA_URL, 1)[1]
+        self.assertRegex(path, r'^products/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.webp$')
+        directories, files = default_storage.listdir(path.rsplit('/', 1)[0])
+        self.assertEqual(len(files), 3)
+
+
+class MediaGarbageCollectionTest(TestCase):
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user(username='owner', password='secret', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (50, 50), color).save(buffer, format='PNG')
+        response = self.client.post('/api/upload/', {'file': SimpleUploadedFile('photo.png', buffer.getvalue())})
+        return response.data['url']
+
+    def test_unreferenced_files_are_deleted(self):
+        kept, orphan = self.upload('red'), self.upload('green')
+        subcategory = SubCategory.objects.create(category=Category.objects.create(name='Drinks'), name='Soda')
+        for sku, image in (('R1', kept), ('R2', kept), ('E1', 'https://example.com/media/products/photo.png')):
+            Product.objects.create(
+                productName=sku, description='', skuCode=sku, unit='pcs', subcategory=subcategory, image=image
+            )
+        profile = UserProfile.objects.create(user=self.user)
+        profile.qrCodeImage.save('qr.png', ContentFile(b'qr code'))
+
+        out = StringIO()
+        call_command('collect_media_garbage', stdout=out)
+        self.assertIn('Deleted 0 of 7 media file(s)', out.getvalue())  # All younger than a day
+
+        out = StringIO()
+        call_command('collect_media_garbage', '--min-age-hours', '0', stdout=out)
+        self.assertIn('Deleted 3 of 7 media file(s)', out.getvalue())
+        orphan_path = orphan.split(settings.MEDIA_URL, 1)[1]
+        for variant in ('full', 'medium', 'thumbnail'):
+            self.assertFalse(default_storage.exists(variant_name(orphan_path, variant)))
+            self.assertTrue(default_storage.exists(variant_name(kept.split(settings.MEDIA_URL, 1)[1], variant)))
+        self.assertTrue(default_storage.exists(profile.qrCodeImage.name))
+        self.assertRegex(profile.qrCodeImage.name, r'^qr_codes/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+
+
+class InvoicePDFTest(TestCase):
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user(username='cashier', password='secret', role='staff')
+        UserProfile.objects.create(user=self.user, businessName='Corner Shop', businessPhone='012 345 678')
+        category = Category.objects.create(name='Drinks')
+        subcategory = SubCategory.objects.create(category=category, name='Soda')
+        product = Product.objects.create(
+            productName='Cola', description='', skuCode='C1', unit='pcs', subcategory=subcategory
+        )
+        self.invoice = Invoice.objects.create(
+            createdByUser=self.user, totalBeforeDiscount=Decimal('3.00'), grandTotal=Decimal('3.00'),
+            paymentMethod='Cash'
+        )
+        Purchase.objects.bulk_create([Purchase(
+            invoice=self.invoice, product=product, quantity=2, pricePerUnit=Decimal('1.50'), subtotal=Decimal('3.00')
+        )])
+        Invoice.objects.filter(pk=self.invoice.pk).update(createdAt=datetime(2025, 3, 10, 3, 0, tzinfo=dt_timezone.utc))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/invoices/{self.invoice.pk}/pdf/'
+
+    def test_paid_invoice_is_rendered_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.status = 'Paid'
+            self.invoice.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+        with mock.patch('api.views.store_pdf') as store_pdf, self.assertNumQueries(2):  # Only the status, per request
+            response = self.client.get(self.url)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        store_pdf.assert_not_called()
+
+    def test_pending_invoice_version_follows_its_content(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(note='Deliver tomorrow')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_batch_render_for_a_month(self):
+        out = StringIO()
+        call_command('render_invoice_pdfs', '2025-03', '--workers', '1', stdout=out)
+        self.assertIn('Rendered 1 PDF(s) for 1 invoice(s) of 2025-03', out.getvalue())
+
+        out = StringIO()
+        call_command('render_invoice_pdfs', '2025-03', '--workers', '1', stdout=out)
+        self.assertIn('Rendered 0 PDF(s) for 1 invoice(s)', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('render_invoice_pdfs', 'March')
+
@@ -1,6 +1,7 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 # router automatically create the url or api endpoint for all methods
 router = DefaultRouter()
@@ -17,12 +18,34 @@ router.register(r'invoices', views.InvoiceViewSet)
 router.register(r'purchases', views.PurchaseViewSet)
 router.register(r'transactions', views.TransactionViewSet)
 router.register(r'activitylogs', views.ActivityLogViewSet)
+router.register(r'stock-movements', views.StockMovementViewSet)
 
 from .authentication import LoginView, RegisterView
 
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('register/', RegisterView.as_view(), name='register'),
+    re_path(
+        r'^invoices/(?P<pk>[0-9]+)/khqr\.(?P<fmt>png|svg)$',
+        views.InvoiceViewSet.as_view({'get': 'khqr_image'}),
+        name='invoice-khqr-image'
+    ),
     path('', include(router.urls)),
     path('upload/', views.upload_image, name='upload_image'),
-]
\ No newline at end of file
+    path('reports/sales/', views.sales_report, name='sales_report'),
+    path('sync/', views.sync, name='sync'),
+    re_path(
+        r'^exports/(?P<name>invoices|purchases|transactions|activitylogs)\.(?P<fmt>csv|jsonl)$',
+        views.export,
+        name='export'
+    ),
+]
+
+# Native async payment actions (run under ASGI); listed first so they take
+# precedence over the router's sync versions of the same URLs
+if settings.KHQR_ASYNC_VIEWS:
+    urlpatterns = [
+        path('invoices/batch_check_payments/', async_views.batch_check_payments, name='invoice-batch-check-payments'),
+        path('invoices/<int:pk>/check_payment/', async_views.check_payment, name='invoice-check-payment'),
+        path('invoices/<int:pk>/generate_khqr/', async_views.generate_khqr, name='invoice-generate-khqr'),
+    ] + urlpatterns
\ No newline at end of file
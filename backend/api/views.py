@@ -1,16 +1,42 @@
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import ValidationError
-from rest_framework.decorators import action, api_view, parser_classes, permission_classes
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes, renderer_classes
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from django.db import transaction
-from django.core.files.storage import default_storage
+from django.db.models import F, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 import logging
+import time
 import traceback
-from .khqr_service import KHQRService
+from .catalog_cache import CachedCatalogMixin
+from .catalog_import import ImportFileError, detect_format, import_catalog
+from .conditional import ConditionalGetMixin
+from .delta_sync import changes_since, parse_cursor
+from .exports import FORMATS as EXPORT_FORMATS, stream_export
+from .khqr_generation import KHQR_CURRENCY, schedule_invoice_qr, store_invoice_qr, wait_for_invoice_qr
+from .invoice_pdf import invoice_document, load_pdf, pdf_etag, pdf_version, store_pdf
+from .khqr_images import IMAGE_CONTENT_TYPES, image_etag, load_image, store_image
+from .khqr_service import get_khqr_service
+from .khqr_payments import (
+    BAKONG_BATCH_SIZE, check_invoices, chunked, mark_invoices_paid, payment_status, pending_khqr_invoices
+)
+from .renderers import CSVRenderer, JSONLinesRenderer, PDFRenderer, PNGRenderer, SVGRenderer
+from .media_storage import media_storage
+from .product_images import ImageProcessingError, save_product_image
+from .product_search import facet_counts, parse_filters, search_products
+from .sales_summary import DEFAULT_SPANS, PERIODS, local_today, report_timezone, sales_report as build_sales_report
+from .pagination import (
+    ActivityLogPagination, InvoicePagination, LowStockPagination, TransactionPagination, StockMovementPagination
+)
+from .stock_ledger import balance_as_of, record_movement
 
 logger = logging.getLogger(__name__)
 from .permissions import (
@@ -33,13 +59,16 @@ from .models import (
     Invoice,
     Purchase,
     Transaction,
-    ActivityLog
+    ActivityLog,
+    StockMovement,
+    LOW_STOCK
 )
 from .serializers import (
     UserSerializer,
     UserProfileSerializer,
     ProductSerializer, 
     InventorySerializer, 
+    LowStockSerializer,
     CategorySerializer, 
     SubCategorySerializer, 
     SourceSerializer,
@@ -48,7 +77,8 @@ from .serializers import (
     InvoiceSerializer,
     PurchaseNestedSerializer,
     TransactionSerializer,
-    ActivityLogSerializer
+    ActivityLogSerializer,
+    StockMovementSerializer
 )
 
 
@@ -56,12 +86,11 @@ from .serializers import (
 @permission_classes([IsAuthenticated])
 @parser_classes([MultiPartParser, FormParser])
 def upload_image(request):
-    """Upload product image with validation"""
+    """Upload product image with validation; stored as WebP with medium and thumbnail variants"""
     file_obj = request.FILES.get('file')
     if not file_obj:
         return Response({'error': 'No file provided'}, status=400)
     
-    import uuid
     from pathlib import Path
     
     # Validate file type
@@ -81,62 +110,293 @@ def upload_image(request):
         }, status=400)
     
     try:
-        # Generate unique filename to prevent conflicts
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # Save the file with unique name
-        file_name = default_storage.save(f'products/{unique_filename}', file_obj)
-        file_url = default_storage.url(file_name)
-        
-        # Return the full URL
-        full_url = request.build_absolute_uri(file_url)
-        return Response({'url': full_url}, status=201)
+        # Re-encoded to WebP in several sizes, without the original's metadata
+        file_names, (width, height) = save_product_image(file_obj)
+    except ImageProcessingError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         return Response({'error': f'Failed to upload image: {str(e)}'}, status=500)
 
+    # Return full URLs; 'url' is the full size image, to be stored as Product.image
+    urls = {name: request.build_absolute_uri(media_storage.url(file_name)) for name, file_name in file_names.items()}
+    return Response({'url': urls['full'], 'variants': urls, 'width': width, 'height': height}, status=201)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminOrManager])
+def sales_report(request):
+    """
+    Sales totals, payment-method split and top products per day, week or month
+    GET /api/reports/sales/?period=week&start=2025-01-01&end=2025-03-31&top=5
+    Dates are local days in REPORT_TIME_ZONE; both ends are inclusive.
+    """
+    period = request.query_params.get('period', 'day')
+    if period not in PERIODS:
+        return Response({'error': f'Invalid period, use one of: {", ".join(PERIODS)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dates = {}
+    for name in ('start', 'end'):
+        value = request.query_params.get(name)
+        if value:
+            try:
+                dates[name] = parse_date(value)
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                return Response({'error': f'Invalid "{name}" date, use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+    end = dates.get('end') or local_today()
+    start = dates.get('start') or end - DEFAULT_SPANS[period]
+    if start > end:
+        return Response({'error': '"start" must not be after "end"'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        top = int(request.query_params.get('top', 5))
+    except ValueError:
+        return Response({'error': '"top" must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    top = max(0, min(top, 50))
+
+    return Response({
+        'period': period,
+        'timezone': str(report_timezone()),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'results': build_sales_report(start, end, period=period, top=top),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminOrManager])
+@renderer_classes([JSONRenderer, CSVRenderer, JSONLinesRenderer])
+def export(request, name, fmt):
+    """
+    Stream invoices, purchases, transactions or activity logs as CSV or JSON Lines
+    GET /api/exports/invoices.csv?start=2025-01-01&end=2025-01-31&gzip=1
+    Dates are local days in REPORT_TIME_ZONE; both ends are inclusive.
+    """
+    dates = {}
+    for param in ('start', 'end'):
+        value = request.query_params.get(param)
+        if value:
+            try:
+                dates[param] = parse_date(value)
+            except ValueError:
+                dates[param] = None
+            if dates[param] is None:
+                return Response({'error': f'Invalid "{param}" date, use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+    if dates.get('start') and dates.get('end') and dates['start'] > dates['end']:
+        return Response({'error': '"start" must not be after "end"'}, status=status.HTTP_400_BAD_REQUEST)
+    compress = request.query_params.get('gzip') in ('1', 'true')
+
+    filename = '-'.join([name] + [dates[param].isoformat() for param in ('start', 'end') if dates.get(param)])
+    filename += f'.{fmt}.gz' if compress else f'.{fmt}'
+    response = StreamingHttpResponse(
+        stream_export(name, fmt, start=dates.get('start'), end=dates.get('end'), compress=compress),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'  # Let nginx pass the stream through instead of buffering it
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync(request):
+    """
+    Products, inventory, categories, subcategories and customers changed or
+    deleted since a cursor, for offline terminals
+    GET /api/sync/?since=<cursor from the previous response>
+    Without `since` (or after a long time offline) everything is returned with
+    "reset": true and the client should replace its local copy.
+    """
+    since = request.query_params.get('since')
+    if since:
+        try:
+            since = parse_cursor(since)
+        except ValueError:
+            return Response({'error': 'Invalid "since" cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(changes_since(since or None, context={'request': request}))
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsAdmin] # Only administrators should manage users
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
+    modified_field = 'updatedAt'
     
     def get_queryset(self):
         # Users can only see their own profile
+        queryset = super().get_queryset()
         if self.request.user.role == 'administrator':
-            return UserProfile.objects.all()
-        return UserProfile.objects.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    modified_field = 'updatedAt'  # Validates without the catalog cache (its version is used when enabled)
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Admins/Managers can manage, Staff can view
     
-class SubCategoryViewSet(viewsets.ModelViewSet):
+class SubCategoryViewSet(ConditionalGetMixin, CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
+    modified_field = 'updatedAt'
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Admins/Managers can manage, Staff can view
 
-class SourceViewSet(viewsets.ModelViewSet):
+class SourceViewSet(ConditionalGetMixin, CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Source.objects.all()
     serializer_class = SourceSerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Admins/Managers can manage, Staff can view
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    modified_field = 'updatedAt'
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can create/edit, Staff can view
+    search_limit = 50
+    max_search_limit = 200
+    
+    def search_queryset(self, queryset):
+        """
+        Products matching ?q= and the price range, ranked when searching, and
+        the facet filters (?status=, ?subcategory=, ?source=) still to apply
+        """
+        params = self.request.query_params
+        filters, facet_filters = parse_filters(params)
+        queryset = queryset.filter(**filters)
+        
+        if params.get('q', '').strip():
+            queryset = search_products(queryset, params['q']).order_by('-rank', 'productName')
+        elif filters or facet_filters:
+            queryset = queryset.order_by('productName')
+        return queryset, facet_filters
+    
+    def filter_queryset(self, queryset):
+        """Apply search and filters to the plain list too (same shape as before: a list of products)"""
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list':
+            return queryset
+        queryset, facet_filters = self.search_queryset(queryset)
+        return queryset.filter(**facet_filters)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked product search with filters and facet counts, in two queries
+        GET /api/products/search/?q=coca&status=Active&subcategory=3&source=1&min_price=0.5&max_price=2&limit=50
+        """
+        try:
+            limit = int(request.query_params.get('limit', self.search_limit))
+        except ValueError:
+            return Response({'error': '"limit" must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_search_limit))
+        
+        queryset, facet_filters = self.search_queryset(self.get_queryset())
+        count, facets = facet_counts(queryset, facet_filters)
+        results = queryset.filter(**facet_filters)[:limit]
+        
+        return Response({
+            'count': count,
+            'results': self.get_serializer(results, many=True).data,
+            'facets': facets,
+        })
+    
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def import_products(self, request):
+        """
+        Create or update products (and inventory) from a CSV/XLSX file, in batches
+        POST /api/products/import/ (multipart: file, optional location)
+        Returns the totals, a report per batch and the rejected rows.
+        """
+        file_obj = request.FILES.get('file')
+        if not file_obj:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        batches = []
+        try:
+            result = import_catalog(
+                file_obj,
+                detect_format(file_obj.name),
+                user=request.user,
+                location=request.data.get('location') or None,
+                progress=batches.append,
+                filename=file_obj.name,
+            )
+        except ImportFileError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**result, 'batches': batches})
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can adjust, Staff can view
+    modified_field = 'updatedAt'  # Stock operations stamp it too, including bulk decrements
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        """Record manual quantity changes in the stock ledger"""
+        # Lock the row and save over its current values, so a sale committed
+        # since the instance was read is neither overwritten nor left out of the delta
+        serializer.instance = Inventory.objects.select_for_update().get(pk=serializer.instance.pk)
+        previous_quantity = serializer.instance.quantity
+        inventory = serializer.save()
+        
+        change = inventory.quantity - previous_quantity
+        if change:
+            record_movement(inventory, 'Adjustment', change, reference='Manual adjustment', user=self.request.user)
+    
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
+        """
+        Ledger quantity of an inventory row as of a point in time
+        GET /api/inventory/{id}/balance/?at=2025-01-31T23:59:59+07:00
+        """
+        inventory = self.get_object()
+        
+        at = None
+        if request.query_params.get('at'):
+            at = parse_datetime(request.query_params['at'])
+            if at is None:
+                return Response({'error': 'Invalid "at" timestamp, use ISO 8601'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        at = at or timezone.now()
+        
+        return Response({
+            'inventoryId': inventory.inventoryId,
+            'at': at.isoformat(),
+            'quantity': balance_as_of(inventory.inventoryId, at)
+        })
+    
+    def low_stock_queryset(self):
+        queryset = Inventory.objects.filter(LOW_STOCK)
+        location = self.request.query_params.get('location')
+        if location:
+            queryset = queryset.filter(location=location)
+        return queryset
+    
+    @action(detail=False, methods=['get'], url_path='low-stock')
+    def low_stock(self, request):
+        """
+        Inventory rows at or below their reorder level, with product details
+        GET /api/inventory/low-stock/?location=Shop&page_size=100
+        """
+        paginator = LowStockPagination()
+        page = paginator.paginate_queryset(self.low_stock_queryset().select_related('product'), request, view=self)
+        return paginator.get_paginated_response(LowStockSerializer(page, many=True).data)
+    
+    @action(detail=False, methods=['get'], url_path='low-stock/count')
+    def low_stock_count(self, request):
+        """
+        Number of low-stock rows, for dashboard badges
+        GET /api/inventory/low-stock/count/
+        """
+        return Response({'count': self.low_stock_queryset().count()})
 
 class NewStockViewSet(viewsets.ModelViewSet):
-    queryset = NewStock.objects.all()
+    # NewStockSerializer reads product, supplier and user names for every row
+    queryset = NewStock.objects.select_related('inventory__product', 'supplier', 'addedByUser')
     serializer_class = NewStockSerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can add stock, Staff can view
     
@@ -150,65 +410,122 @@ class NewStockViewSet(viewsets.ModelViewSet):
         if new_stock_quantity is None or new_stock_quantity <= 0:
             raise ValidationError({"quantity": "Stock quantity must be a positive number"})
         
-        # Update inventory quantity
-        inventory_item.quantity += new_stock_quantity
-        inventory_item.save(update_fields=['quantity', 'updatedAt'])
+        # Increment in the database, like sales decrement it, so concurrent sales aren't overwritten
+        Inventory.objects.filter(pk=inventory_item.pk).update(
+            quantity=F('quantity') + new_stock_quantity,
+            updatedAt=timezone.now(),
+        )
         
         # Save the new stock record
-        serializer.save()
+        new_stock = serializer.save()
+        record_movement(
+            inventory_item,
+            'Receipt',
+            new_stock_quantity,
+            reference=f"NewStock #{new_stock.newstockId}",
+            user=self.request.user
+        )
 
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can manage customers, Staff can view
-    
-    def create(self, request, *args, **kwargs):
-        """Override create to add detailed error logging"""
-        print(f"[Customer Create] Received data: {request.data}")
-        serializer = self.get_serializer(data=request.data)
-        if not serializer.is_valid():
-            print(f"[Customer Create] Validation errors: {serializer.errors}")
-        return super().create(request, *args, **kwargs)
 
 class InvoiceViewSet(viewsets.ModelViewSet):
-    queryset = Invoice.objects.all()
+    # InvoiceSerializer nests purchases (with product names) and the creator's username
+    queryset = Invoice.objects.select_related('createdByUser').prefetch_related(
+        Prefetch(
+            'purchases',
+            queryset=Purchase.objects.select_related('product').only(
+                'purchaseId', 'invoice', 'product', 'quantity', 'pricePerUnit',
+                'discount', 'subtotal', 'product__productName'
+            )
+        )
+    )
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can create/manage invoices, Staff can view
+    pagination_class = InvoicePagination
     
     def perform_create(self, serializer):
         """Automatically set the createdByUser to the current user"""
         invoice = serializer.save(createdByUser=self.request.user)
         
-        # Auto-generate KHQR QR code if payment method is KHQR
+        # Generate the KHQR QR code in the background so the sale doesn't wait on Bakong
         if invoice.paymentMethod == 'KHQR' and invoice.status == 'Pending':
-            try:
-                khqr_service = KHQRService()
-                qr_data = khqr_service.generate_qr_code(
-                    invoice_id=invoice.invoiceId,
-                    amount=invoice.grandTotal,
-                    currency='USD'  # You can make this dynamic based on your needs
-                )
-                
-                if qr_data:
-                    invoice.khqrCodeString = qr_data['qr_string']
-                    invoice.khqrMd5 = qr_data['md5_hash']
-                    
-                    # Generate deeplink
-                    deeplink = khqr_service.generate_deeplink(qr_data['qr_string'])
-                    if deeplink:
-                        invoice.khqrDeeplink = deeplink
-                    
-                    invoice.save()
-            except Exception as e:
-                # Log error but don't fail invoice creation
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Failed to generate KHQR for invoice #{invoice.invoiceId}: {str(e)}")
+            schedule_invoice_qr(invoice)
     
     def perform_update(self, serializer):
         """Update invoice - transaction creation handled by signals"""
         serializer.save()
     
+    def get_renderers(self):
+        if self.action == 'khqr_image':
+            return [JSONRenderer(), PNGRenderer(), SVGRenderer()]
+        if self.action == 'pdf':
+            return [JSONRenderer(), PDFRenderer()]
+        return super().get_renderers()
+    
+    @action(detail=True, methods=['get'])
+    def pdf(self, request, pk=None):
+        """
+        Printable invoice with its lines and the issuer's business details
+        GET /api/invoices/{id}/pdf/
+        Stored per content version; paid invoices are rendered only once.
+        """
+        invoice = get_object_or_404(Invoice.objects.only('invoiceId', 'status'), pk=pk)
+        self.check_object_permissions(request, invoice)
+        
+        document = None
+        if invoice.status == 'Paid':
+            version = pdf_version(invoice.status)  # Final; no need to load the lines to know the version
+        else:
+            document = invoice_document(invoice.invoiceId)
+            version = pdf_version(document['status'], document)
+        
+        etag = pdf_etag(invoice.invoiceId, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content = load_pdf(invoice.invoiceId, version)
+            if content is None:
+                content = store_pdf(document or invoice_document(invoice.invoiceId), version)
+            response = HttpResponse(content, content_type='application/pdf')
+            response['Content-Disposition'] = f'inline; filename="invoice-{invoice.invoiceId}.pdf"'
+        response['ETag'] = etag
+        # A paid invoice can still be cancelled, so clients revalidate (a cheap 304)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    def khqr_image(self, request, pk=None, fmt='png'):
+        """
+        Server-rendered KHQR QR code, stored once per QR and cacheable forever
+        GET /api/invoices/{id}/khqr.png
+        GET /api/invoices/{id}/khqr.svg
+        """
+        invoice = get_object_or_404(Invoice.objects.only('invoiceId', 'khqrMd5', 'khqrCodeString'), pk=pk)
+        self.check_object_permissions(request, invoice)
+        
+        if not (invoice.khqrMd5 and invoice.khqrCodeString):
+            try:
+                wait_for_invoice_qr(invoice.invoiceId, timeout=settings.KHQR_QR_WAIT_TIMEOUT)
+            except TimeoutError:
+                return Response(
+                    {'error': 'QR code is still being generated, retry shortly'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': '1'}
+                )
+            invoice.refresh_from_db(fields=['khqrMd5', 'khqrCodeString'])
+            if not (invoice.khqrMd5 and invoice.khqrCodeString):
+                return Response({'error': 'No KHQR payment associated with this invoice'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = image_etag(invoice.khqrMd5, fmt)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content = load_image(invoice.khqrMd5, fmt) or store_image(invoice.khqrMd5, invoice.khqrCodeString, fmt)
+            response = HttpResponse(content, content_type=IMAGE_CONTENT_TYPES[fmt])
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+    
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def generate_khqr(self, request, pk=None):
         """
@@ -223,6 +540,18 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # The QR code may still be generating in the background since the invoice was created
+        if not (invoice.khqrCodeString and invoice.khqrMd5):
+            try:
+                wait_for_invoice_qr(invoice.invoiceId, timeout=settings.KHQR_QR_WAIT_TIMEOUT)
+            except TimeoutError:
+                return Response(
+                    {'success': False, 'pending': True, 'message': 'QR code is still being generated, retry shortly'},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Retry-After': '1'}
+                )
+            invoice.refresh_from_db(fields=['khqrCodeString', 'khqrMd5', 'khqrDeeplink'])
+        
         # If QR code already exists, return it instead of regenerating
         if invoice.khqrCodeString and invoice.khqrMd5:
             logger.info(f"Using existing QR code for invoice #{invoice.invoiceId}")
@@ -236,7 +565,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             })
         
         try:
-            khqr_service = KHQRService()
+            khqr_service = get_khqr_service()
             
             # Validate configuration
             if not khqr_service.bakong_account_id:
@@ -248,14 +577,11 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             
             logger.info(f"Generating NEW KHQR for invoice #{invoice.invoiceId}, amount: {invoice.grandTotal}")
             
-            # Convert USD to KHR if needed (1 USD ≈ 4000 KHR)
-            # Bakong typically uses KHR currency
-            amount_khr = float(invoice.grandTotal) * 4000
-            
+            # Same amount and currency as the background generation
             qr_data = khqr_service.generate_qr_code(
                 invoice_id=invoice.invoiceId,
-                amount=amount_khr,
-                currency='KHR'
+                amount=invoice.grandTotal,
+                currency=KHQR_CURRENCY
             )
             
             if not qr_data:
@@ -265,25 +591,25 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
             
-            # Update invoice with QR data (ONLY ONCE!)
-            invoice.khqrCodeString = qr_data['qr_string']
-            invoice.khqrMd5 = qr_data['md5_hash']
-            invoice.paymentMethod = 'KHQR'
-            
             # Generate deeplink (optional, may fail if no access token)
             deeplink = khqr_service.generate_deeplink(qr_data['qr_string'])
-            if deeplink:
-                invoice.khqrDeeplink = deeplink
-            
-            invoice.save()
             
-            logger.info(f"Successfully generated KHQR for invoice #{invoice.invoiceId}")
+            # The background job (possibly on another worker process) may have
+            # stored a QR code meanwhile; only the first one is kept, return that
+            if store_invoice_qr(invoice.invoiceId, qr_data, deeplink):
+                logger.info(f"Successfully generated KHQR for invoice #{invoice.invoiceId}")
+            invoice.refresh_from_db(fields=['status', 'paymentMethod', 'khqrCodeString', 'khqrMd5', 'khqrDeeplink'])
+            if not invoice.khqrMd5:
+                return Response(
+                    {'error': 'QR code can only be generated for pending invoices'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             return Response({
                 'success': True,
-                'qr_string': qr_data['qr_string'],
-                'md5_hash': qr_data['md5_hash'],
-                'deeplink': deeplink,
+                'qr_string': invoice.khqrCodeString,
+                'md5_hash': invoice.khqrMd5,
+                'deeplink': invoice.khqrDeeplink or '',
                 'amount': float(invoice.grandTotal),
                 'invoice_id': invoice.invoiceId
             })
@@ -311,8 +637,12 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # The poll_khqr_payments worker confirms payments; just report local state
+        if settings.KHQR_BACKGROUND_POLLING:
+            return Response(payment_status(invoice))
+        
         try:
-            khqr_service = KHQRService()
+            khqr_service = get_khqr_service()
             
             # Check if KHQR service is properly configured
             if not khqr_service.get_access_token():
@@ -331,57 +661,15 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             transaction_data = khqr_service.check_transaction_by_md5(invoice.khqrMd5)
             logger.info(f"KHQR API response: {transaction_data}")
             
-            # Update last checked timestamp
-            invoice.khqrLastCheckedAt = timezone.now()
-            
-            if transaction_data:
-                # Payment successful!
-                invoice.status = 'Paid'
-                
-                # Use payment timestamp from Bakong (in milliseconds)
-                # createdDateMs: Transaction creation timestamp
-                # acknowledgedDateMs: Transaction acknowledged timestamp
-                payment_timestamp_ms = transaction_data.get('acknowledgedDateMs') or transaction_data.get('createdDateMs')
-                
-                if payment_timestamp_ms:
-                    try:
-                        # Convert milliseconds to seconds for datetime
-                        from datetime import datetime
-                        invoice.paidAt = datetime.fromtimestamp(payment_timestamp_ms / 1000)
-                    except Exception as e:
-                        logger.error(f"Error parsing timestamp {payment_timestamp_ms}: {e}")
-                        invoice.paidAt = timezone.now()
-                else:
-                    invoice.paidAt = timezone.now()
-                
-                invoice.khqrTransactionHash = transaction_data.get('hash', '')
-                invoice.khqrShortHash = transaction_data.get('hash', '')[:8] if transaction_data.get('hash') else ''
-                invoice.khqrPaymentData = transaction_data
-                invoice.save()
-                
-                logger.info(f"Payment confirmed for invoice #{invoice.invoiceId} at {invoice.paidAt}")
-                logger.info(f"Transaction details: {transaction_data}")
-                
-                return Response({
-                    'success': True,
-                    'paid': True,
-                    'payment_timestamp': invoice.paidAt.isoformat() if invoice.paidAt else None,
-                    'transaction_hash': invoice.khqrTransactionHash,
-                    'from_account': transaction_data.get('fromAccountId'),
-                    'amount': transaction_data.get('amount'),
-                    'currency': transaction_data.get('currency'),
-                    'payment_data': transaction_data,
-                    'invoice_status': invoice.status
-                })
-            else:
-                # Payment not found yet
-                invoice.save()
-                return Response({
-                    'success': True,
-                    'paid': False,
-                    'message': 'Payment not found yet',
-                    'invoice_status': invoice.status
-                })
+            # Written like the poller's results: confirmation re-checks that the
+            # invoice is still Pending under a row lock, so a payment confirmed
+            # meanwhile by the poller or batch check isn't recorded twice, and
+            # nothing else on the (possibly stale) instance is saved
+            paid = {invoice: transaction_data} if transaction_data else {}
+            if mark_invoices_paid(paid, [invoice.pk]):
+                logger.info(f"Payment confirmed for invoice #{invoice.invoiceId}")
+            invoice.refresh_from_db()
+            return Response(payment_status(invoice))
         except Exception as e:
             logger.error(f"Error checking payment: {str(e)}")
             import traceback
@@ -406,13 +694,14 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         - You've verified payment in your Bakong app manually
         """
         invoice = self.get_object()
+        already_paid = Response({
+            'success': True,
+            'message': 'Invoice is already marked as paid',
+            'invoice_status': 'Paid'
+        })
         
         if invoice.status == 'Paid':
-            return Response({
-                'success': True,
-                'message': 'Invoice is already marked as paid',
-                'invoice_status': invoice.status
-            })
+            return already_paid
         
         if invoice.paymentMethod != 'KHQR':
             return Response(
@@ -420,10 +709,18 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Mark as paid with current timestamp
-        invoice.status = 'Paid'
-        invoice.paidAt = timezone.now()
-        invoice.save()
+        with transaction.atomic():
+            # Re-read under a row lock: the poller or check_payment may have confirmed
+            # the invoice since get_object(), and saving the stale instance would run
+            # the Paid transition (paidAt, sales summary) a second time
+            invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+            if invoice.status == 'Paid':
+                return already_paid
+            
+            # Mark as paid with current timestamp
+            invoice.status = 'Paid'
+            invoice.paidAt = timezone.now()
+            invoice.save(update_fields=['status', 'paidAt'])
         
         logger.info(f"Invoice #{invoice.invoiceId} manually marked as paid by {request.user.username}")
         
@@ -441,14 +738,12 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         Batch check payment status for multiple pending KHQR invoices
         POST /api/invoices/batch_check_payments/
         """
-        # Get all pending KHQR invoices with MD5 hashes
-        pending_invoices = Invoice.objects.filter(
-            status='Pending',
-            paymentMethod='KHQR',
-            khqrMd5__isnull=False
-        ).exclude(khqrMd5='')
+        # Get all pending KHQR invoices with MD5 hashes (only the columns needed)
+        pending_invoices = list(
+            pending_khqr_invoices().order_by('invoiceId').only('invoiceId', 'khqrMd5', 'createdByUser', 'status')
+        )
         
-        if not pending_invoices.exists():
+        if not pending_invoices:
             return Response({
                 'success': True,
                 'message': 'No pending KHQR invoices to check',
@@ -457,55 +752,50 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             })
         
         try:
-            khqr_service = KHQRService()
-            md5_list = [inv.khqrMd5 for inv in pending_invoices]
+            khqr_service = get_khqr_service()
             
-            # Batch check transactions
-            results = khqr_service.batch_check_transactions_by_md5(md5_list)
+            # Check in chunks of 50 (the Bakong limit), matching results by MD5 in memory
+            paid = {}
+            checked_ids = []
+            chunks = []
+            for index, chunk in enumerate(chunked(pending_invoices, BAKONG_BATCH_SIZE)):
+                started = time.monotonic()
+                chunk_paid = check_invoices(chunk, khqr_service)
+                chunk_report = {
+                    'chunk': index,
+                    'size': len(chunk),
+                    'duration_ms': round((time.monotonic() - started) * 1000, 1),
+                    'ok': chunk_paid is not None,
+                    'paid': len(chunk_paid or {})
+                }
+                chunks.append(chunk_report)
+                
+                if chunk_paid is None:
+                    logger.error(f"Batch check failed for chunk {index} ({len(chunk)} invoices)")
+                    continue
+                paid.update(chunk_paid)
+                checked_ids.extend(invoice.invoiceId for invoice in chunk)
             
-            if not results:
+            if not checked_ids:
                 return Response(
-                    {'error': 'Batch check failed'},
+                    {'error': 'Batch check failed', 'chunks': chunks},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
             
-            # Process results
-            paid_count = 0
-            updated_invoices = []
-            
-            for result in results:
-                md5_hash = result.get('md5')
-                result_status = result.get('status')
-                transaction_data = result.get('data')
-                
-                # Find invoice by MD5
-                try:
-                    invoice = pending_invoices.get(khqrMd5=md5_hash)
-                    invoice.khqrLastCheckedAt = timezone.now()
-                    
-                    if result_status == 'SUCCESS' and transaction_data:
-                        # Mark as paid
-                        invoice.status = 'Paid'
-                        invoice.paidAt = timezone.now()
-                        invoice.khqrTransactionHash = transaction_data.get('hash', '')
-                        invoice.khqrShortHash = transaction_data.get('hash', '')[:8]
-                        invoice.khqrPaymentData = transaction_data
-                        paid_count += 1
-                        updated_invoices.append(invoice.invoiceId)
-                    
-                    invoice.save()
-                except Invoice.DoesNotExist:
-                    continue
+            # Persist everything with bulk updates and one aggregated log entry
+            started = time.monotonic()
+            updated_invoices = mark_invoices_paid(paid, checked_ids, source='KHQR batch check')
+            persist_ms = round((time.monotonic() - started) * 1000, 1)
             
             return Response({
                 'success': True,
-                'checked': len(md5_list),
-                'paid': paid_count,
-                'updated_invoices': updated_invoices
+                'checked': len(checked_ids),
+                'paid': len(updated_invoices),
+                'updated_invoices': updated_invoices,
+                'chunks': chunks,
+                'persist_ms': persist_ms
             })
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error in batch payment check: {str(e)}")
             return Response(
                 {'error': f'Batch check failed: {str(e)}'},
@@ -521,8 +811,30 @@ class TransactionViewSet(viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated, IsManagerOrReadOnly] # Managers/Admins can manage transactions, Staff can view
+    pagination_class = TransactionPagination
 
 class ActivityLogViewSet(viewsets.ModelViewSet):
-    queryset = ActivityLog.objects.all()
+    # Only the username is needed from the joined user row
+    queryset = ActivityLog.objects.select_related('user').only(
+        'logId', 'user', 'actionType', 'description', 'createdAt', 'user__username'
+    )
     serializer_class = ActivityLogSerializer
-    permission_classes = [IsAuthenticated, IsAdminOrManager] # Only Managers/Admins should view activity logs
\ No newline at end of file
+    permission_classes = [IsAuthenticated, IsAdminOrManager] # Only Managers/Admins should view activity logs
+    pagination_class = ActivityLogPagination
+
+class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
+    # The ledger is append-only: movements are written by stock operations, never through the API
+    queryset = StockMovement.objects.all()
+    serializer_class = StockMovementSerializer
+    permission_classes = [IsAuthenticated, IsManagerOrReadOnly]
+    pagination_class = StockMovementPagination
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        inventory_id = self.request.query_params.get('inventory')
+        if inventory_id:
+            try:
+                queryset = queryset.filter(inventory_id=int(inventory_id))
+            except ValueError:
+                raise ValidationError({'inventory': 'Must be an id'})
+        return queryset
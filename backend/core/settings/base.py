@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Full-text and trigram product search
     'rest_framework',
     'rest_framework.authtoken',
     'api',
@@ -38,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ActivityLogBatchMiddleware',  # Batch activity log writes per request
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -71,6 +73,31 @@ DATABASES = {
     }
 }
 
+# Shared cache for all workers (catalog responses, see api/catalog_cache.py).
+# Without REDIS_URL each process has its own in-memory cache, which only
+# invalidates correctly with a single worker.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'inventory',
+        }
+    }
+
+# Off by default with the per-process cache: other workers would keep serving
+# (and answering 304 for) stale catalog responses after a write
+CATALOG_CACHE_ENABLED = os.environ.get('CATALOG_CACHE_ENABLED', str(bool(REDIS_URL))) == 'True'
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', '3600'))  # Entries are invalidated by version anyway
+CATALOG_CACHE_LOCK_TIMEOUT = float(os.environ.get('CATALOG_CACHE_LOCK_TIMEOUT', '5'))
+
 AUTH_USER_MODEL = 'api.User'
 
 # Password validation
@@ -95,6 +122,18 @@ TIME_ZONE = 'Asia/Phnom_Penh'
 USE_I18N = True
 USE_TZ = True
 
+# Local day boundaries for sales reports and the daily sales summary
+REPORT_TIME_ZONE = os.environ.get('REPORT_TIME_ZONE', TIME_ZONE)
+
+# TTF used for invoice PDFs; needs Khmer glyphs to print Khmer names (default: Helvetica)
+INVOICE_PDF_FONT = os.environ.get('INVOICE_PDF_FONT', '')
+
+# Delta sync (/api/sync/): how far before the cursor each sync re-reads, to
+# catch rows committed late by transactions that were open when it was taken,
+# and how long deletions are remembered (older cursors get a full resync)
+SYNC_CURSOR_OVERLAP = int(os.environ.get('SYNC_CURSOR_OVERLAP', '30'))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '30'))
+
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
@@ -104,6 +143,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded product images are re-encoded to WebP at this quality (0-100), by
+# this many background threads
+PRODUCT_IMAGE_QUALITY = int(os.environ.get('PRODUCT_IMAGE_QUALITY', '80'))
+PRODUCT_IMAGE_WORKERS = int(os.environ.get('PRODUCT_IMAGE_WORKERS', '2'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -127,3 +171,31 @@ KHQR_MERCHANT_CITY = os.environ.get('KHQR_MERCHANT_CITY', 'Phnom Penh')
 KHQR_APP_ICON_URL = os.environ.get('KHQR_APP_ICON_URL', '')
 KHQR_APP_NAME = os.environ.get('KHQR_APP_NAME', 'Inventory System')
 KHQR_APP_DEEPLINK_CALLBACK = os.environ.get('KHQR_APP_DEEPLINK_CALLBACK', '')
+
+# Bakong HTTP client: pooled keep-alive connections, timeouts and retries
+KHQR_POOL_MAXSIZE = int(os.environ.get('KHQR_POOL_MAXSIZE', '20'))
+KHQR_CONNECT_TIMEOUT = float(os.environ.get('KHQR_CONNECT_TIMEOUT', '3.05'))
+KHQR_TIMEOUTS = {  # Read timeout in seconds per Bakong endpoint
+    'check_transaction_by_md5': float(os.environ.get('KHQR_CHECK_TIMEOUT', '5')),
+    'check_transaction_by_md5_list': float(os.environ.get('KHQR_BATCH_CHECK_TIMEOUT', '15')),
+}
+KHQR_MAX_RETRIES = int(os.environ.get('KHQR_MAX_RETRIES', '2'))  # Only for read-only checks
+KHQR_RETRY_BACKOFF = float(os.environ.get('KHQR_RETRY_BACKOFF', '0.25'))
+KHQR_ASYNC_POOL_MAXSIZE = int(os.environ.get('KHQR_ASYNC_POOL_MAXSIZE', '200'))
+
+# Invoice QR codes are generated by background threads after the invoice is
+# created; generate_khqr waits this long for a running generation
+KHQR_QR_WORKERS = int(os.environ.get('KHQR_QR_WORKERS', '2'))
+KHQR_QR_WAIT_TIMEOUT = float(os.environ.get('KHQR_QR_WAIT_TIMEOUT', '5'))
+
+# Serve generate_khqr / check_payment / batch_check_payments from the native
+# async views in api/async_views.py. Only useful when running under ASGI.
+KHQR_ASYNC_VIEWS = os.environ.get('KHQR_ASYNC_VIEWS', 'False') == 'True'
+
+# When True, payments are confirmed by `manage.py poll_khqr_payments` and
+# check_payment only reads the invoice's local status (run the worker!)
+KHQR_BACKGROUND_POLLING = os.environ.get('KHQR_BACKGROUND_POLLING', 'False') == 'True'
+
+# Activity logging
+ACTIVITY_LOG_BATCH_SIZE = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', '500'))
+ACTIVITY_LOG_BACKGROUND = os.environ.get('ACTIVITY_LOG_BACKGROUND', 'False') == 'True'  # Write logs from a background thread